@@ -0,0 +1,84 @@
+# A Python API for running Cadmium commands from scripts.
+#
+# Prepare parses a sequence of commands once. The returned Statement can then
+# be executed any number of times, with different values of the $params used
+# in the commands, against a dict of tables (which the commands modify in
+# place, as in the interactive tool):
+#
+#   load = api.Prepare('LOAD raw FROM "okreg_" + $index + ".csv";')
+#   tables = {}
+#   for index in range(1, 101):
+#     load.Execute(tables, index=str(index))
+#
+# The tables are (header, rows) pairs, as described in context.md (the
+# returned ones are tabular.Tables, which unpack like pairs). Records turns one
+# into a list of dicts, keyed by column names.
+
+import command
+import expression
+import prune
+import sql
+import tabular
+import view
+
+# Adds the names of the $params read by the parsed commands (or expressions)
+# in node to names. A $ can also name a column (like in the group keys of
+# AGGREGATE), so only the params read by the expressions are added.
+def AddParams(node, names, seen):
+  if id(node) in seen:
+    return
+  seen.add(id(node))
+  if isinstance(node, expression.ParamExpr):
+    names.add(node.arg.Eval({}))
+  if isinstance(node, dict):
+    children = list(node.keys()) + list(node.values())
+  elif isinstance(node, (list, tuple, set)):
+    children = node
+  elif isinstance(node, (command.Command, command.Sequence,
+                         command.SingleExpression, command.RangeExpression,
+                         expression.Expression)):
+    children = vars(node).values()
+  else:
+    return
+  for child in children:
+    AddParams(child, names, seen)
+
+class Statement:
+  def __init__(self, lines):
+    self.comm = sql.GetCommandList(lines)
+    # The names of the $params used in the commands, all of which need to be
+    # given values when executing.
+    names = set()
+    AddParams(self.comm, names, set())
+    self.params = sorted(names)
+    # The lines output by the last execution (by LIST, DESCRIBE, and so on).
+    self.output = []
+
+  # Runs the commands, with the params given either as a dict, or as keyword
+  # arguments. Returns the tables (with lists of rows, see view.py).
+  def Execute(self, tables=None, params=None, **kwargs):
+    if tables is None:
+      tables = {}
+    params = dict(params or {}, **kwargs)
+    missing = [name for name in self.params if name not in params]
+    if missing:
+      raise ValueError('No values given for params: {}'.format(
+          ', '.join(missing)))
+    self.output = prune.Eval(self.comm, params, tables)
+    for name, table in tables.items():
+      header, rows = table
+      tables[name] = tabular.Table(header, view.Rows(rows),
+                                   tabular.Uniform(table))
+    return tables
+
+# Parses the commands, given as a string, or a list of lines (as in a config
+# file).
+def Prepare(commands):
+  if isinstance(commands, str):
+    commands = [commands]
+  return Statement(commands)
+
+def Records(table):
+  header, rows = table
+  names = sorted(header, key=header.get)
+  return [dict(zip(names, row)) for row in rows]
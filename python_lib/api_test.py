@@ -0,0 +1,70 @@
+import os
+import tempfile
+import unittest
+
+import api
+
+class TestApi(unittest.TestCase):
+  def test_execute_many_times(self):
+    stmt = api.Prepare([
+      'EMPTY AS t;',
+      'TRANSFORM t WITH 1 AS district, 1 AS votes;',
+      'APPEND $district, int($votes) * 2 TO t;',
+      'TRANSFORM t TO "result" + $district WITH district AS district, '
+      '  votes AS votes;',
+      'DROP t;'])
+    self.assertEqual(['district', 'votes'], stmt.params)
+    tables = {}
+    for district in ['1', '2', '3']:
+      stmt.Execute(tables, district=district, votes='10')
+    self.assertEqual(['result1', 'result2', 'result3'], sorted(tables))
+    self.assertEqual([{'district': '2', 'votes': 20}],
+                     api.Records(tables['result2']))
+
+  def test_params_as_dict(self):
+    tables = api.Prepare('EMPTY AS t; TRANSFORM t WITH 1 AS x; '
+                         'APPEND $x TO t;').Execute(params={'x': 'a'})
+    self.assertEqual(({'x': 0}, [['a']]), tables['t'])
+
+  def test_group_key_columns(self):
+    # $1 in the group keys is the first column, not a param.
+    stmt = api.Prepare('EMPTY AS t; TRANSFORM t WITH 1 AS a, 2 AS b; '
+                       'APPEND 1, 2 TO t; APPEND 1, $x TO t; '
+                       'AGGREGATE t TO u BY $1 WITH a AS a, sum(b) AS s;')
+    self.assertEqual(['x'], stmt.params)
+    self.assertEqual(({'a': 0, 's': 1}, [[1, 5]]),
+                     stmt.Execute(x=3)['u'])
+
+  def test_missing_params(self):
+    stmt = api.Prepare('EMPTY AS t; TRANSFORM t WITH $a AS x, $b AS y;')
+    with self.assertRaises(ValueError) as e:
+      stmt.Execute(a='1')
+    self.assertIn('b', str(e.exception))
+
+  def test_loaded_tables(self):
+    # The rows are filtered while loading, and the tables left have all
+    # their columns.
+    with tempfile.TemporaryDirectory() as d:
+      path = os.path.join(d, 'okreg.csv')
+      with open(path, 'w') as f:
+        f.write('teryt;community;votes\n1;a;10\n;"Dzielnice";20\n')
+      stmt = api.Prepare([
+          'LOAD raw FROM $path;',
+          'TRANSFORM raw WITH at(2) AS community, int(votes) AS votes;',
+          """FILTER raw BY not(startswith(community, '"Dzielnice'));""",
+          'TRANSFORM raw TO "result" + $index WITH community AS community,',
+          '  votes * int($index) AS votes;',
+          'DROP raw;'])
+      tables = {}
+      for index in ['1', '2']:
+        stmt.Execute(tables, path=path, index=index)
+    self.assertEqual([{'community': 'a', 'votes': 20}],
+                     api.Records(tables['result2']))
+
+  def test_output(self):
+    stmt = api.Prepare('EMPTY AS t; LIST TABLES;')
+    stmt.Execute()
+    self.assertTrue(any('t' in line for line in stmt.output))
+
+if __name__ == '__main__':
+  unittest.main()
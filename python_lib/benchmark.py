@@ -0,0 +1,229 @@
+# Usage: python3 benchmark.py [BENCHMARK_NAME]*
+#
+# Runs Cadmium micro-benchmarks, and prints the timings to stdout. With no
+# arguments, runs all of them.
+
+import os
+import random
+import subprocess
+import sys
+import time
+
+import columnar
+import compiler
+import sql
+import tokenizer
+
+def Timed(f, *args):
+  start = time.perf_counter()
+  res = f(*args)
+  return time.perf_counter() - start, res
+
+# A synthetic config of roughly the shape we have in data/: a LOAD, and then
+# a mix of multi-line TRANSFORMs, AGGREGATEs and JOINs.
+def GeneratedConfig(commands):
+  lines = ['# Generated config for the parse benchmark.',
+           'LOAD raw FROM "raw.csv";']
+  for i in range(commands):
+    if i % 3 == 0:
+      lines.extend([
+        'TRANSFORM raw TO t{} WITH'.format(i),
+        '  if(at(1) = \'\', \'149901\', at(1)) AS teryt,',
+        '  substr(county, 0, 4) + "_" + voivodship AS key,',
+        '  int(votes) * 100 / (int(eligible) + 1) AS attendance,',
+        '  if(curr() = \'\', 0, int(curr())) FOR [index("district") + 1:]',
+        ';'])
+    elif i % 3 == 1:
+      lines.extend([
+        'AGGREGATE t{} TO a{} BY teryt, key WITH'.format(i - 1, i),
+        '  teryt AS teryt, sum(attendance) AS attendance,',
+        '  sum(curr()) FOR 4: AS currname() + "_total";'])
+    else:
+      lines.extend([
+        'JOIN a{} INTO t{} ON teryt PREFIX teryt'.format(i - 1, i - 2),
+        '  WITH INSERT UNMATCHED VALUES AS j{};'.format(i),
+        'DROP t{};'.format(i - 2)])
+  return lines
+
+def ParseThroughput(lines):
+  tokenize_time, tokens = Timed(tokenizer.tokenize, lines)
+  token_count = len(tokens)
+  parse_time, _ = Timed(sql.GetCommandList, lines)
+  print('  {} lines, {} tokens: tokenize {:.3f}s, tokenize+parse {:.3f}s, '
+        '{:.0f} tokens/s'.format(len(lines), token_count, tokenize_time,
+                                 parse_time, token_count / parse_time))
+  return parse_time
+
+def ParseBenchmark():
+  print('Parsing generated configs:')
+  small = ParseThroughput(GeneratedConfig(3000))
+  large = ParseThroughput(GeneratedConfig(6000))
+  print('  Doubling the config size multiplies parse time by {:.2f}'.format(
+      large / small))
+  print('Parsing a single long line (as passed to cadmium.py):')
+  short = ParseThroughput([' '.join(GeneratedConfig(500)[1:])])
+  long = ParseThroughput([' '.join(GeneratedConfig(1000)[1:])])
+  print('  Doubling the line length multiplies parse time by {:.2f}'.format(
+      long / short))
+
+# A commune-level table: 2500 rows, an id, a district, and 40 party columns
+# (with their countrywide totals and thresholds, as in apply_threshold.cfg).
+def GeneratedTable(rows=2500, parties=40):
+  header = {'teryt': 0, 'district': 1}
+  for kind in ['', '_total', '_thr']:
+    for p in range(parties):
+      header['party{}{}'.format(p, kind)] = len(header)
+  table = []
+  for r in range(rows):
+    row = [str(100000 + r), str(r % 41 + 1)]
+    row.extend([(r * 7 + p * 13) % 1000 for p in range(parties)])
+    row.extend([400000 + p * 1000 for p in range(parties)])
+    row.extend([5] * parties)
+    table.append(row)
+  return header, table
+
+TRANSFORMS = [
+  ('threshold',
+   'TRANSFORM votes TO res WITH district AS district, '
+   'if(at(currname() + "_total") * 100 < at(currname() + "_thr") * 450000, '
+   '0, curr()) FOR [index("district") + 1:index("party0_total")];'),
+  ('arithmetic',
+   'TRANSFORM votes TO res WITH teryt AS teryt, '
+   'int(teryt) * 2 + int(district) - 1 AS a, '
+   'if(party0 > party1, party0 - party1, party1 - party0) * 100 / '
+   '(party0 + party1 + 1) AS b, curr() * 2 + 1 FOR 3:43;'),
+  ('shared',
+   'TRANSFORM votes TO res WITH district AS district, '
+   'sum_range(3:43) AS total, party0 * 100 / sum_range(3:43) AS share0, '
+   'party1 * 100 / sum_range(3:43) AS share1, '
+   'party0 + party1 + party2 - party3 + party4 / 3 AS real, '
+   'party6 / (party0 + party1 + party2 - party3 + party4 / 3) AS ratio;'),
+  ('filter',
+   'FILTER votes TO res BY and(party3 * 4 > party4 + party5, '
+   'int(district) < 20);'),
+  ('aggregate',
+   'AGGREGATE votes TO res BY district WITH district AS district, '
+   'sum(curr()) FOR 3:43, sum(party0 * 100 / party0_total) AS share0;'),
+  ('pipeline',
+   'TRANSFORM votes TO a WITH district AS district, party0 + party1 AS p01, '
+   'curr() FOR 5:43; '
+   'FILTER a TO b BY p01 > party2; '
+   'TRANSFORM b TO res WITH district AS district, p01 - party2 AS diff; '
+   'DROP a; DROP b;'),
+]
+
+def TransformBenchmark():
+  header, rows = GeneratedTable()
+  print('Evaluating expressions over {} rows, {} columns:'.format(
+      len(rows), len(header)))
+  for name, config in TRANSFORMS:
+    comm = sql.GetCommandList([config])
+    times = []
+    for compiled, by_columns in [(False, False), (True, False), (True, True)]:
+      compiler.ENABLED = compiled
+      columnar.ENABLED = by_columns
+      tables = {'votes': (header, rows)}
+      elapsed, _ = Timed(comm.Eval, tables, {})
+      times.append(elapsed)
+    compiler.ENABLED = True
+    print('  {}: tree {:.3f}s, compiled {:.3f}s, columnar {:.3f}s, '
+          'speedup x{:.2f}'.format(name, *times, times[0] / times[2]))
+
+# JOINs communes (by teryt, padded to the given length) into their districts,
+# and voivodships, by the longest prefix. Returns the time per commune.
+def PrefixJoinTime(key_length, communes=20000):
+  voivodships = ['{:02d}'.format(v) for v in range(2, 34, 2)]
+  districts = [v + '{:02d}'.format(d) for v in voivodships for d in range(20)]
+  left = ({'prefix': 0}, [[key] for key in voivodships + districts])
+  right = ({'teryt': 0}, [
+      [(districts[c % len(districts)] + '{:03d}'.format(c % 1000)).ljust(
+          key_length, '0')] for c in range(communes)])
+  comm = sql.GetCommandList(['JOIN districts INTO communes ON prefix PREFIX '
+                             'teryt WITH LONGEST PREFIX AS res;'])
+  elapsed, _ = Timed(comm.Eval, {'districts': left, 'communes': right}, {})
+  return elapsed / communes
+
+# JOINs a table of keys into a table of (every other) keys, returning the
+# time it took. The keys of the left table are sorted, or shuffled.
+def EqualJoinTime(left_rows, right_rows, shuffled):
+  left = [['{:07d}'.format(i), 'a'] for i in range(left_rows)]
+  if shuffled:
+    random.Random(1).shuffle(left)
+  right = [['{:07d}'.format(i * left_rows // right_rows), 'b']
+           for i in range(right_rows)]
+  comm = sql.GetCommandList(['JOIN l INTO r ON k EQ rk AS res;'])
+  tables = {'l': ({'k': 0, 'a': 1}, left), 'r': ({'rk': 0, 'b': 1}, right)}
+  elapsed, _ = Timed(comm.Eval, tables, {})
+  return elapsed
+
+def JoinBenchmark():
+  print('JOIN ... PREFIX of 20000 keys into 336 prefixes of 2 lengths:')
+  times = [(length, PrefixJoinTime(length)) for length in [7, 70, 700]]
+  for length, elapsed in times:
+    print('  keys of length {}: {:.2f}us per key'.format(length, elapsed * 1e6))
+  print('  Keys 100 times longer multiply the time per key by {:.2f}'.format(
+      times[-1][1] / times[0][1]))
+  print('JOIN ... EQ of 200000 rows:')
+  for name, right_rows, shuffled in [
+      ('into 2000 rows (dict of the right keys)', 2000, True),
+      ('into 200000 rows, both sorted (merged)', 200000, False),
+      ('into 200000 rows, shuffled (dict of the left keys)', 200000, True)]:
+    print('  {}: {:.3f}s'.format(
+        name, EqualJoinTime(200000, right_rows, shuffled)))
+
+# The modules every invocation of the command line tools loads, and the
+# budget for importing them. The time depends on the machine, so only the
+# benchmark reports it; startup_test.py checks that the imaging modules
+# aren't loaded.
+STARTUP_MODULES = ['command', 'sql', 'plancache', 'terminal']
+IMPORT_TIME_BUDGET = 0.1
+# The modules only VISUALIZE should load.
+IMAGING_MODULES = ['visualize', 'writing', 'imageio', 'numpy']
+
+# Imports the modules in a fresh interpreter, and returns the time it took
+# (in seconds, as reported by -X importtime) and the names of all the modules
+# loaded.
+def ImportTime(modules):
+  code = 'import sys\n'
+  code += ''.join('import {}\n'.format(m) for m in modules)
+  code += 'print("\\n".join(sys.modules))'
+  res = subprocess.run([sys.executable, '-X', 'importtime', '-c', code],
+                       capture_output=True, text=True, check=True,
+                       cwd=os.path.dirname(os.path.abspath(__file__)))
+  total = 0
+  for line in res.stderr.splitlines():
+    # Lines look like "import time:   self |   cumulative | name", with the
+    # name indented for modules imported by other modules.
+    parts = line.split('|')
+    if len(parts) == 3 and parts[2][1:] in modules:
+      total += int(parts[1])
+  return total / 1e6, res.stdout.split()
+
+def StartupBenchmark():
+  print('Importing {} in a fresh interpreter:'.format(
+      ', '.join(STARTUP_MODULES)))
+  elapsed, loaded = ImportTime(STARTUP_MODULES)
+  print('  {:.3f}s (budget {:.3f}s), imaging modules loaded: {}'.format(
+      elapsed, IMPORT_TIME_BUDGET,
+      ', '.join(m for m in IMAGING_MODULES if m in loaded) or 'none'))
+  elapsed, _ = ImportTime(['visualize'])
+  print('  Importing visualize (on the first VISUALIZE): {:.3f}s'.format(
+      elapsed))
+
+BENCHMARKS = {
+  'parse': ParseBenchmark,
+  'transform': TransformBenchmark,
+  'startup': StartupBenchmark,
+  'join': JoinBenchmark,
+}
+
+if __name__ == '__main__':
+  names = sys.argv[1:] if len(sys.argv) > 1 else list(BENCHMARKS.keys())
+  for name in names:
+    if name not in BENCHMARKS:
+      print('Unknown benchmark {}, known benchmarks are: {}'.format(
+          name, ' '.join(BENCHMARKS.keys())))
+      sys.exit(1)
+  for name in names:
+    print('Running benchmark', name)
+    BENCHMARKS[name]()
@@ -2,6 +2,7 @@
 
 import command
 import os
+import prune
 import sys
 import sql
 import terminal
@@ -12,11 +13,29 @@ def usage():
   print('Usage:')
   print('"python3 cadmium.py" runs the interactive interpreter')
   print('"python3 cadmium.py COMMAND" runs a Cadmium command')
+  print('"python3 cadmium.py --check COMMAND" checks the column names and ' +
+        'types in a Cadmium command (and the files it runs), without ' +
+        'loading any data')
+  print('"python3 cadmium.py --stream COMMAND" runs a Cadmium command, ' +
+        'passing the rows from LOADs to DUMPs one by one, without storing ' +
+        'the tables in between')
   sys.exit(1)
 
-if len(sys.argv) > 1:
+if len(sys.argv) > 2 and sys.argv[1] == '--check':
   try:
-    command = ' '.join(sys.argv[1:]) 
+    comm = sql.GetCommandList([' '.join(sys.argv[2:])])
+    comm.Check({}, {})
+  except Exception as e:
+    print(str(e))
+    sys.exit(1)
+  print('Check passed')
+elif len(sys.argv) > 1:
+  args = sys.argv[1:]
+  if len(args) > 1 and args[0] == '--stream':
+    command.STREAM = True
+    args = args[1:]
+  try:
+    command = ' '.join(args) 
     comm = sql.GetCommandList([command])
   except Exception as e:
     print(str(e))
@@ -25,7 +44,7 @@ if len(sys.argv) > 1:
   print('Parsed successfully, running')
   print()
   try:
-    for l in comm.Eval({}, {}):
+    for l in prune.Eval(comm, {}):
       print(l)
   except Exception as e:
     print(str(e))
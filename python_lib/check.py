@@ -0,0 +1,273 @@
+# Static checks of command sequences, run before any data is loaded (see
+# cadmium.py --check).
+#
+# Checking goes through the same commands as evaluating (see the Check
+# methods in command.py), including the files run with RUN FILE, but the
+# tables hold just their schemas. Instead of the rows, a checked table holds
+# the list of possible types (see sql.py) of every column: LOAD reads only
+# the header of the file (and all the loaded values are strings), and the
+# commands compute the types of the new columns from the types of their
+# expressions. The expressions aren't evaluated for any row, only the
+# columns they refer to, and the types of the values they get, are checked.
+#
+# The columns of some tables depend on the data (like the ones made by
+# PIVOT). Their schema is UNKNOWN, and the commands using them aren't
+# checked.
+
+import compiler
+import expression
+import optimizer
+# This module is imported by command.py, which sql.py imports, so sql can
+# only be used inside functions.
+import sql
+
+UNKNOWN = (None, None)
+
+def Known(table):
+  return table[0] is not None
+
+# The schema of a loaded table.
+def Loaded(header):
+  return (header, [[sql.STRING] for _ in header])
+
+def ValueType(val):
+  for python_type, typ in [(bool, sql.BOOL), (int, sql.INT),
+                           (float, sql.FLOAT), (str, sql.STRING)]:
+    if isinstance(val, python_type):
+      return typ
+  return None
+
+def Union(*types):
+  res = []
+  for typ in types:
+    res.extend(t for t in typ if t not in res)
+  return res
+
+def IsString(types):
+  return sql.STRING in types
+
+# The types of a column in which the missing values are filled with empty
+# strings (by UNION or JOIN).
+def Filled(types):
+  return Union(types, [sql.STRING])
+
+# Python does arithmetic on bools, even if the parser doesn't accept it.
+def IsNumber(typ):
+  return typ in [sql.BOOL, sql.INT, sql.FLOAT]
+
+# The types of the value of an arithmetic operation on values of the given
+# types (empty if every combination fails).
+def ArithmeticTypes(node, left, right):
+  res = []
+  for l in left:
+    for r in right:
+      if IsNumber(l) and IsNumber(r):
+        if sql.FLOAT in [l, r] or isinstance(node, expression.Quotient):
+          res = Union(res, [sql.FLOAT])
+        else:
+          res = Union(res, [sql.INT])
+      elif l == r == sql.STRING and isinstance(node, expression.Sum):
+        res = Union(res, [sql.STRING])
+  return res
+
+def Comparable(left, right):
+  return any((IsNumber(l) and IsNumber(r)) or l == r == sql.STRING
+             for l in left for r in right)
+
+def Mismatch(node, *types):
+  raise ValueError('Type mismatch in ' + node.DebugString(),
+                   'arguments of types {}'.format(
+                       ', '.join(' or '.join(typ) for typ in types)))
+
+# The functions that only use the truth values of their arguments, so they
+# take values of any type (even though the parser expects bools), with the
+# types of their values.
+TRUTH_FUNCTIONS = {
+  'and': Union,
+  'or': Union,
+  'not': lambda typ: [sql.BOOL],
+  'assert': lambda typ: typ,
+}
+
+# The types a function (see sql.py) accepts for an argument, given the types
+# it's declared to accept.
+def Accepted(intypes):
+  return intypes + [sql.BOOL] if sql.INT in intypes else intypes
+
+# The definition of the function (see sql.py) of a unary, binary or ternary
+# node, with the types of its arguments, or None.
+def Function(node):
+  if isinstance(node, expression.UnaryExpr):
+    return sql.UNARY_FUNCTIONS.get(node.descr)
+  if isinstance(node, expression.BinaryExpr):
+    return sql.BINARY_FUNCTIONS.get(node.descr)
+  return sql.TERNARY_FUNCTIONS.get(node.descr)
+
+# Infers the types of expressions evaluated in a single context (see
+# command.RowContext), over a table with columns of the given types. In
+# aggregations, keys is the set of (0-indexed) columns of the group key,
+# which are the only ones that can be read outside of aggregate functions.
+class Checker:
+  def __init__(self, context, types, keys=None):
+    self.context = context
+    self.types = types
+    self.keys = keys
+    self.invariant = {}
+    # Whether the checked node is in a branch of an if, that isn't
+    # evaluated for every row.
+    self.conditional = False
+
+  # Whether node doesn't depend on the row (see compiler.Invariant).
+  def Invariant(self, node):
+    if id(node) not in self.invariant:
+      if isinstance(node, compiler.INVARIANT_LEAVES):
+        res = True
+      elif isinstance(node, compiler.INVARIANT_IF_CHILDREN_ARE):
+        res = all(self.Invariant(child)
+                  for child in optimizer.Children(node))
+      else:
+        res = False
+      self.invariant[id(node)] = res
+    return self.invariant[id(node)]
+
+  def Value(self, node):
+    if not self.Invariant(node):
+      return compiler.FAILED
+    return compiler.EvalOrFailed(node, self.context)
+
+  # Returns the (0-indexed) column read by at(), or None if it depends on
+  # the row. Raises the error at() would raise for every row.
+  def Column(self, node):
+    arg = self.Value(node.arg)
+    if arg is compiler.FAILED:
+      return None
+    if isinstance(arg, str):
+      if not compiler.IsColumnName(arg) or arg not in self.context:
+        raise ValueError(node.ErrorStr(), 'column {} unknown, columns are {}'.format(
+            arg, [name for name in self.context if compiler.IsColumnName(name)]))
+      arg = self.context[arg]
+    if not isinstance(arg, int) or arg <= 0 or arg >= self.context['?last']:
+      raise ValueError(node.ErrorStr(),
+                       'column index {} out of range'.format(arg))
+    return self.KeyColumn(node, arg - 1)
+
+  def KeyColumn(self, node, column):
+    if self.keys is not None and column not in self.keys:
+      raise ValueError(node.ErrorStr(),
+                       'Column {} is not a part of the group key'.format(
+                           column + 1))
+    return column
+
+  # The (0-indexed) columns of a range (of a range function, or a seat
+  # assignment), or none if the range depends on the row.
+  def Range(self, node):
+    beg = self.Value(node.beg)
+    end = self.Value(node.end)
+    if not isinstance(beg, int) or not isinstance(end, int):
+      return []
+    if end - 1 < 0:
+      end = self.context['?last'] + 1
+    return [self.KeyColumn(node, column)
+            for column in range(max(beg - 1, 0), min(end - 1, len(self.types)))]
+
+  def Types(self, node):
+    val = self.Value(node)
+    if val is not compiler.FAILED and ValueType(val) is not None:
+      return [ValueType(val)]
+    if self.Invariant(node):
+      # Fails for every row in which it's evaluated.
+      if not self.conditional:
+        try:
+          node.Eval(self.context)
+        except Exception as e:
+          raise ValueError(node.ErrorStr(), str(e.__cause__ or e)) from e
+      return node.types or sql.ANY
+    if isinstance(node, expression.MemoExpr):
+      return self.Types(node.child)
+    if isinstance(node, expression.If):
+      condition = self.Value(node.condition)
+      if condition is not compiler.FAILED:
+        return self.Types(node.then if condition else node.otherwise)
+      self.Types(node.condition)
+      conditional = self.conditional
+      self.conditional = True
+      res = Union(self.Types(node.then), self.Types(node.otherwise))
+      self.conditional = conditional
+      return res
+    if isinstance(node, expression.AtExpr):
+      column = self.Column(node)
+      if column is None:
+        self.Types(node.arg)
+        return Union(*self.types)
+      return self.types[column]
+    if isinstance(node, expression.CurrExpr):
+      if '?' not in self.context:
+        raise ValueError(node.ErrorStr(),
+                         'curr() can only be used in column range definitions')
+      return self.types[
+          self.KeyColumn(node, self.context[self.context['?']] - 1)]
+    if isinstance(node, (expression.IndexExpr, expression.NameExpr,
+                         expression.ParamExpr)):
+      self.Types(node.arg)
+      return node.types or sql.ANY
+    if isinstance(node, expression.AggregateExpr):
+      if self.keys is None:
+        raise ValueError(node.ErrorStr(),
+                         'Cannot evaluate outside of aggregation context')
+      checker = Checker(self.context, self.types)
+      checker.conditional = self.conditional
+      child = checker.Types(node.child)
+      f = sql.AGGREGATE_FUNCTIONS[node.descr]
+      return sql.CalcType1(Accepted(f[2]), child, f[3]) or Mismatch(
+          node, child)
+    if isinstance(node, expression.RangeExpr):
+      f = sql.RANGE_FUNCTIONS[node.descr]
+      if node.descr in TRUTH_FUNCTIONS:
+        return f[3]
+      for column in self.Range(node):
+        if not set(Accepted(f[2])) & set(self.types[column]):
+          Mismatch(node, self.types[column])
+      return f[3]
+    if isinstance(node, expression.SeatAssignmentExpr):
+      seats = self.Types(node.seats)
+      self.Types(node.myvotes)
+      for typ in [seats] + [self.types[column] for column in self.Range(node)]:
+        if not any(IsNumber(t) for t in typ):
+          Mismatch(node, typ)
+      return [sql.INT]
+    if isinstance(node, expression.Equal):
+      self.Types(node.left)
+      self.Types(node.right)
+      return [sql.BOOL]
+    if isinstance(node, (expression.Lesser, expression.Greater)):
+      left = self.Types(node.left)
+      right = self.Types(node.right)
+      if not Comparable(left, right):
+        Mismatch(node, left, right)
+      return [sql.BOOL]
+    if isinstance(node, (expression.Sum, expression.Difference,
+                         expression.Product, expression.Quotient)):
+      left = self.Types(node.left)
+      right = self.Types(node.right)
+      return ArithmeticTypes(node, left, right) or Mismatch(node, left, right)
+    if isinstance(node, (expression.UnaryExpr, expression.BinaryExpr,
+                         expression.TernaryExpr)):
+      args = [self.Types(child) for child in optimizer.Children(node)]
+      if node.descr in TRUTH_FUNCTIONS:
+        return TRUTH_FUNCTIONS[node.descr](*args)
+      f = Function(node)
+      if f is not None:
+        intypes = [Accepted(typ) for typ in f[1:-1]]
+        return sql.CalcTypesGeneric(intypes, args, f[-1]) or Mismatch(
+            node, *args)
+    return node.types or sql.ANY
+
+# Returns the possible types of the values of expr in the context, and
+# raises a ValueError if expr refers to a column that isn't there, or
+# applies a function to values it doesn't take.
+def Types(expr, context, types, keys=None):
+  try:
+    return Checker(context, types, keys).Types(expr)
+  except RecursionError:
+    # Very deep expressions are left unchecked.
+    return expr.types or sql.ANY
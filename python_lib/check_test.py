@@ -0,0 +1,115 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import check
+import sql
+
+class TestCheck(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.old_dir = os.getcwd()
+    os.chdir(self.dir)
+    # The rows after the header are never read by the checks.
+    self.Write('votes.csv', ['# Comment', 'teryt;party;votes', 'x;y'])
+
+  def tearDown(self):
+    os.chdir(self.old_dir)
+    shutil.rmtree(self.dir)
+
+  def Write(self, name, lines):
+    with open(name, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+
+  def Check(self, commands, params={}):
+    tables = {}
+    sql.GetCommandList(commands).Check(tables, params)
+    return tables
+
+  def assertFails(self, commands, message):
+    with self.assertRaises(ValueError) as e:
+      self.Check(commands)
+    self.assertIn(message, str(e.exception))
+
+  def test_schemas(self):
+    tables = self.Check([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v TO w WITH teryt AS id, int(votes) * 2 AS votes,',
+        '  int(votes) / 2 < 1 AS small, if(party = "a", 1, "b") AS mixed;',
+        'AGGREGATE w TO s BY id WITH id AS id, sum(votes) AS votes;',
+        'JOIN s INTO w ON id EQ id WITH INSERT UNMATCHED VALUES AS j;',
+        'PIVOT v TO p;'])
+    self.assertEqual(({'teryt': 0, 'party': 1, 'votes': 2},
+                      [[sql.STRING]] * 3), tables['v'])
+    self.assertEqual([[sql.STRING], [sql.INT], [sql.BOOL],
+                      [sql.INT, sql.STRING]], tables['w'][1])
+    self.assertEqual([[sql.STRING], [sql.INT, sql.STRING]],
+                     tables['j'][1][:2])
+    self.assertEqual(check.UNKNOWN, tables['p'])
+
+  def test_grouping_sets(self):
+    tables = self.Check([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v WITH int(teryt) AS teryt, party AS party, votes AS votes;',
+        'AGGREGATE v TO a, b BY ROLLUP party, teryt',
+        '  WITH teryt AS teryt, sum(int(votes)) AS votes;'])
+    self.assertEqual([[sql.INT], [sql.INT]], tables['a'][1])
+    self.assertEqual([[sql.INT, sql.STRING], [sql.INT]], tables['b'][1])
+    self.assertFails([
+        'LOAD v FROM "votes.csv";',
+        'AGGREGATE v TO a BY teryt AND TO b BY party WITH votes AS votes;'],
+        'not a part of the group key')
+
+  def test_unknown_column(self):
+    self.assertFails([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v WITH teryt AS id, int(vote) AS votes;'],
+        'column vote unknown')
+    self.assertFails([
+        'LOAD v FROM "votes.csv";',
+        'AGGREGATE v BY teryt WITH party AS party;'],
+        'not a part of the group key')
+    self.assertFails(['LOAD v FROM "votes.csv";', 'FILTER v BY $missing;'],
+                     'Parameter missing missing')
+    self.assertFails(['LOAD v FROM "votes.csv";',
+                      'FILTER v BY teryt IN v.id;'],
+                     'Column id not present in table v')
+
+  def test_type_mismatch(self):
+    self.assertFails([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v WITH votes * 2 AS votes;'],
+        'Type mismatch in product at line 2')
+    self.assertFails([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v WITH int(votes) AS votes, teryt AS teryt;',
+        'TRANSFORM v WITH substr(votes, 0, 2) AS votes;'],
+        'Type mismatch in substr')
+    self.assertFails([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v WITH sum_range(1:) AS votes;'],
+        'Type mismatch in sum_range')
+
+  def test_untaken_branches(self):
+    self.Check([
+        'LOAD v FROM "votes.csv";',
+        'TRANSFORM v WITH if(votes = "", 1 / 0, int(votes)) AS votes,',
+        '  if($year = "2023", teryt, at("nonexistent")) AS teryt;'],
+        {'year': '2023'})
+
+  def test_run_file(self):
+    self.Write('child.cfg', [
+        'INPUT TABLES t;',
+        'TRANSFORM t WITH int(votes) AS votes, $column AS column;'])
+    tables = self.Check([
+        'LOAD v FROM "votes.csv";',
+        'RUN FILE "child.cfg" FROM v WITH PARAM column x INTO c;'])
+    self.assertEqual([[sql.INT], [sql.STRING]], tables['c'][1])
+    self.Write('child.cfg', ['LOAD t FROM "votes.csv";',
+                             'TRANSFORM t WITH int(teryt) + party AS x;'])
+    self.assertFails(['RUN FILE "child.cfg" INTO c;'],
+                     'Failure in imported file child.cfg')
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,301 @@
+# Evaluates expressions (see expression.py) for all the rows of a table at
+# once, with NumPy.
+#
+# TRANSFORM and FILTER evaluate their expressions for every row, which costs
+# at least a Python function call per row (see compiler.py), or per cell in
+# FOR ranges. For large tables, they first try to evaluate them for whole
+# columns: every column the expression reads is converted to a NumPy array
+# (of ints, floats or bools if all its values are of that type, and of
+# Python objects otherwise), and every node computes the array of its values
+# for all the rows. The tables themselves stay lists of rows, so the other
+# commands work as before.
+#
+# The values are exactly the ones the rows would get. Arithmetic on arrays
+# of numbers is only done if it can't overflow (or lose precision), and on
+# arrays of objects it applies the Python operators to the values. The
+# branches of an if are evaluated only for the rows that take them. Whenever
+# the result could differ from evaluating the rows one by one (a division by
+# zero in some row, an error, or a node that isn't handled here), Evaluate
+# gives up, and the command evaluates the rows as usual - which also raises
+# the usual errors.
+
+import operator
+
+import compiler
+import expression
+import view
+
+# Set to False to always evaluate the rows one by one.
+ENABLED = True
+# For smaller tables, converting the columns costs more than it saves (and
+# importing NumPy takes as long as evaluating a few thousand rows).
+MIN_ROWS = 1000
+
+# NumPy, imported when it's first needed (it takes longer to import than all
+# the rest of the tool), or False if it isn't installed.
+_numpy = None
+
+def NumPy():
+  global _numpy
+  if _numpy is None:
+    try:
+      import numpy
+      _numpy = numpy
+    except ImportError:
+      _numpy = False
+  return _numpy
+
+class GiveUp(Exception):
+  pass
+
+# The ints in int64 arrays are below INT_BOUND, and exactly representable as
+# floats below FLOAT_BOUND.
+INT_BOUND = 2 ** 63
+FLOAT_BOUND = 2 ** 53
+
+ARITHMETIC = {operator.add, operator.sub, operator.mul, operator.truediv}
+COMPARISONS = {operator.eq, operator.lt, operator.gt}
+# On bools, and() and or() are the bitwise operators.
+LOGICAL = {expression.logical_and: operator.and_,
+           expression.logical_or: operator.or_}
+
+# The NumPy kind of a value: 'b', 'i' or 'f' for bools, ints and floats
+# (and arrays of them), and 'O' for everything else.
+def Kind(val):
+  if hasattr(val, 'dtype'):
+    return val.dtype.kind if val.dtype.kind in 'bif' else 'O'
+  return {bool: 'b', int: 'i', float: 'f'}.get(type(val), 'O')
+
+# The largest absolute value of an int (or of an array of ints).
+def Bound(val):
+  if not hasattr(val, 'dtype'):
+    return abs(val)
+  if not len(val):
+    return 0
+  return max(int(val.max()), -int(val.min()))
+
+# The columns of a table, converted to arrays when they're first read.
+class Table:
+  def __init__(self, np, rows):
+    self.np = np
+    self.rows = rows
+    self.columns = {}
+
+  def Column(self, index):
+    if index not in self.columns:
+      self.columns[index] = self.Array(view.Column(self.rows, index))
+    return self.columns[index]
+
+  def Array(self, values):
+    np = self.np
+    types = set(map(type, values))
+    try:
+      if types == {int}:
+        return np.array(values, dtype=np.int64)
+      if types == {float}:
+        return np.array(values, dtype=np.float64)
+      if types == {bool}:
+        return np.array(values, dtype=np.bool_)
+    except OverflowError:
+      pass
+    res = np.empty(len(values), dtype=object)
+    res[:] = values
+    return res
+
+# Returns the Table of the rows, if they're worth evaluating by columns (and
+# all have the given length), or None.
+def ForRows(rows, width):
+  if not ENABLED or len(rows) < MIN_ROWS:
+    return None
+  np = NumPy()
+  if not np or view.Widths(rows) != {width}:
+    return None
+  return Table(np, rows)
+
+# Evaluates the nodes of an expression for all the rows, in a context of a
+# command (see compiler.Bind) - where the context has a current column, for
+# that column. The values are Python values (for the nodes that have the
+# same value in every row), or arrays with the values for the selected rows.
+class Evaluator:
+  def __init__(self, table, context):
+    self.np = table.np
+    self.table = table
+    self.context = context
+    self.invariant = {}
+
+  def Invariant(self, node):
+    if id(node) not in self.invariant:
+      if isinstance(node, compiler.INVARIANT_LEAVES):
+        res = True
+      elif isinstance(node, compiler.INVARIANT_IF_CHILDREN_ARE):
+        res = all(self.Invariant(child)
+                  for child in compiler.optimizer.Children(node))
+      else:
+        res = False
+      self.invariant[id(node)] = res
+    return self.invariant[id(node)]
+
+  # The values of the (0-indexed) column in the rows with the given indices
+  # (or in all the rows, if rows is None).
+  def Column(self, index, rows):
+    if index >= len(self.table.rows[0]):
+      raise GiveUp()
+    column = self.table.Column(index)
+    return column if rows is None else column[rows]
+
+  def Constant(self, node):
+    val = compiler.EvalOrFailed(node, self.context)
+    if val is compiler.FAILED:
+      raise GiveUp()
+    return val
+
+  def AsObjects(self, val):
+    if hasattr(val, 'dtype') and val.dtype.kind != 'O':
+      return val.astype(object)
+    return val
+
+  def AsNumbers(self, val):
+    if Kind(val) == 'b':
+      return val.astype(self.np.int64) if hasattr(val, 'dtype') else int(val)
+    return val
+
+  # Whether ints of the given bound can be used in op on arrays, giving the
+  # same values as on Python ints.
+  def SafeInts(self, op, left, right):
+    kinds = (Kind(left), Kind(right))
+    if 'f' in kinds or op is operator.truediv:
+      # Compared with, or converted to floats.
+      return all(Bound(val) < FLOAT_BOUND for val in [left, right]
+                 if Kind(val) == 'i')
+    if op is operator.mul:
+      return Bound(left) * Bound(right) < INT_BOUND
+    if op in ARITHMETIC:
+      return Bound(left) + Bound(right) < INT_BOUND
+    return True
+
+  def Binary(self, op, left, right):
+    if not hasattr(left, 'dtype') and not hasattr(right, 'dtype'):
+      return op(left, right)
+    if op in LOGICAL and Kind(left) == Kind(right) == 'b':
+      return LOGICAL[op](left, right)
+    if op in LOGICAL:
+      return self.np.frompyfunc(op, 2, 1)(left, right)
+    if Kind(left) in 'bif' and Kind(right) in 'bif':
+      if op in ARITHMETIC:
+        # Python adds bools as ints, NumPy as bools.
+        left, right = self.AsNumbers(left), self.AsNumbers(right)
+      if op is operator.truediv and not self.np.all(right != 0):
+        raise GiveUp()
+      if not self.SafeInts(op, left, right):
+        raise GiveUp()
+      with self.np.errstate(over='ignore'):
+        return op(left, right)
+    if op in ARITHMETIC or op in COMPARISONS:
+      return op(self.AsObjects(left), self.AsObjects(right))
+    return self.np.frompyfunc(op, 2, 1)(left, right)
+
+  def Truth(self, val):
+    if not hasattr(val, 'dtype'):
+      return bool(val)
+    if val.dtype.kind == 'b':
+      return val
+    if val.dtype.kind in 'if':
+      return val != 0
+    return val.astype(bool)
+
+  def Int(self, val):
+    kind = Kind(val)
+    if not hasattr(val, 'dtype') or kind == 'i':
+      return int(val) if not hasattr(val, 'dtype') else val
+    if kind == 'b':
+      return val.astype(self.np.int64)
+    if kind == 'f':
+      if not self.np.all(self.np.abs(val) < FLOAT_BOUND):
+        raise GiveUp()
+      return val.astype(self.np.int64)
+    return self.table.Array(list(map(int, val.tolist())))
+
+  # The values of the if for the rows (or for all the rows, if rows is None),
+  # where every row only evaluates the branch it takes.
+  def If(self, node, rows):
+    np = self.np
+    condition = self.Truth(self.Evaluate(node.condition, rows))
+    if not hasattr(condition, 'dtype'):
+      return self.Evaluate(node.then if condition else node.otherwise, rows)
+    if np.all(condition) or not np.any(condition):
+      # All the rows take the same branch.
+      return self.Evaluate(node.then if condition[0] else node.otherwise, rows)
+    if rows is None:
+      rows = np.arange(len(condition))
+    branches = []
+    for taken, branch in [(condition, node.then), (~condition, node.otherwise)]:
+      if np.any(taken):
+        branches.append((taken, self.Evaluate(branch, rows[taken])))
+    kinds = set(Kind(val) for _, val in branches)
+    if len(kinds) == 1 and kinds <= {'b', 'i', 'f'}:
+      res = np.empty(len(rows), dtype={'b': np.bool_, 'i': np.int64,
+                                       'f': np.float64}[kinds.pop()])
+    else:
+      res = np.empty(len(rows), dtype=object)
+    for taken, val in branches:
+      res[taken] = val
+    return res
+
+  def Range(self, node, rows):
+    beg = self.Constant(node.beg) - 1
+    end = self.Constant(node.end) - 1
+    if end < 0:
+      end = self.context['?last']
+    val = node.acc[0]
+    for column in range(beg, end):
+      val = self.Binary(node.acc[1], val, self.Column(column, rows))
+    return val
+
+  def Evaluate(self, node, rows=None):
+    if self.Invariant(node):
+      return self.Constant(node)
+    if isinstance(node, expression.MemoExpr):
+      return self.Evaluate(node.child, rows)
+    if isinstance(node, expression.AtExpr):
+      index = compiler.ResolveColumn(self.context, self.Constant(node.arg))
+      if index is None:
+        raise GiveUp()
+      return self.Column(index, rows)
+    if isinstance(node, expression.CurrExpr):
+      if '?' not in self.context:
+        raise GiveUp()
+      return self.Column(self.context[self.context['?']] - 1, rows)
+    if isinstance(node, expression.If):
+      return self.If(node, rows)
+    if isinstance(node, expression.RangeExpr):
+      return self.Range(node, rows)
+    if isinstance(node, expression.BinaryExpr):
+      return self.Binary(node.op, self.Evaluate(node.left, rows),
+                         self.Evaluate(node.right, rows))
+    if isinstance(node, expression.UnaryExpr):
+      arg = self.Evaluate(node.arg, rows)
+      if node.op is int:
+        return self.Int(arg)
+      if node.op is operator.not_:
+        # The branch of an if taken in all the rows can be a single value.
+        if not hasattr(arg, 'dtype'):
+          return not arg
+        return self.np.logical_not(self.Truth(arg))
+      return self.np.frompyfunc(node.op, 1, 1)(arg)
+    if isinstance(node, expression.TernaryExpr):
+      args = [self.Evaluate(arg, rows)
+              for arg in [node.arg1, node.arg2, node.arg3]]
+      return self.np.frompyfunc(node.op, 3, 1)(*args)
+    raise GiveUp()
+
+# Returns the list of the values of expr for all the rows of the table (the
+# values expr.Eval would return with every row as the __data of the
+# context), or None if expr can't be evaluated by columns.
+def Evaluate(expr, context, table):
+  try:
+    res = Evaluator(table, context).Evaluate(expr)
+  except Exception:
+    return None
+  if hasattr(res, 'dtype'):
+    return res.tolist()
+  return [res] * len(table.rows)
@@ -0,0 +1,94 @@
+import unittest
+
+import columnar
+import command
+import sql
+import tokenizer
+
+HEADER = {'id': 0, 'n': 1, 'm': 2, 'f': 3, 'flag': 4, 'mixed': 5}
+ROWS = [[str(1000 + i), i % 7, i % 5 - 2, i / 4, i % 3 == 0,
+         [i, str(i), 1.5][i % 3]] for i in range(30)]
+
+def parse(s):
+  return sql.GetExpression(tokenizer.tokenize([s]), {})
+
+def evaluate(s, rows=ROWS):
+  context = command.RowContext(None, HEADER, {'year': '2023'})
+  return columnar.Evaluate(parse(s), context,
+                           columnar.ForRows(rows, len(HEADER)))
+
+# Runs the command both by columns and row by row, and returns the pair of
+# resulting tables (or of error strings).
+def both(commands, rows=ROWS):
+  res = []
+  for enabled in [True, False]:
+    columnar.ENABLED = enabled
+    tables = {'t': (HEADER, [list(row) for row in rows])}
+    try:
+      sql.GetCommandList(commands).Eval(tables, {})
+      res.append(tables['t'])
+    except ValueError as e:
+      res.append('raised ' + str(e))
+  columnar.ENABLED = True
+  return res
+
+class TestColumnar(unittest.TestCase):
+  def setUp(self):
+    self.min_rows = columnar.MIN_ROWS
+    columnar.MIN_ROWS = 1
+
+  def tearDown(self):
+    columnar.MIN_ROWS = self.min_rows
+
+  def assertSame(self, commands, rows=ROWS):
+    by_columns, by_rows = both(commands, rows)
+    self.assertEqual(by_rows, by_columns)
+    if not isinstance(by_rows, str):
+      # Equal values of different types (like 1 and 1.0) are different.
+      self.assertEqual([list(map(type, row)) for row in by_rows[1]],
+                       [list(map(type, row)) for row in by_columns[1]])
+    return by_columns
+
+  def test_values(self):
+    self.assertEqual([n * 2 - 1 for n in range(7)], evaluate('n * 2 - 1')[:7])
+    self.assertEqual([i / 4 + 1 for i in range(30)], evaluate('f + 1'))
+    self.assertEqual([1000 + i + 1 for i in range(30)], evaluate('int(id) + 1'))
+    self.assertEqual([True, 1, 1], evaluate('if(flag, flag, 1)')[:3])
+    self.assertEqual(['1000x', '1001x'], evaluate('id + "x"')[:2])
+    self.assertEqual(['2023'] * 30, evaluate('$year'))
+
+  def test_gives_up(self):
+    # Some rows would fail.
+    self.assertIsNone(evaluate('n / m'))
+    self.assertIsNone(evaluate('mixed + 1'))
+    # Python ints can be larger than NumPy ones.
+    self.assertIsNone(evaluate('n * 9223372036854775807'))
+    self.assertIsNone(evaluate('at(id)'))
+
+  def test_transform(self):
+    self.assertSame(['TRANSFORM t WITH id AS id, n * m AS p, f / (n + 1) AS q,',
+                     '  if(n > m, n - m, f) AS r, flag + flag AS s,',
+                     '  and(flag, n < 3) AS a, int(f) AS i, len(id) AS l;'])
+    self.assertSame(['TRANSFORM t WITH id AS id, curr() * 2 FOR 2:4,',
+                     '  sum_range(2:4) AS total, concat_range(1:2) AS c;'])
+    self.assertSame(['TRANSFORM t WITH if(m = 0, 0, n / m) AS q,',
+                     '  if(mixed = 1, mixed, 2) AS mixed;'])
+    # The rows all take the same branch, which is a single value.
+    self.assertSame(['TRANSFORM t WITH not(if(n > -1, 1 = 1, 1 = 2)) AS a,',
+                     '  int(if(n > -1, "3", id)) AS b;'])
+
+  def test_filter(self):
+    self.assertSame(['FILTER t BY or(n < m, f > 3);'])
+    self.assertSame(['FILTER t BY mixed = "1";'])
+    self.assertSame(['FILTER t BY not(if(n > -1, 1 = 1, 1 = 2));'])
+    self.assertSame(['FILTER t BY not(if(n > 10, 1 = 1, 1 = 2));'])
+
+  def test_fallback(self):
+    self.assertSame(['TRANSFORM t WITH n AS n, mixed * 2 AS p;'])
+    self.assertIn('raised', self.assertSame(['TRANSFORM t WITH n / m AS q;']))
+    self.assertIn('raised', self.assertSame(['FILTER t BY mixed + 1 > 2;']))
+    rows = [row + [0] if i == 3 else row for i, row in enumerate(ROWS)]
+    self.assertIn('raised', self.assertSame(['FILTER t BY n > 1;'], rows))
+
+if __name__ == '__main__':
+  unittest.main()
@@ -6,10 +6,24 @@
 #
 # Commands also take 'params', which are a string-to-string mapping
 # of parameters that affect execution.
-
+#
+# Commands can also be checked, without loading any data: Check(tables,
+# params) goes through the same steps as Eval, but the tables hold only
+# their schemas (see check.py).
+
+import check
+import collections
+import columnar
+import compiler
+import expression
+import itertools
+import optimizer
 import os
+import plancache
+import prune
 import sys
-import visualize
+import tabular
+import view
 
 SEPARATOR = 'separator'
 PREFIX = 'prefix'
@@ -20,6 +34,15 @@ TARGET_TABLE = 'target_table'
 
 INPUT_TABLES = '__input_table_names'
 
+# Set to True (by cadmium.py --stream) to pass the rows from LOADs to DUMPs,
+# through TRANSFORMs and FILTERs, one by one, without storing the tables in
+# between (see Stream).
+STREAM = False
+
+# The number of times every way of joining a pair of tables ('probe', 'merge'
+# or 'hash', see Join.PairRows) was used.
+JOIN_STRATEGIES = collections.Counter()
+
 class Const:
   def __init__(self, value):
     self.value = value
@@ -52,6 +75,7 @@ def ParamContext(params):
 def RowContext(row, header, params):
   context = ParamContext(params)
   context['?last'] = len(header) + 1
+  context['?names'] = tabular.Names(header)
   context['__data'] = row
   for x in header:
     context[x] = header[x] + 1
@@ -72,6 +96,19 @@ class Command:
     raise ValueError('FAILED ' + self.ErrorStr() + ': ', msg, str(e)
         ).with_traceback(e.__traceback__) from None
 
+  # Returns the function calling function for the row, after checking that the
+  # row has the length of the header. The rows of the tables that are uniform
+  # (see tabular.py) don't need the check.
+  def Checked(self, header, function, uniform=False):
+    if uniform:
+      return function
+    def Checked(row, *args):
+      if len(row) != len(header):
+        self.Raise('Row {} has length {}, expected {}'.format(
+            row, len(row), len(header)))
+      return function(row, *args)
+    return Checked
+
   def Source(self, source, tables, params):
     source_table = source.Eval(ParamContext(params))
     if source_table not in tables:
@@ -90,6 +127,61 @@ class Command:
       target_table = source_table
     return source_table, target_table
 
+  # Returns the names of all the tables the command reads or writes, or None
+  # if they aren't known before evaluating it (see Unused).
+  def TableNames(self, params):
+    return None
+
+  # The names of the source and target tables of a command with optional
+  # TO, without checking that they can be used.
+  def SourceAndTargetNames(self, params):
+    source_table = self.source_table.Eval(ParamContext(params))
+    if self.target_table is None:
+      return [source_table, source_table]
+    return [source_table, self.target_table.Eval(ParamContext(params))]
+
+
+# The value of the cells of the loaded rows that aren't live (see prune.py),
+# which the LOAD doesn't strip (or split, after the last live one). It's
+# shown as None, except in the error messages showing the rows, where the
+# values are read from the file again (see Shown).
+class Unloaded:
+  def __init__(self, load, path, columns):
+    self.load = load
+    # The absolute path of the file, or None if it isn't known.
+    self.path = path
+    # The indices of the cells that aren't live.
+    self.columns = columns
+
+  def __repr__(self):
+    return 'None'
+
+  # Returns the values of the first line of the file with the values of the
+  # live cells of the row, or None if the row isn't a loaded one (or there's
+  # no such line). The commands only read the live cells, so any earlier line
+  # with the same values would fail the same way as the row does.
+  def Values(self, row):
+    if (self.path is None or
+        [i for i, cell in enumerate(row) if cell is self] != self.columns):
+      return None
+    try:
+      with open(self.path, 'r') as inf:
+        for values in self.load.Stream(inf)[1]:
+          if len(values) == len(row) and all(
+              cell is self or cell == value
+              for cell, value in zip(row, values)):
+            return values
+    except Exception:
+      pass
+    return None
+
+# Returns the row as shown in the error messages, with the values of the
+# cells a LOAD didn't read (see Unloaded), if it's a loaded row.
+def Shown(row):
+  for cell in row:
+    if isinstance(cell, Unloaded):
+      return cell.Values(row) or row
+  return row
 
 class Load(Command):
   def __init__(self, line, name, path, options={}):
@@ -122,42 +214,118 @@ class Load(Command):
     res.append(''.join(curline).strip())
     return res
 
+  # Splits the line, stripping only the live columns (see prune.py), and not
+  # splitting the ones after the last live one. The other ones are unloaded
+  # (see Unloaded).
+  def SplitLive(self, line, separator, live_columns, unloaded, width):
+    if line.count(separator) + 1 != width:
+      return line.split(separator)
+    values = line.split(separator, live_columns[-1] + 1 if live_columns else 0)
+    res = [unloaded] * width
+    for i in live_columns:
+      res[i] = values[i].strip()
+    return res
+
+  # Splits the line, where live is the list of whether the columns are live
+  # (see prune.py), or None if all of them are.
+  def Split(self, line, live, live_columns, unloaded):
+    if self.options['IGNORE QUOTED SEPARATOR']:
+      r = self.SplitQuotedLine(line, self.options[SEPARATOR])
+      if live is not None:
+        r = [v if l else unloaded for v, l in zip(r, live)] + r[len(live):]
+      return r
+    if live is not None:
+      return self.SplitLive(line, self.options[SEPARATOR], live_columns,
+                            unloaded, len(live))
+    return [v.strip() for v in line.split(self.options[SEPARATOR])]
+
   # Headered SSV file, rectangle-shaped.
   # TODO: add option for separator, possibly also header presense, and
   # maybe more table shapes?
-  def ReadLines(self, lines):
-    header_row_parsed = False
-    rows = []
-    for row_number, row in enumerate(lines):
-      if not row or row[0] == '#':
-        continue
-      if self.options['IGNORE QUOTED SEPARATOR']:
-        r = self.SplitQuotedLine(row, self.options[SEPARATOR])
-      else:
-        r = [v.strip() for v in row.split(self.options[SEPARATOR])]
-      if not header_row_parsed:
+  def ReadLines(self, lines, prune_columns=False):
+    header, rows = self.Stream(lines, prune_columns)
+    return (header, list(rows))
+
+  # Returns the header, and the generator of the rows, of the lines (which
+  # are read as the rows are). With prune_columns, the columns that aren't
+  # live (see prune.py) are Unloaded, and the rows that don't pass the
+  # FILTERs evaluated by the LOAD are skipped. The path is the one of the
+  # file the lines are read from, if known.
+  def Stream(self, lines, prune_columns=False, path=None):
+    numbered = enumerate(lines)
+    for _, row in numbered:
+      if row and row[0] != '#':
         header = {}
-        for i, v in enumerate(r):
+        for i, v in enumerate(self.Split(row, None, None, None)):
           header[v] = i
-        header_row_parsed = True
+        break
+    else:
+      self.Raise('No lines in file')
+    live, keep = (None, None)
+    if prune_columns:
+      live, keep = prune.Loaded(self, header)
+    return header, self.Rows(numbered, header, live, keep, path)
+
+  def Rows(self, numbered, header, live, keep, path):
+    live_columns = [i for i, l in enumerate(live or []) if l]
+    unloaded = Unloaded(self, path,
+                        [i for i, l in enumerate(live or []) if not l])
+    for row_number, row in numbered:
+      if not row or row[0] == '#':
         continue
+      r = self.Split(row, live, live_columns, unloaded)
       if len(r) != len(header):
         self.Raise('Line {} has length {}, header has length {}'.format(
             row_number, len(r), len(header)))
-      rows.append(r)
-    if header is None:
-      self.Raise('No lines in file')
-    return (header, rows)
+      if keep is None or keep(r):
+        yield r
 
   def Eval(self, tables, params):
+    assert self.name not in tables
+    header, rows = self.Open(params)
+    tables[self.name] = tabular.Table(header, list(rows), True)
+    return []
+
+  # Returns the header of the file, and the generator of its rows (see
+  # Stream), which closes the file when they're all read.
+  def Open(self, params):
+    path = self.path.Eval(ParamContext(params))
+    try:
+      inf = open(path, 'r')
+    except BaseException as e:
+      self.RaiseFrom('Failed to read from {}'.format(path), e)
+    try:
+      header, rows = self.Stream(inf, True, os.path.abspath(path))
+    except BaseException as e:
+      inf.close()
+      self.RaiseFrom('Failed to read from {}'.format(path), e)
+    def Rows():
+      with inf:
+        try:
+          yield from rows
+        except Exception as e:
+          self.RaiseFrom('Failed to read from {}'.format(path), e)
+    return header, Rows()
+
+  def TableNames(self, params):
+    return [self.name]
+
+  # Reads just the header.
+  def Check(self, tables, params):
     assert self.name not in tables
     path = self.path.Eval(ParamContext(params))
     try:
       with open(path, 'r') as inf:
-        tables[self.name] = self.ReadLines(inf.readlines())
+        for row in inf:
+          if row and row[0] != '#':
+            header, _ = self.ReadLines([row])
+            break
+        else:
+          self.Raise('No lines in file')
+      tables[self.name] = check.Loaded(header)
+      prune.Computed(self, None, tables[self.name], [])
     except BaseException as e:
       self.RaiseFrom('Failed to read from {}'.format(path), e)
-    return []
 
 
 class Empty(Command):
@@ -169,9 +337,15 @@ class Empty(Command):
     target = self.target.Eval(ParamContext(params))
     if target in tables:
       self.Raise('Target table {} already present in tables!'.format(target))
-    tables[target] = ({}, [])
+    tables[target] = tabular.Table({}, [], True)
     return []
 
+  def TableNames(self, params):
+    return [self.target.Eval(ParamContext(params))]
+
+  def Check(self, tables, params):
+    self.Eval(tables, params)
+
 
 class Union(Command):
   def __init__(self, line, sources, target, schema):
@@ -218,8 +392,7 @@ class Union(Command):
         result[targetschema[key]] = row[sourceschema[key]]
     return result
 
-  def Eval(self, tables, params):
-    sources = [self.Source(x, tables, params) for x in self.sources]
+  def TargetSchema(self, tables, sources):
     targetschema = tables[sources[0]][0].copy()
     if self.schema in ('EQUAL', 'REORDERED'):
       self.ValidateHeadersMatch(tables, sources, self.schema == 'EQUAL')
@@ -228,16 +401,49 @@ class Union(Command):
         self.IntersectSchema(targetschema, tables[source][0])
       elif self.schema == 'UNION':
         self.UnionSchema(targetschema, tables[source][0])
+    return targetschema
+
+  def Target(self, tables, sources, params):
     target = self.target.Eval(ParamContext(params))
     if target in tables and target not in sources:
       self.Raise('Target table {} already present in tables!'.format(target))
+    return target
+
+  def Eval(self, tables, params):
+    sources = [self.Source(x, tables, params) for x in self.sources]
+    targetschema = self.TargetSchema(tables, sources)
+    target = self.Target(tables, sources, params)
     new_rows = []
     for source in sources:
       for row in tables[source][1]:
         new_rows.append(self.TransformRow(row, tables[source][0], targetschema))
-    tables[target] = (targetschema, new_rows)
+    tables[target] = tabular.Table(targetschema, new_rows)
     return []
 
+  def TableNames(self, params):
+    return [table.Eval(ParamContext(params))
+            for table in self.sources + [self.target]]
+
+  def Check(self, tables, params):
+    sources = [self.Source(x, tables, params) for x in self.sources]
+    for source in sources:
+      prune.Read(tables[source])
+    if not all(check.Known(tables[source]) for source in sources):
+      tables[self.Target(tables, sources, params)] = check.UNKNOWN
+      return
+    targetschema = self.TargetSchema(tables, sources)
+    target = self.Target(tables, sources, params)
+    types = [[] for _ in targetschema]
+    for source in sources:
+      header, source_types = tables[source]
+      for key in targetschema:
+        typ = types[targetschema[key]]
+        if key in header:
+          types[targetschema[key]] = check.Union(typ, source_types[header[key]])
+        else:
+          types[targetschema[key]] = check.Filled(typ)
+    tables[target] = (targetschema, types)
+
 class Dump(Command):
   def __init__(self, line, name, path, options={}):
     super().__init__(line, 'DUMP')
@@ -253,11 +459,19 @@ class Dump(Command):
     for row in rows:
       outf.write(self.options[SEPARATOR].join([str(x) for x in row]) + '\n')
 
-  # Dump into a headered SSV file
+  # Dump into a headered SSV file. The table is left as it is: only a
+  # streamed DUMP (see Stream) doesn't keep the rows, but the plan is
+  # followed the same way.
   def Eval(self, tables, params):
     name = self.Source(self.name, tables, params)
-    path = self.path.Eval(ParamContext(params))
     header, rows = tables[name]
+    prune.Kept(self, header)
+    return self.Write(header, rows, params)
+
+  # Writes the rows, which can be a generator (see Stream). Doesn't leave a
+  # partially written file if it fails.
+  def Write(self, header, rows, params):
+    path = self.path.Eval(ParamContext(params))
     if path == 'stdout':
       res = []
       res.append(self.options[SEPARATOR].join(header))
@@ -265,10 +479,22 @@ class Dump(Command):
         res.append(self.options[SEPARATOR].join([str(x) for x in row]))
       return res
     else:
-      with open(path, 'x') as outf:
-        self.WriteLines(header, rows, outf)
+      outf = open(path, 'x')
+      try:
+        with outf:
+          self.WriteLines(header, rows, outf)
+      except Exception:
+        os.remove(path)
+        raise
       return []
 
+  def Check(self, tables, params):
+    prune.Dumped(self, tables[self.Source(self.name, tables, params)])
+    self.path.Eval(ParamContext(params))
+
+  def TableNames(self, params):
+    return [self.name.Eval(ParamContext(params))]
+
 class Print(Command):
   def __init__(self, line, expr, path):
     super().__init__(line, 'PRINT')
@@ -284,6 +510,13 @@ class Print(Command):
       outf.write(expr + '\n')
     return []
 
+  def TableNames(self, params):
+    return []
+
+  def Check(self, tables, params):
+    self.expr.Eval(ParamContext(params))
+    self.path.Eval(ParamContext(params))
+
 class List(Command):
   def __init__(self, line):
     super().__init__(line, "LIST TABLES")
@@ -291,6 +524,29 @@ class List(Command):
   def Eval(self, tables, params):
     return tables.keys()
 
+  # The freed tables (see Free) are still listed.
+  def TableNames(self, params):
+    return []
+
+  def Check(self, tables, params):
+    pass
+
+# Lists the memos of the subexpressions evaluated so far (see
+# expression.MemoExpr), with their hit counts.
+class ListMemos(Command):
+  def __init__(self, line):
+    super().__init__(line, "LIST MEMOS")
+
+  def Eval(self, tables, params):
+    return [memo.DebugString()
+            for memo in sorted(expression.MEMOS, key=lambda m: m.position)]
+
+  def TableNames(self, params):
+    return []
+
+  def Check(self, tables, params):
+    pass
+
 class Describe(Command):
   def __init__(self, line, name):
     super().__init__(line, "DESCRIBE")
@@ -310,16 +566,267 @@ class Describe(Command):
     res.append('{} rows in total'.format(len(rows)))
     return res
 
+  def TableNames(self, params):
+    return [self.name.Eval(ParamContext(params))]
+
+  def Check(self, tables, params):
+    prune.Read(tables[self.Source(self.name, tables, params)])
+
 # A sequence of commands to be executed one by one.
 class Sequence:
   def __init__(self, seq):
     self.seq = seq
 
-  def Eval(self, tables, params):
+  # Kept is the set of the tables read after the sequence, or None if all of
+  # them can be. The rows of the other tables are freed after their last use
+  # (see Free).
+  def Eval(self, tables, params, kept=None):
     res = []
+    removed = Removed(self.seq, params, kept)
+    i = 0
+    while i < len(self.seq):
+      chain = self.Chain(i, tables, params)
+      if len(chain) > 1:
+        res.extend(Fuse(chain, tables, params))
+        end = i + len(chain)
+      else:
+        res.extend(self.seq[i].Eval(tables, params))
+        end = i + 1
+      Free(self.seq[i:end], removed[end], tables, params)
+      i = end
+    return res
+
+  # Returns the chain of commands, starting with the i-th one, that can be
+  # fused (see Fuse): TRANSFORMs and FILTERs, each reading the table written
+  # by the previous one, such that the tables in between are never read.
+  # When streaming, the chain can also start with a LOAD, and end with a
+  # DUMP of the last table.
+  def Chain(self, i, tables, params):
+    chain = []
+    present = set(tables)
+    for comm in self.seq[i:]:
+      try:
+        names = ChainNames(comm, params)
+      except Exception:
+        break
+      if names is None:
+        break
+      source_table, target_table = names
+      if chain and source_table != chain[-1][2]:
+        break
+      # Commands that would fail are evaluated by themselves.
+      if source_table is not None and source_table not in present:
+        break
+      if target_table in present and target_table != source_table:
+        break
+      chain.append((comm, source_table, target_table))
+      if target_table is None:
+        break
+      present.add(target_table)
+    while len(chain) > 1:
+      rest = self.seq[i + len(chain):]
+      last_table = chain[-1][2] or chain[-1][1]
+      if all(Unused(target_table, rest, params)
+             for _, _, target_table in chain[:-1]
+             if target_table != last_table):
+        break
+      chain.pop()
+    return [comm for comm, _, _ in chain]
+
+  def Check(self, tables, params):
     for comm in self.seq:
+      comm.Check(tables, params)
+
+# The source and target tables of a command that can be a part of a chain
+# (see Sequence.Chain), or None. When streaming, a LOAD has no source table,
+# and a DUMP no target table.
+def ChainNames(comm, params):
+  if isinstance(comm, Filter) and comm.member is not None:
+    return None
+  if isinstance(comm, (Transform, Filter)):
+    return comm.TableNames(params)
+  if STREAM and isinstance(comm, Load):
+    return [None] + comm.TableNames(params)
+  if STREAM and isinstance(comm, Dump):
+    return comm.TableNames(params) + [None]
+  return None
+
+# Whether the commands (evaluated in order) remove the table, with DROP or
+# OUTPUT TABLES, before any of them reads or writes it.
+def Unused(table, commands, params):
+  for comm in commands:
+    try:
+      names = comm.TableNames(params)
+    except Exception:
+      return False
+    if isinstance(comm, Drop) and names == [table]:
+      return True
+    if isinstance(comm, Output):
+      return table not in names
+    if names is None or table in names:
+      return False
+  return False
+
+# Returns, for every k from 0 to the number of commands, the tables that the
+# commands from the k-th one on remove before reading or writing them (see
+# Unused), as a pair of a set of table names, and whether the tables removed
+# are the ones not in the set. The tables not in kept (if it isn't None) are
+# removed after the commands.
+def Removed(commands, params, kept=None):
+  res = [(set(), False) if kept is None else (set(kept), True)]
+  for comm in reversed(commands):
+    removed, others = res[-1]
+    try:
+      names = comm.TableNames(params)
+    except Exception:
+      names = None
+    if names is None:
+      res.append((set(), False))
+    elif isinstance(comm, Output):
+      res.append((set(names), True))
+    elif isinstance(comm, Drop):
+      res.append((removed - set(names), True) if others else
+                 (removed | set(names), False))
+    else:
+      res.append((removed | set(names), True) if others else
+                 (removed - set(names), False))
+  return res[::-1]
+
+# Frees the rows of the tables read or written by the commands that are
+# removed (see Removed) by the commands after them, before anything reads
+# them. The tables are stored empty, for the commands that remove them.
+def Free(commands, removed, tables, params):
+  removed, others = removed
+  for comm in commands:
+    try:
+      names = comm.TableNames(params)
+    except Exception:
+      continue
+    for name in names or []:
+      if (name in removed) != others and name in tables and tables[name][1]:
+        tables[name] = tabular.Table(tables[name][0], [], True)
+
+# Evaluates a chain of TRANSFORMs and FILTERs (see Sequence.Chain), storing
+# only the rows of the last table (the tables in between are stored empty,
+# for the commands that drop them). Small tables are evaluated in a single
+# pass over the rows, each row going through all the commands. Tables large
+# enough to be evaluated by columns (see columnar.py) are evaluated command
+# by command, but the tables in between are dropped as soon as they're used.
+# Returns the output of the chain.
+def Fuse(chain, tables, params):
+  if isinstance(chain[0], Load) or isinstance(chain[-1], Dump):
+    return Stream(chain, tables, params)
+  names = [comm.TableNames(params) for comm in chain]
+  table = tables[names[0][0]]
+  headers = []
+  saved = prune.Save()
+  try:
+    if columnar.ForRows(table[1], len(table[0])):
+      for comm in chain:
+        table = comm.Apply(table, params)
+        headers.append(table[0])
+    else:
+      header, rows = table
+      # Only the first stage reads rows that might have the wrong length.
+      uniform = tabular.Uniform(table)
+      stages = []
+      for comm in chain:
+        header, stage = comm.Stage(header, params, uniform)
+        headers.append(header)
+        stages.append(stage)
+        uniform = True
+      new_rows = []
+      for row in rows:
+        for stage in stages:
+          row = stage(row)
+          if row is None:
+            break
+        else:
+          new_rows.append(row)
+      table = tabular.Table(header, new_rows, True)
+  except Exception:
+    # Evaluating the commands one by one (with the same plan, see prune.py)
+    # raises the usual error.
+    prune.Restore(saved)
+    for comm in chain:
+      comm.Eval(tables, params)
+    return []
+  for (_, target_table), header in zip(names, headers):
+    tables[target_table] = tabular.Table(header, [], True)
+  tables[names[-1][1]] = table
+  return []
+
+# Evaluates a streamed chain (see Sequence.Chain): the rows go one by one
+# from the LOAD (or the first table) through the TRANSFORMs and FILTERs to
+# the DUMP, and only the rows of the last table are stored, if anything
+# else reads them (see prune.Kept). Returns the output of the DUMP.
+def Stream(chain, tables, params):
+  load = chain[0] if isinstance(chain[0], Load) else None
+  dump = chain[-1] if isinstance(chain[-1], Dump) else None
+  commands = chain[1 if load else 0:len(chain) - 1 if dump else len(chain)]
+  names = [comm.TableNames(params) for comm in commands]
+  saved = prune.Save()
+  try:
+    if load:
+      header, rows = load.Open(params)
+      headers = [header]
+      names.insert(0, [None, load.name])
+      uniform = True
+    else:
+      header, rows = tables[names[0][0]]
+      headers = []
+      uniform = tabular.Uniform(tables[names[0][0]])
+    stages = []
+    for comm in commands:
+      header, stage = comm.Stage(header, params, uniform)
+      headers.append(header)
+      stages.append(stage)
+      uniform = True
+    rows = Staged(rows, stages)
+    stored = []
+    res = []
+    if dump and prune.Kept(dump, header):
+      rows = Stored(rows, stored)
+    if dump:
+      res = dump.Write(header, rows, params)
+    else:
+      stored = list(rows)
+  except Exception:
+    # Evaluating the commands one by one (with the same plan) raises the
+    # usual error.
+    prune.Restore(saved)
+    res = []
+    for comm in chain:
       res.extend(comm.Eval(tables, params))
     return res
+  for (_, target_table), header in zip(names, headers):
+    tables[target_table] = tabular.Table(header, [], True)
+  tables[names[-1][1]] = tabular.Table(headers[-1], stored, True)
+  return res
+
+# The generator of the rows that pass all the stages (see Fuse).
+def Staged(rows, stages):
+  for row in rows:
+    for stage in stages:
+      row = stage(row)
+      if row is None:
+        break
+    else:
+      yield row
+
+# The generator of the rows, appending them to stored.
+def Stored(rows, stored):
+  for row in rows:
+    stored.append(row)
+    yield row
+
+# The ways RunInput and Import can execute the commands they run.
+def EvalCommand(comm, tables, params):
+  return comm.Eval(tables, params)
+
+def CheckCommand(comm, tables, params):
+  comm.Check(tables, params)
+  return []
 
 class Run(Command):
   def __init__(self, line, runnables, random_names, parser):
@@ -350,6 +857,21 @@ class Run(Command):
       del tables[random_name]
     return res
 
+  def TableNames(self, params):
+    res = []
+    for runnable in self.runnables:
+      names = runnable.TableNames(params)
+      if names is None:
+        return None
+      res.extend(names)
+    return res
+
+  def Check(self, tables, params):
+    for runnable in self.runnables:
+      runnable.Check(tables, params)
+    for random_name in self.random_names:
+      del tables[random_name]
+
 class RunInput(Command):
   def __init__(self, line, inputdata, options, parser):
     super().__init__(line, 'RUN input')
@@ -364,6 +886,24 @@ class RunInput(Command):
     self.target_table = options[TARGET_TABLE]
 
   def Eval(self, tables, params):
+    return self.Execute(tables, params, EvalCommand)
+
+  def Check(self, tables, params):
+    self.Execute(tables, params, CheckCommand)
+
+  # The tables read by the TABLE inputs, and the target table. Without INTO,
+  # the tables written are new ones (see Execute), so they aren't listed,
+  # except that a TABLE input removes all the other tables.
+  def TableNames(self, params):
+    res = [runnable.input.Eval(ParamContext(params))
+           for runnable in self.sources + [self]
+           if runnable.inputtype == 'TABLE']
+    if self.target_table:
+      return res + [self.target_table.Eval(ParamContext(params))]
+    return None if self.inputtype == 'TABLE' else res
+
+  # Runs the commands with run (EvalCommand or CheckCommand).
+  def Execute(self, tables, params, run):
     res = []
     inputdata = self.input.Eval(ParamContext(params))
     prefix = self.prefix.Eval(ParamContext(params)) if self.prefix else ''
@@ -373,14 +913,15 @@ class RunInput(Command):
       try:
         with open(inputdata, 'r') as config_file:
           try:
-            child_command = self.parser(config_file.readlines())
+            child_command = plancache.Parse(config_file.readlines(),
+                                            self.parser)
           except Exception as e:
             self.RaiseFrom('Failure parsing imported file {}'.format(
                 inputdata), e)
       except OSError as e:
         self.RaiseFrom('Failed to open file {}'.format(inputdata), e)
     elif self.inputtype == 'COMMAND':
-      child_command = self.parser([inputdata])
+      child_command = plancache.Parse([inputdata], self.parser)
     elif self.inputtype == 'TABLE':
       source_table = self.Source(self.input, tables, params)
     # Step two: prepare the new parameters for the execution.
@@ -408,7 +949,7 @@ class RunInput(Command):
       if source.inputtype == 'TABLE':
         for tablename in tables:
           grandchild_tables[tablename] = tables[tablename]
-      source.Eval(grandchild_tables, params)
+      run(source, grandchild_tables, params)
       if len(grandchild_tables) != 1:
         self.Raise('Source produced {} tables: {}, expected 1'.format(
             len(grandchild_tables), list(grandchild_tables.keys())))
@@ -425,7 +966,7 @@ class RunInput(Command):
     # Step five: actually execute child
     if self.inputtype in ['FILE', 'COMMAND']:
       try:
-        res = child_command.Eval(child_tables, child_params)
+        res = run(child_command, child_tables, child_params)
       except ValueError as e:
         if self.inputtype == 'FILE':
           self.RaiseFrom('Failure in imported file ' + inputdata, e)
@@ -471,6 +1012,13 @@ class Import(Command):
     self.target_table = options[TARGET_TABLE]
 
   def Eval(self, tables, params):
+    return self.Execute(tables, params, EvalCommand)
+
+  def Check(self, tables, params):
+    self.Execute(tables, params, CheckCommand)
+
+  # Runs the file with run (EvalCommand or CheckCommand).
+  def Execute(self, tables, params, run):
     res = []
     path = self.path.Eval(ParamContext(params))
     prefix = self.prefix.Eval(ParamContext(params)) if self.prefix else ''
@@ -479,7 +1027,8 @@ class Import(Command):
     try:
       with open(path, 'r') as config_file:
         try:
-          child_command = self.parser(config_file.readlines())
+          child_command = plancache.Parse(config_file.readlines(),
+                                          self.parser)
         except Exception as e:
           self.RaiseFrom('Failure parsing imported file {}'.format(path), e)
     except OSError as e:
@@ -513,7 +1062,7 @@ class Import(Command):
       child_params[INPUT_TABLES].append(table_name)
     # Step five: actually execute child
     try:
-      res = child_command.Eval(child_tables, child_params)
+      res = run(child_command, child_tables, child_params)
     except ValueError as e:
       self.RaiseFrom('Failure in imported file ' + path, e)
     finally:
@@ -534,6 +1083,10 @@ class Import(Command):
         tables[new_table_name] = child_tables[table]
     return res
 
+# The evaluation of a column that isn't live (see prune.py).
+def Pruned(context):
+  return None
+
 class SingleExpression:
   def __init__(self, expr, columnname):
     self.expr = expr
@@ -546,13 +1099,51 @@ class SingleExpression:
       raise ValueError('Column {} defined twice'.format(columnname))
     new_header[columnname] = len(new_header)
 
+  # Prepares the evaluation for all the rows of the command, where context
+  # is the single context the command evaluates all the rows in, and shared
+  # holds the subexpressions shared with the other expressions of the command
+  # (see compiler.Shared). Live is the list of whether the new columns are
+  # live (see prune.py), or None if all of them are.
+  def Bind(self, context, shared, live=None):
+    if live is None or live[0]:
+      self.evaluate = compiler.Bind(self.expr, context, shared=shared)
+    else:
+      self.evaluate = Pruned
+
   def AppendValues(self, context, row, header, input_row):
     try:
-      row.append(self.expr.Eval(context))
+      row.append(self.evaluate(context))
     except Exception as e:
       msg = 'Failure evaluating {} (column {}) for row {}: {}'
       raise ValueError(msg.format(
-          self.columnname.Eval(context), len(row) + 1, input_row, str(e))) from e
+          self.columnname.Eval(context), len(row) + 1, Shown(input_row),
+          str(e))) from e
+
+  # The current columns (see CurrExpr) the expression is evaluated for.
+  def CurrentNames(self):
+    return [None]
+
+  # Returns the list of the values of the new column for all the rows of the
+  # table (see columnar.py), or None if they have to be evaluated row by row.
+  def Columns(self, context, table, live=None):
+    if live is not None and not live[0]:
+      return [[None] * len(table.rows)]
+    values = columnar.Evaluate(self.expr, context, table)
+    return None if values is None else [values]
+
+  # Returns the list of the columns the new column is computed from (see
+  # prune.Reads).
+  def Reads(self, context):
+    return [prune.Reads(self.expr, context)]
+
+  # Returns the list of the types of the new column (see check.py), where
+  # keys are the group key columns in aggregations.
+  def Check(self, context, types, keys):
+    try:
+      return [check.Types(self.expr, context, types, keys)]
+    except ValueError as e:
+      raise ValueError('Failure checking {}: {}'.format(
+          self.columnname.Eval(context), str(e))) from e
 
 class RangeExpression:
   def __init__(self, expr, range_beg, range_end, header_expr):
@@ -565,52 +1156,195 @@ class RangeExpression:
     context = RowContext(None, old_header, params)
     self.beg = self.range_beg.Eval(context)
     self.end = self.range_end.Eval(context)
-    old_header_rev = {}
-    for x in old_header:
-      old_header_rev[old_header[x]] = x
+    old_header_rev = context['?names']
+    # The names of the columns in the range.
+    self.columns = []
     for col in range(self.beg - 1, self.end - 1):
       context['?'] = old_header_rev[col]
+      self.columns.append(context['?'])
       col_header = self.header_expr.Eval(context)
       new_header[col_header] = len(new_header)
 
+  # Binds the expression separately for every column in the range. The
+  # columns share the memo for at(), so at(currname()) resolves every name
+  # once.
+  def Bind(self, context, shared, live=None):
+    memo = compiler.ColumnMemo(context)
+    self.evaluators = []
+    for i, name in enumerate(self.columns):
+      if live is not None and not live[i]:
+        self.evaluators.append(Pruned)
+        continue
+      context['?'] = name
+      self.evaluators.append(compiler.Bind(self.expr, context, memo, shared))
+    context.pop('?', None)
+
   def AppendValues(self, context, row, header, input_row):
-    header_rev = {}
-    for name in header:
-      header_rev[header[name]] = name
-    for x in range(self.beg - 1, self.end - 1):
-      context['?'] = header_rev[x]
+    for x, name, evaluate in zip(range(self.beg - 1, self.end - 1),
+                                 self.columns, self.evaluators):
+      context['?'] = name
       try:
-        row.append(self.expr.Eval(context))
+        row.append(evaluate(context))
       except Exception as e:
         msg = 'Failure evaluating {} (column {} in range {}-{}) for row {}'
-        raise ValueError(msg.format(header_rev[x], x+1, self.beg+1,
-                                    self.end+1, input_row) + str(e)) from e
+        raise ValueError(msg.format(name, x+1, self.beg+1, self.end+1,
+                                    Shown(input_row)) + str(e)) from e
       del context['?']
 
+  def CurrentNames(self):
+    return self.columns
+
+  def Columns(self, context, table, live=None):
+    res = []
+    for i, name in enumerate(self.columns):
+      if live is not None and not live[i]:
+        res.append([None] * len(table.rows))
+        continue
+      context['?'] = name
+      values = columnar.Evaluate(self.expr, context, table)
+      if values is None:
+        res = None
+        break
+      res.append(values)
+    context.pop('?', None)
+    return res
+
+  def Reads(self, context):
+    res = []
+    for name in self.columns:
+      context['?'] = name
+      res.append(prune.Reads(self.expr, context))
+    context.pop('?', None)
+    return res
+
+  def Check(self, context, types, keys):
+    res = []
+    for x, name in zip(range(self.beg - 1, self.end - 1), self.columns):
+      context['?'] = name
+      try:
+        res.append(check.Types(self.expr, context, types, keys))
+      except ValueError as e:
+        msg = 'Failure checking {} (column {} in range {}-{}): '
+        raise ValueError(msg.format(name, x+1, self.beg+1,
+                                    self.end+1) + str(e)) from e
+    context.pop('?', None)
+    return res
+
 class Filter(Command):
-  def __init__(self, line, source_table, target_table, expr):
+  def __init__(self, line, source_table, target_table, expr, member=None,
+               negated=False):
     super().__init__(line, "FILTER")
     self.source_table = source_table
     self.target_table = target_table
     self.expr = expr
+    # For FILTER ... IN, the table and the column with the values the value
+    # of the expression is looked up in (and whether it's NOT IN).
+    self.member = member
+    self.negated = negated
 
   def Eval(self, tables, params):
     source_table, target_table = self.SourceAndTarget(
         self.source_table, self.target_table, tables, params)
-    header, rows = tables[source_table]
-    new_rows = []
-    for row in rows:
-      if len(row) != len(header):
-        self.Raise('Row {} has length {}, expected {}'.format(row, len(row),
-            len(header)))
+    members = None
+    if self.member is not None:
+      members = self.Members(tables, params)
+    tables[target_table] = self.Apply(tables[source_table], params, members)
+    return []
+
+  # Returns the set of the values in the column of the table given by IN.
+  def Members(self, tables, params):
+    table, column = self.MemberColumn(tables, params)
+    header, rows = tables[table]
+    if not tabular.Uniform(tables[table]):
+      self.Raise('Rows of table {} have lengths {}, expected {}'.format(
+          table, sorted(view.Widths(rows)), len(header)))
+    return set(view.Column(rows, header[column]))
+
+  # Returns the table and the column given by IN.
+  def MemberColumn(self, tables, params):
+    table = self.Source(self.member[0], tables, params)
+    column = self.member[1].Eval(ParamContext(params))
+    header, _ = tables[table]
+    if check.Known(tables[table]) and column not in header:
+      self.Raise('Column {} not present in table {}, columns are {}'.format(
+          column, table, list(header)))
+    return table, column
+
+  # Returns the filtered table. The members are the values looked up by IN.
+  def Apply(self, table, params, members=None):
+    header, rows = table
+    pushdown = prune.Pushed(self, header)
+    if pushdown and pushdown.pushed:
+      return table
+    uniform = tabular.Uniform(table)
+    # All the rows are evaluated in the same context, we only swap the data.
+    context = RowContext(None, header, params)
+    table = columnar.ForRows(rows, len(header))
+    if table and members is None:
+      values = columnar.Evaluate(self.expr, context, table)
+      if values is not None:
+        return tabular.Table(header, view.Selected(rows, values), True)
+    keep = self.RowFunction(context, header, uniform, members)
+    return tabular.Table(header, [row for row in rows if keep(row)], True)
+
+  # Returns the function evaluating the filter for a row.
+  def RowFunction(self, context, header, uniform=False, members=None):
+    evaluate = compiler.Bind(self.expr, context)
+    if members is not None:
+      key, negated = evaluate, self.negated
+      evaluate = lambda context: (key(context) in members) != negated
+    def Keep(row):
+      context['__data'] = row
       try:
-        val = self.expr.Eval(RowContext(row, header, params))
-        if val:
-          new_rows.append(row)
+        return evaluate(context)
       except Exception as e:
         self.RaiseFrom('Failed to evaluate filter for row '.format(row), e)
-    tables[target_table] = (header, new_rows)
-    return []
+    return self.Checked(header, Keep, uniform)
+
+  # Returns the header of the filtered table, and the function returning the
+  # row if it passes the filter, and None otherwise (see Fuse).
+  def Stage(self, header, params, uniform=False):
+    pushdown = prune.Pushed(self, header)
+    keep = self.RowFunction(RowContext(None, header, params), header, uniform)
+    if pushdown:
+      return header, lambda row: row if pushdown.pushed or keep(row) else None
+    return header, lambda row: row if keep(row) else None
+
+  def TableNames(self, params):
+    names = self.SourceAndTargetNames(params)
+    if self.member is not None:
+      names.append(self.member[0].Eval(ParamContext(params)))
+    return names
+
+  def Check(self, tables, params):
+    source_table, target_table = self.SourceAndTarget(
+        self.source_table, self.target_table, tables, params)
+    source = tables[source_table]
+    if self.member is not None:
+      table, column = self.MemberColumn(tables, params)
+      members = tables[table]
+      prune.Read(members, [members[0][column]] if check.Known(members)
+                 else None)
+    if not check.Known(source):
+      tables[target_table] = source
+      prune.Unchecked(self)
+      return
+    header, types = source
+    context = RowContext(None, header, params)
+    try:
+      check.Types(self.expr, context, types)
+    except ValueError as e:
+      self.RaiseFrom('Failed to check filter', e)
+    tables[target_table] = (header, types)
+    if not prune.Planning():
+      return
+    if self.member is not None:
+      # The rows filtered by IN aren't filtered by the LOAD.
+      prune.Read(source, prune.Reads(self.expr, context))
+      prune.Passed(tables[target_table], [source])
+    else:
+      prune.Filtered(self, source, tables[target_table],
+                     prune.Reads(self.expr, context), context)
 
 class Transform(Command):
   def __init__(self, line, source_table, target_table, expr_list):
@@ -622,37 +1356,218 @@ class Transform(Command):
   def Eval(self, tables, params):
     source_table, target_table = self.SourceAndTarget(
         self.source_table, self.target_table, tables, params)
-    header, rows = tables[source_table]
+    tables[target_table] = self.Apply(tables[source_table], params)
+    return []
+
+  def Header(self, header, params):
     new_header = {}
     for expr in self.expr_list:
       expr.AppendHeader(new_header, header, params)
-    new_rows = []
-    for row in rows:
+    return new_header
+
+  # Returns, for every expression, the list of whether its columns are live
+  # (see prune.py), or None if all of them are. Has to be called after
+  # Header.
+  def Live(self, header):
+    live = prune.Live(self, header)
+    res = []
+    for expr in self.expr_list:
+      count = len(expr.CurrentNames())
+      res.append(None if live is None else live[:count])
+      live = None if live is None else live[count:]
+    return res
+
+  # Returns the transformed table.
+  def Apply(self, table, params):
+    header, rows = table
+    new_header = self.Header(header, params)
+    live = self.Live(header)
+    uniform = tabular.Uniform(table)
+    # The TRANSFORMs only copying columns return views of the rows (see
+    # view.py), if the rows have the right length.
+    copied = self.Copied(header, new_header, params)
+    if copied is not None and uniform:
+      return tabular.Table(new_header, view.Projection(rows, copied), True)
+    # Construct the expression evaluation context. It's shared by all the
+    # rows, we only swap the data.
+    context = RowContext(None, header, params)
+    # The values of the expressions that can be evaluated for all the rows
+    # at once, by columns (see columnar.py).
+    table = columnar.ForRows(rows, len(header))
+    columns = [expr.Columns(context, table, l) if table else None
+               for expr, l in zip(self.expr_list, live)]
+    if all(columns) and sum(map(len, columns)) == len(new_header):
+      return tabular.Table(new_header, [
+          list(row) for row in zip(*[col for cols in columns for col in cols])],
+          True)
+    evaluate = self.RowFunction(context, header, new_header, columns, live,
+                                uniform)
+    return tabular.Table(
+        new_header, [evaluate(row, i) for i, row in enumerate(rows)], True)
+
+  # Returns the (0-indexed) columns copied to the new columns, if all the
+  # expressions only copy columns, or None. Has to be called after Header.
+  def Copied(self, header, new_header, params):
+    context = RowContext(None, header, params)
+    res = []
+    for expr in self.expr_list:
+      for columns in expr.Reads(context):
+        column = prune.Copied(expr.expr, columns)
+        if column is None or column >= len(header):
+          return None
+        res.append(column)
+    return res if len(res) == len(new_header) else None
+
+  # Returns the function computing the new row for a row, copying the given
+  # columns.
+  def CopyFunction(self, header, copied, uniform=False):
+    def Copy(row):
+      return [row[column] for column in copied]
+    return self.Checked(header, Copy, uniform)
+
+  # Binds the expressions that aren't evaluated by columns, and returns the
+  # function computing the new row for a row (the i-th one, for the values
+  # computed by columns).
+  def RowFunction(self, context, header, new_header, columns, live,
+                  uniform=False):
+    shared = compiler.Shared([
+        expr.expr for expr, cols, l in zip(self.expr_list, columns, live)
+        if not cols and (l is None or any(l))])
+    for expr, cols, l in zip(self.expr_list, columns, live):
+      if not cols:
+        expr.Bind(context, shared, l)
+    def Evaluate(row, i=None):
       new_row = []
-      if len(row) != len(header):
-        self.Raise('Row {} has length {}, expected {}'.format(
-            row, len(row), len(header)))
-      # Construct the expression evaluation context
-      for expr in self.expr_list:
-        expr.AppendValues(RowContext(row, header, params), new_row, header, row)
+      context['__data'] = row
+      for expr, cols in zip(self.expr_list, columns):
+        if cols:
+          new_row.extend(col[i] for col in cols)
+        else:
+          expr.AppendValues(context, new_row, header, row)
       if len(new_row) != len(new_header):
         self.Raise('Calculated row {} has length {}, expected {}'.format(
             new_row, len(new_row), len(new_header)))
-      new_rows.append(new_row)
-    tables[target_table] = (new_header, new_rows)
-    return []
+      return new_row
+    return self.Checked(header, Evaluate, uniform)
+
+  # Returns the header of the transformed table, and the function computing
+  # the new row for a row (see Fuse).
+  def Stage(self, header, params, uniform=False):
+    new_header = self.Header(header, params)
+    live = self.Live(header)
+    copied = self.Copied(header, new_header, params)
+    if copied is not None:
+      return new_header, self.CopyFunction(header, copied, uniform)
+    return new_header, self.RowFunction(
+        RowContext(None, header, params), header, new_header,
+        [None] * len(self.expr_list), live, uniform)
+
+  def TableNames(self, params):
+    return self.SourceAndTargetNames(params)
+
+  def Check(self, tables, params):
+    source_table, target_table = self.SourceAndTarget(
+        self.source_table, self.target_table, tables, params)
+    if not check.Known(tables[source_table]):
+      tables[target_table] = check.UNKNOWN
+      prune.Unchecked(self)
+      return
+    source = tables[source_table]
+    header, types = source
+    new_header = {}
+    for expr in self.expr_list:
+      expr.AppendHeader(new_header, header, params)
+    context = RowContext(None, header, params)
+    new_types = []
+    for expr in self.expr_list:
+      try:
+        new_types.extend(expr.Check(context, types, None))
+      except ValueError as e:
+        self.RaiseFrom('Failed to check expressions', e)
+    tables[target_table] = (new_header, new_types)
+    if prune.Planning():
+      reads = []
+      copies = []
+      constants = []
+      asserts = []
+      for expr in self.expr_list:
+        columns = expr.Reads(context)
+        if prune.Asserts(expr.expr):
+          asserts.extend(range(len(reads), len(reads) + len(columns)))
+        reads.extend(columns)
+        copies.extend(prune.Copied(expr.expr, c) for c in columns)
+        constants.extend([isinstance(expr.expr, expression.Constant)] *
+                         len(columns))
+      prune.Computed(self, source, tables[target_table], reads, copies,
+                     constants)
+      if asserts:
+        prune.Read(tables[target_table], asserts)
+
+# The aggregations (see expression.AggregateExpr) evaluated for the rows of
+# the groups, that is the ones in the expression but not inside other
+# aggregations.
+def Aggregations(node):
+  if isinstance(node, expression.AggregateExpr):
+    return [node]
+  return [aggregation for child in optimizer.Children(node)
+          for aggregation in Aggregations(child)]
+
+# Whether the expression reads the same values from the row as from the dict
+# of its columns. Ranges starting before the first column would read the last
+# columns of the row (with negative indices), and fail on the dict.
+def ReadsColumnsOnly(node):
+  if isinstance(node, (expression.RangeExpr, expression.SeatAssignmentExpr)):
+    if not isinstance(node.beg, expression.Constant) or node.beg.val < 1:
+      return False
+  return all(ReadsColumnsOnly(child) for child in optimizer.Children(node))
 
 class Aggregate(Command):
-  def __init__(self, line, source_table, target_table, group_list, expr_list):
+  def __init__(self, line, source_table, grouping_sets, expr_list):
     super().__init__(line, 'AGGREGATE')
     self.source_table = source_table
-    self.target_table = target_table
-    self.group_list = group_list
+    # The pairs of the target table (None for the source table) and the list
+    # of the group keys, one for every output table.
+    self.grouping_sets = grouping_sets
     self.expr_list = expr_list
 
+  # Returns the set of group keys (0-indexed columns).
+  def GroupKeys(self, header, group_list):
+    group_keys = set()
+    for group_key in group_list:
+      if isinstance(group_key, int):
+        group_keys.add(group_key - 1)
+      else:
+        if group_key not in header:
+          self.Raise('Unknown group key {}'.format(group_key))
+        group_keys.add(header[group_key])
+    return group_keys
+
+  # Returns the names of the target tables of the grouping sets.
+  def TargetTables(self, tables, params):
+    target_tables = []
+    for target_table, _ in self.grouping_sets:
+      _, target_table = self.SourceAndTarget(
+          self.source_table, target_table, tables, params)
+      if target_table in target_tables:
+        self.Raise('Target table {} used twice'.format(target_table))
+      target_tables.append(target_table)
+    return target_tables
+
+  # Returns the pairs of the target table name and the set of group keys of
+  # every grouping set.
+  def Targets(self, header, tables, params):
+    return [(target_table, self.GroupKeys(header, group_list))
+            for target_table, (_, group_list) in zip(
+                self.TargetTables(tables, params), self.grouping_sets)]
+
+  # The columns of the group keys of all the grouping sets, which can be read
+  # outside of the aggregations. In the groups of a grouping set, the ones
+  # that aren't a part of its group key are empty.
+  def KeyColumns(self, targets):
+    return set().union(*[group_keys for _, group_keys in targets])
+
   def Eval(self, tables, params):
-    source_table, target_table = self.SourceAndTarget(
-        self.source_table, self.target_table, tables, params)
+    source_table = self.Source(self.source_table, tables, params)
     header, rows = tables[source_table]
 
     # Define the new header.
@@ -660,16 +1575,113 @@ class Aggregate(Command):
     for expr in self.expr_list:
       expr.AppendHeader(new_header, header, params)
 
-    # Accumulate the set of group keys.
-    group_keys = set()
-    for group_key in self.group_list:
-      if isinstance(group_key, int):
-        group_keys.add(group_key - 1)
-      else:
-        if group_key not in header:
-          self.Raise('Unknown group key {}'.format(group_key))
-        group_keys.add(header[group_key])
+    # Accumulate the sets of group keys.
+    targets = self.Targets(header, tables, params)
+    key_columns = self.KeyColumns(targets)
 
+    try:
+      results = self.Accumulate(header, new_header, rows, params,
+                                [group_keys for _, group_keys in targets],
+                                key_columns,
+                                tabular.Uniform(tables[source_table]))
+    except Exception:
+      # Evaluating the groups one by one raises the usual error.
+      results = None
+    if results is None:
+      results = [self.EvalGroups(header, new_header, rows, params, group_keys,
+                                 key_columns)
+                 for _, group_keys in targets]
+    for (target_table, _), new_rows in zip(targets, results):
+      tables[target_table] = tabular.Table(new_header, new_rows, True)
+    return []
+
+  # Returns the context for evaluating the expressions for the groups, where
+  # the data are the values of the group key columns (of the first row).
+  def GroupContext(self, header, params):
+    context = RowContext(None, header, params)
+    shared = compiler.Shared([expr.expr for expr in self.expr_list])
+    for expr in self.expr_list:
+      expr.Bind(context, shared)
+    return context
+
+  def GroupData(self, header, group_keys, key_columns, row):
+    return {header[column]: row[header[column]]
+            if header[column] in group_keys else ''
+            for column in header if header[column] in key_columns}
+
+  def NewRow(self, context, header, new_header):
+    # The 'debug' row value
+    debug_row = [context['__data'][x] for x in context['__data']]
+    # Calculate the expressions.
+    new_row = []
+    for expr in self.expr_list:
+      expr.AppendValues(context, new_row, header, debug_row)
+    if len(new_row) != len(new_header):
+      self.Raise('Calculated row {} has length {}, expected {}'.format(
+          new_row, len(new_row), len(new_header)))
+    return new_row
+
+  # Evaluates the aggregations in a single pass over the rows, keeping just
+  # the accumulated value of every aggregation (in every expression, and for
+  # every column of the ranges) for every group of every grouping set.
+  # Returns the lists of the new rows of the grouping sets, or None if the
+  # aggregations have to be evaluated over the groups of rows (like when the
+  # rows aren't uniform, see tabular.py).
+  def Accumulate(self, header, new_header, rows, params, group_keys_list,
+                 key_columns, uniform):
+    if not uniform:
+      return None
+    # The aggregated expressions are evaluated in a context for every current
+    # column, with the row (instead of the dict of its columns) as the data.
+    contexts = {}
+    keys = []
+    aggregations = []
+    for expr in self.expr_list:
+      for name in expr.CurrentNames():
+        if name not in contexts:
+          contexts[name] = RowContext(None, header, params)
+          if name is not None:
+            contexts[name]['?'] = name
+        for node in Aggregations(expr.expr):
+          if not ReadsColumnsOnly(node.child):
+            return None
+          keys.append((id(node), name))
+          aggregations.append((contexts[name], compiler.Bind(
+              node.child, contexts[name]), node.op, node.base))
+    contexts = list(contexts.values())
+    bases = [base for _, _, _, base in aggregations]
+
+    # Every row is evaluated once, and accumulated into its group in every
+    # grouping set.
+    grouping_sets = [(group_keys, {}) for group_keys in group_keys_list]
+    for row in rows:
+      for context in contexts:
+        context['__data'] = row
+      values = [evaluate(context) for context, evaluate, _, _ in aggregations]
+      for group_keys, groups in grouping_sets:
+        agg_key = tuple([row[key] for key in group_keys])
+        if agg_key not in groups:
+          groups[agg_key] = (row, list(bases))
+        accumulated = groups[agg_key][1]
+        for i, (_, _, op, _) in enumerate(aggregations):
+          accumulated[i] = op(accumulated[i], values[i])
+
+    context = self.GroupContext(header, params)
+    results = []
+    for group_keys, groups in grouping_sets:
+      new_rows = []
+      for row, accumulated in groups.values():
+        context['__data'] = self.GroupData(header, group_keys, key_columns, row)
+        context['__group_data'] = expression.Accumulated(
+            dict(zip(keys, accumulated)))
+        new_rows.append(self.NewRow(context, header, new_header))
+      results.append(new_rows)
+    return results
+
+  # Evaluates the expressions for every group, with the list of the rows of
+  # the group as the __group_data.
+  def EvalGroups(self, header, new_header, rows, params, group_keys,
+                 key_columns):
     # Accumulate the set of groups, and rows associated with each.
     groups = {}
     for row in rows:
@@ -677,53 +1689,93 @@ class Aggregate(Command):
       if agg_key not in groups:
         groups[agg_key] = []
       groups[agg_key].append(row)
-    
-    # Calculate the new rows.
+
+    # Calculate the new rows. The evaluation context is shared by all the
+    # groups, we only swap the data.
+    context = self.GroupContext(header, params)
     new_rows = []
     for agg_key in groups:
       # Define the evaluation context.
-      context = RowContext(None, header, params)
-      context['__group_data'] = [{} for _ in groups[agg_key]]
-      context['__data'] = {}
-      for column in header:
-        col_num = header[column]
-        if col_num in group_keys:
-          context['__data'][col_num] = groups[agg_key][0][col_num]
-        else:
-          for i, row in enumerate(groups[agg_key]):
-            context['__group_data'][i][col_num] = row[col_num]
-      # The 'debug' row value
-      debug_row = [context['__data'][x] for x in context['__data']]
-      # Calculate the expressions.
-      new_row = []
+      context['__data'] = self.GroupData(header, group_keys, key_columns,
+                                         groups[agg_key][0])
+      context['__group_data'] = [
+          {header[column]: row[header[column]] for column in header
+           if header[column] not in group_keys}
+          for row in groups[agg_key]]
+      new_rows.append(self.NewRow(context, header, new_header))
+    return new_rows
+
+  def TableNames(self, params):
+    source_table = self.source_table.Eval(ParamContext(params))
+    return [source_table] + [
+        source_table if target_table is None else
+        target_table.Eval(ParamContext(params))
+        for target_table, _ in self.grouping_sets]
+
+  def Check(self, tables, params):
+    source_table = self.Source(self.source_table, tables, params)
+    if not check.Known(tables[source_table]):
+      for target_table in self.TargetTables(tables, params):
+        tables[target_table] = check.UNKNOWN
+      return
+    header, types = tables[source_table]
+    targets = self.Targets(header, tables, params)
+    new_header = {}
+    for expr in self.expr_list:
+      expr.AppendHeader(new_header, header, params)
+    key_columns = self.KeyColumns(targets)
+    context = RowContext(None, header, params)
+    source = tables[source_table]
+    prune.Read(source, key_columns)
+    for target_table, group_keys in targets:
+      # The key columns that aren't a part of the group key are empty.
+      set_types = [check.Filled(typ)
+                   if column in key_columns - group_keys else typ
+                   for column, typ in enumerate(types)]
+      new_types = []
       for expr in self.expr_list:
-        expr.AppendValues(context, new_row, header, debug_row)
-      if len(new_row) != len(new_header):
-        self.Raise('Calculated row {} has length {}, expected {}'.format(
-            new_row, len(new_row), len(new_header)))
-      new_rows.append(new_row)
-
-    tables[target_table] = (new_header, new_rows)
-    return []
+        try:
+          new_types.extend(expr.Check(context, set_types, key_columns))
+        except ValueError as e:
+          self.RaiseFrom('Failed to check expressions', e)
+      tables[target_table] = (new_header, new_types)
+      # All the expressions are evaluated, even if their values aren't read.
+      if prune.Planning():
+        for expr in self.expr_list:
+          for columns in expr.Reads(context):
+            prune.Read(source, columns)
+
+# Whether the keys are in increasing order (and can be compared at all).
+def Sorted(keys):
+  try:
+    return all(a <= b for a, b in zip(keys, itertools.islice(keys, 1, None)))
+  except TypeError:
+    return False
 
 class Join(Command):
-  def __init__(self, line, left_table, right_table, target_table,
-               left_expr, right_expr, comparator, unmatched_keys,
-               unmatched_values):
+  def __init__(self, line, left_tables, right_table, target_table,
+               left_exprs, right_exprs, comparator, unmatched_keys,
+               unmatched_values, longest_prefix=False):
     super().__init__(line, 'JOIN')
-    self.left_table = left_table
+    # More than one left table are joined into the right one at once (see
+    # StarRows).
+    self.left_tables = left_tables
     self.right_table = right_table
     self.target_table = target_table
-    self.left_expr = left_expr
-    self.right_expr = right_expr
+    self.left_exprs = left_exprs
+    self.right_exprs = right_exprs
     self.comparator = comparator
     self.unmatched_keys = unmatched_keys
     self.unmatched_values = unmatched_values
+    self.longest_prefix = longest_prefix
 
-  def FindRow(self, keys, key, left_table):
-    for x in keys:
-      empty_row = [''] * len(keys[x][0])
-      break
+  # Returns the distinct lengths of the (string) keys, in increasing order, so
+  # that PREFIX looks up the prefixes of these lengths only.
+  def PrefixLengths(self, keys):
+    return sorted(set(len(key) for key in keys if isinstance(key, str)))
+
+  # The empty_row is the row matched to the unmatched values.
+  def FindRow(self, keys, key, left_table, lengths, empty_row):
     if self.comparator == 'EQ':
       if key not in keys:
         if self.unmatched_values:
@@ -733,12 +1785,14 @@ class Join(Command):
       return keys[key][0]
     elif self.comparator == 'PREFIX':
       found_prefix = None
-      for preflen in range(len(key)+1):
-        if key[:preflen] in keys:
+      for preflen in reversed(lengths) if self.longest_prefix else lengths:
+        if preflen <= len(key) and key[:preflen] in keys:
           if found_prefix is not None:
             self.Raise('Found two prefixes matching {}: {} and {}'.format(
                 key, found_prefix, key[:preflen]))
           found_prefix = key[:preflen]
+          if self.longest_prefix:
+            break
       if found_prefix is None:
         if self.unmatched_values:
           return empty_row
@@ -746,42 +1800,292 @@ class Join(Command):
       keys[found_prefix][1] = True
       return keys[found_prefix][0]
 
-  def Eval(self, tables, params):
-    left_table = self.Source(self.left_table, tables, params)
-    left_header, left_rows = tables[left_table]
-    right_table = self.Source(self.right_table, tables, params)
-    right_header, right_rows = tables[right_table]
+  def Target(self, tables, sources, params):
     target_table = self.target_table.Eval(ParamContext(params))
-    if target_table in tables and target_table not in [left_table, right_table]:
+    if target_table in tables and target_table not in sources:
       self.Raise('Cannot create table {}, it already exists'.format(
           target_table))
+    return target_table
+
+  # Returns the header of the joined table, with the columns of the tables
+  # (with the given headers) one after another.
+  def Header(self, headers):
     header = {}
-    for column in left_header:
-      header[column] = left_header[column]
-    for column in right_header:
-      header[column] = right_header[column] + len(left_header)
-    keys = {}
-    rows = []
-    for row in left_rows:
-      context = RowContext(row, left_header, params)
-      keys[self.left_expr.Eval(context)] = [row, False]
-    for row in right_rows:
-      context = RowContext(row, right_header, params)
-      key = self.right_expr.Eval(context)
-      rows.append(self.FindRow(keys, key, left_table) + row)
+    offset = 0
+    for table_header in headers:
+      for column in table_header:
+        header[column] = table_header[column] + offset
+      offset += len(table_header)
+    return header
+
+  def Eval(self, tables, params):
+    left_tables = [self.Source(table, tables, params)
+                   for table in self.left_tables]
+    right_table = self.Source(self.right_table, tables, params)
+    target_table = self.Target(tables, left_tables + [right_table], params)
+    sources = [tables[table] for table in left_tables + [right_table]]
+    header = self.Header([table_header for table_header, _ in sources])
+    if len(left_tables) > 1:
+      rows = self.StarRows(tables, left_tables, right_table, params)
+    else:
+      rows = self.PairRows(tables, left_tables[0], right_table, params)
+    # The rows are concatenated when they're read (see view.py).
+    uniform = (all(tabular.Uniform(table) for table in sources) and
+               len(header) == sum(len(table_header)
+                                  for table_header, _ in sources))
+    tables[target_table] = tabular.Table(header, view.Joined(rows), uniform)
+    return []
+
+  # Returns the pairs of the matched rows of the left and the right table.
+  # The way of joining them is chosen from the inputs, and gives the same
+  # rows, in the same order:
+  # - 'probe' (ProbeRows): for a right table smaller than the (uniform) left
+  #   one, only the left rows with the keys of the right rows are kept. Not
+  #   with INSERT MISSING KEYS, which returns all the unmatched left rows, so
+  #   it has to keep them all anyway.
+  # - 'merge' (MergeRows): if the keys of both tables are already in
+  #   increasing order. Sorting them would cost more than hashing them.
+  # - 'hash' (HashRows): the right keys are looked up in the dict of the left
+  #   keys. Also for PREFIX, which looks up the prefixes of the right keys.
+  def PairRows(self, tables, left_table, right_table, params):
+    left_header, left_rows = tables[left_table]
+    right_header, right_rows = tables[right_table]
+    left_keys = self.Keys(self.left_exprs, left_header, left_rows, params)
+    # The keys of the right rows are computed first, to choose the way of
+    # joining. If any of them fails, they're computed when they're looked up
+    # (after all the left keys), which raises the usual error.
+    try:
+      right_keys = list(
+          self.Keys(self.right_exprs, right_header, right_rows, params))
+    except Exception:
+      right_keys = None
+    # The rows matched to the unmatched values, and to the missing keys.
+    empty_left = [''] * len(left_header)
+    empty_row = [''] * len(right_header)
     for row in right_rows:
       empty_row = [''] * len(row)
       break
-    if self.unmatched_keys in ['RAISE', 'INCLUDE']:
-      for key in keys:
-        if not keys[key][1]:
-          if self.unmatched_keys == 'INCLUDE':
-            rows.append(keys[key][0] + empty_row)
-          else:
-            self.Raise('Key {} from {} not matched by any value'.format(
-                key, left_table))
-    tables[target_table] = (header, rows)
-    return []
+    rows = None
+    if self.comparator == 'EQ' and right_keys is not None:
+      if (self.unmatched_keys != 'INCLUDE' and len(right_rows) < len(left_rows)
+          and tabular.Uniform(tables[left_table])):
+        JOIN_STRATEGIES['probe'] += 1
+        return self.ProbeRows(left_rows, left_keys, right_rows, right_keys,
+                              left_table, empty_left)
+      if Sorted(right_keys):
+        left_keys = list(left_keys)
+        if Sorted(left_keys):
+          try:
+            rows = self.MergeRows(left_rows, left_keys, right_rows,
+                                  right_keys, left_table, empty_left,
+                                  empty_row)
+            JOIN_STRATEGIES['merge'] += 1
+          except TypeError:
+            rows = None
+    if rows is None:
+      if right_keys is None:
+        right_keys = self.Keys(self.right_exprs, right_header, right_rows,
+                               params)
+      rows = self.HashRows(left_rows, left_keys, right_rows, right_keys,
+                           left_table, empty_left, empty_row)
+      JOIN_STRATEGIES['hash'] += 1
+    return rows
+
+  # Returns the tuples of the rows of the left tables matched to every right
+  # row, followed by the right row, looking the right key up in the dicts of
+  # the keys of all the left tables in a single pass over the right rows.
+  # Every left table is matched as if it was joined into the right table by
+  # itself (so the missing keys can't be included).
+  def StarRows(self, tables, left_tables, right_table, params):
+    lookups = []
+    for left_table in left_tables:
+      left_header, left_rows = tables[left_table]
+      keys = {}
+      for key, row in zip(
+          self.Keys(self.left_exprs, left_header, left_rows, params),
+          left_rows):
+        keys[key] = [row, False]
+      lengths = (self.PrefixLengths(keys) if self.comparator == 'PREFIX'
+                 else None)
+      empty_left = [''] * len(left_header)
+      for x in keys:
+        empty_left = [''] * len(keys[x][0])
+        break
+      lookups.append((left_table, keys, lengths, empty_left))
+    right_header, right_rows = tables[right_table]
+    rows = []
+    for key, row in zip(
+        self.Keys(self.right_exprs, right_header, right_rows, params),
+        right_rows):
+      rows.append(tuple(
+          self.FindRow(keys, key, left_table, lengths, empty_left)
+          for left_table, keys, lengths, empty_left in lookups) + (row,))
+    for left_table, keys, _, _ in lookups:
+      self.AddUnmatched(
+          rows, ((key, keys[key][0], keys[key][1]) for key in keys),
+          left_table, None)
+    return rows
+
+  # Returns the generator of the keys of the rows (the tuples of the values of
+  # the expressions, if there's more than one).
+  def Keys(self, exprs, header, rows, params):
+    context = RowContext(None, header, params)
+    keys = [compiler.Bind(expr, context) for expr in exprs]
+    key = keys[0]
+    if len(keys) > 1:
+      key = lambda context: tuple(key(context) for key in keys)
+    for row in rows:
+      context['__data'] = row
+      yield key(context)
+
+  # Returns the pairs of the matched rows, looking the right keys up in the
+  # dict of the left keys. The unmatched values are matched to the empty_left
+  # (as wide as the first left row), and the missing keys to the empty_row.
+  def HashRows(self, left_rows, left_keys, right_rows, right_keys, left_table,
+               empty_left, empty_row):
+    keys = {}
+    for key, row in zip(left_keys, left_rows):
+      keys[key] = [row, False]
+    lengths = self.PrefixLengths(keys) if self.comparator == 'PREFIX' else None
+    for x in keys:
+      empty_left = [''] * len(keys[x][0])
+      break
+    rows = [(self.FindRow(keys, key, left_table, lengths, empty_left), row)
+            for key, row in zip(right_keys, right_rows)]
+    self.AddUnmatched(rows, ((key, keys[key][0], keys[key][1]) for key in keys),
+                      left_table, empty_row)
+    return rows
+
+  # Returns the pairs of the matched rows, for a right table smaller than the
+  # left one, keeping only the left rows with the keys of the right rows (the
+  # last one for every key, as in HashRows). Of the keys that aren't matched,
+  # only the first one is kept, for RAISE UNMATCHED KEYS.
+  def ProbeRows(self, left_rows, left_keys, right_rows, right_keys,
+                left_table, empty_left):
+    wanted = set(right_keys)
+    found = {}
+    unmatched = []
+    for key, row in zip(left_keys, left_rows):
+      if key in wanted:
+        found[key] = row
+      elif not unmatched:
+        unmatched.append(key)
+    rows = []
+    for key, row in zip(right_keys, right_rows):
+      if key in found:
+        rows.append((found[key], row))
+      elif self.unmatched_values:
+        rows.append((empty_left, row))
+      else:
+        self.Raise('Failed to find key {} in table {}'.format(key, left_table))
+    if unmatched and self.unmatched_keys == 'RAISE':
+      self.Raise('Key {} from {} not matched by any value'.format(
+          unmatched[0], left_table))
+    return rows
+
+  # Returns the pairs of the matched rows, for the keys of both tables in
+  # increasing order, by merging them.
+  def MergeRows(self, left_rows, left_keys, right_rows, right_keys, left_table,
+                empty_left, empty_row):
+    # The distinct left keys, with the last row of each (as in HashRows), and
+    # whether the key is matched.
+    keys = []
+    found = []
+    for key, row in zip(left_keys, left_rows):
+      if keys and keys[-1] == key:
+        found[-1] = row
+      else:
+        keys.append(key)
+        found.append(row)
+    matched = bytearray(len(keys))
+    if found:
+      empty_left = [''] * len(found[0])
+    rows = []
+    i = 0
+    for key, row in zip(right_keys, right_rows):
+      while i < len(keys) and keys[i] < key:
+        i += 1
+      if i < len(keys) and keys[i] == key:
+        matched[i] = True
+        rows.append((found[i], row))
+      elif self.unmatched_values:
+        rows.append((empty_left, row))
+      else:
+        self.Raise('Failed to find key {} in table {}'.format(key, left_table))
+    self.AddUnmatched(rows, zip(keys, found, matched), left_table, empty_row)
+    return rows
+
+  # Adds the pairs of the left rows whose keys (given as the key, the row, and
+  # whether it's matched) aren't matched, with the empty_row, or raises,
+  # depending on the option for the unmatched keys.
+  def AddUnmatched(self, rows, keys, left_table, empty_row):
+    if self.unmatched_keys not in ['RAISE', 'INCLUDE']:
+      return
+    for key, row, matched in keys:
+      if not matched:
+        if self.unmatched_keys == 'INCLUDE':
+          rows.append((row, empty_row))
+        else:
+          self.Raise('Key {} from {} not matched by any value'.format(
+              key, left_table))
+
+  def TableNames(self, params):
+    return [table.Eval(ParamContext(params)) for table in
+            self.left_tables + [self.right_table, self.target_table]]
+
+  # Returns the columns read by the key expressions (see prune.Reads), or None
+  # if any of them can read any column.
+  def KeyReads(self, exprs, context):
+    res = set()
+    for expr in exprs:
+      reads = prune.Reads(expr, context)
+      if reads is None:
+        return None
+      res.update(reads)
+    return res
+
+  def Check(self, tables, params):
+    left_tables = [self.Source(table, tables, params)
+                   for table in self.left_tables]
+    right_table = self.Source(self.right_table, tables, params)
+    target_table = self.Target(tables, left_tables + [right_table], params)
+    lefts, right = [tables[table] for table in left_tables], tables[right_table]
+    if not all(check.Known(table) for table in lefts + [right]):
+      for table in lefts + [right]:
+        prune.Read(table)
+      tables[target_table] = check.UNKNOWN
+      return
+    left_contexts = [RowContext(None, left_header, params)
+                     for left_header, _ in lefts]
+    right_header, right_types = right
+    right_context = RowContext(None, right_header, params)
+    try:
+      for (_, left_types), left_context in zip(lefts, left_contexts):
+        for expr in self.left_exprs:
+          check.Types(expr, left_context, left_types)
+      key_types = [check.Types(expr, right_context, right_types)
+                   for expr in self.right_exprs][0]
+    except ValueError as e:
+      self.RaiseFrom('Failed to check the keys', e)
+    if prune.Planning():
+      for left, left_context in zip(lefts, left_contexts):
+        prune.Read(left, self.KeyReads(self.left_exprs, left_context))
+      prune.Read(right, self.KeyReads(self.right_exprs, right_context))
+    if self.comparator == 'PREFIX' and not check.IsString(key_types):
+      self.Raise('Keys matched by prefix have to be strings, got {}'.format(
+          ' or '.join(key_types)))
+    # The unmatched rows are filled with empty strings.
+    types = []
+    for _, left_types in lefts:
+      if self.unmatched_values:
+        left_types = [check.Filled(typ) for typ in left_types]
+      types.extend(left_types)
+    if self.unmatched_keys == 'INCLUDE':
+      right_types = [check.Filled(typ) for typ in right_types]
+    tables[target_table] = (
+        self.Header([table_header for table_header, _ in lefts + [right]]),
+        types + right_types)
+    prune.Passed(tables[target_table], lefts + [right])
 
 class Append(Command):
   def __init__(self, line, expr_list, table):
@@ -793,13 +2097,33 @@ class Append(Command):
     table = self.Source(self.table, tables, params)
     row = []
     for expr in self.expr_list:
-      row.append(expr.Eval({}))
-    if len(row) != len(tables[table][0]):
+      row.append(expr.Eval(ParamContext(params)))
+    header, rows = tables[table]
+    if len(row) != len(header):
       self.Raise('Provided {} values, while table {} has {} columns'.format(
-          len(row), table, len(tables[table][0])))
-    tables[table][1].append(row)
+          len(row), table, len(header)))
+    if isinstance(rows, view.View):
+      rows = list(rows)
+      tables[table] = tabular.WithRows(tables[table], rows)
+    rows.append(row)
     return []
 
+  def TableNames(self, params):
+    return [self.table.Eval(ParamContext(params))]
+
+  def Check(self, tables, params):
+    table = self.Source(self.table, tables, params)
+    row = [expr.Eval(ParamContext(params)) for expr in self.expr_list]
+    if not check.Known(tables[table]):
+      return
+    prune.Written(tables[table])
+    header, types = tables[table]
+    if len(row) != len(header):
+      self.Raise('Provided {} values, while table {} has {} columns'.format(
+          len(row), table, len(header)))
+    for i, val in enumerate(row):
+      types[i] = check.Union(types[i], [check.ValueType(val)])
+
 class Drop(Command):
   def __init__(self, line, table):
     super().__init__(line, 'DROP')
@@ -810,6 +2134,12 @@ class Drop(Command):
     del tables[target]
     return []
 
+  def TableNames(self, params):
+    return [self.table.Eval(ParamContext(params))]
+
+  def Check(self, tables, params):
+    self.Eval(tables, params)
+
 class Output(Command):
   def __init__(self, line, tables):
     super().__init__(line, 'OUTPUT TABLES')
@@ -827,6 +2157,12 @@ class Output(Command):
       del tables[table]
     return []
 
+  def TableNames(self, params):
+    return [table.Eval(ParamContext(params)) for table in self.tables]
+
+  def Check(self, tables, params):
+    self.Eval(tables, params)
+
 class Input(Command):
   def __init__(self, line, tables):
     super().__init__(line, 'INPUT TABLES')
@@ -849,6 +2185,9 @@ class Input(Command):
       self.Source(t, tables, params)
     return []
 
+  def Check(self, tables, params):
+    self.Eval(tables, params)
+
 class Pivot(Command):
   def __init__(self, line, source, target, headers_from, headers_to):
     super().__init__(line, 'PIVOT')
@@ -857,6 +2196,17 @@ class Pivot(Command):
     self.headers_from = headers_from
     self.headers_to = headers_to
 
+  # Returns the name of the column with the new headers.
+  def HeadersFrom(self, source, old_header, params):
+    headers_from = self.headers_from.Eval(
+        RowContext(None, old_header, params))
+    if headers_from not in old_header:
+      self.Raise(
+        ('Source table {} does not have requested header column {}, ' +
+        'present columns are {}').format(
+            source, headers_from, old_header.keys()))
+    return headers_from
+
   def Eval(self, tables, params):
     source, target = self.SourceAndTarget(
         self.source, self.target, tables, params)
@@ -866,13 +2216,7 @@ class Pivot(Command):
     rows = []
     # Prepare the new header lambda, and the skipped row.
     if self.headers_from:
-      headers_from = self.headers_from.Eval(
-          RowContext(None, old_header, params))
-      if headers_from not in old_header:
-        self.Raise(
-          ('Source table {} does not have requested header column {}, ' +
-          'present columns are {}').format(
-              source, headers_from, old_header.keys()))
+      headers_from = self.HeadersFrom(source, old_header, params)
       header_column_index = old_header[headers_from]
       skipped_source_col = header_column_index
       header_for_row = lambda i, row: row[header_column_index]
@@ -910,9 +2254,24 @@ class Pivot(Command):
       for j, val in enumerate(row):
         if target_row(j) is not None:
           rows[target_row(j)].append(val)
-    tables[target] = (header, rows)
+    tables[target] = tabular.Table(header, rows)
     return []
 
+  def TableNames(self, params):
+    source = self.source.Eval(ParamContext(params))
+    if self.target is None:
+      return [source, source]
+    return [source, self.target.Eval(ParamContext(params))]
+
+  # The new columns come from the rows.
+  def Check(self, tables, params):
+    source, target = self.SourceAndTarget(
+        self.source, self.target, tables, params)
+    if self.headers_from and check.Known(tables[source]):
+      self.HeadersFrom(source, tables[source][0], params)
+    prune.Read(tables[source])
+    tables[target] = check.UNKNOWN
+
 class Visualize(Command):
   def __init__(self, line, table, outfile, base, colours, idname, dataname,
                lowb, highb, legend, header, title):
@@ -936,6 +2295,15 @@ class Visualize(Command):
           name, header.keys()))
     return header[name]
 
+  def Bounds(self):
+    if self.lowbound is None and self.highbound is not None:
+      self.Raise('High bound specified, but low bound is not')
+    if self.highbound is None and self.lowbound is not None:
+      self.Raise('Low bound specified, but high bound is not')
+    high = float(self.highbound) if self.highbound is not None else None
+    low = float(self.lowbound) if self.lowbound is not None else None
+    return low, high
+
   def Eval(self, tables, params):
     header, rows = tables[self.Source(self.table, tables, params)]
     idcol = self.GetColumnIndex(self.idname, params, header)
@@ -945,18 +2313,29 @@ class Visualize(Command):
     map_header = self.header.Eval(ParamContext(params))
     map_title = self.title.Eval(ParamContext(params))
     data = {}
-    if self.lowbound is None and self.highbound is not None:
-      self.Raise('High bound specified, but low bound is not')
-    if self.highbound is None and self.lowbound is not None:
-      self.Raise('Low bound specified, but high bound is not')
-    high = float(self.highbound) if self.highbound is not None else None
-    low = float(self.lowbound) if self.lowbound is not None else None
+    low, high = self.Bounds()
     for row in rows:
       data[row[idcol]] = row[datacol]
     try:
+      # Imported here, as it pulls in imageio (and numpy), which takes longer
+      # to load than everything else, and most configs don't visualize.
+      import visualize
       visualize.Visualize(data, outfile, base, self.colours, low, high,
                           self.legend, map_header, map_title)
     except Exception as e:
       self.RaiseFrom('Failed to visualize', e)
     return []
 
+  def TableNames(self, params):
+    return [self.table.Eval(ParamContext(params))]
+
+  def Check(self, tables, params):
+    table = tables[self.Source(self.table, tables, params)]
+    prune.Read(table)
+    if check.Known(table):
+      self.GetColumnIndex(self.idname, params, table[0])
+      self.GetColumnIndex(self.dataname, params, table[0])
+    for expr in [self.base, self.outfile, self.header, self.title]:
+      expr.Eval(ParamContext(params))
+    self.Bounds()
+
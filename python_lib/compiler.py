@@ -0,0 +1,522 @@
+# Compiles expressions (see expression.py) into Python functions.
+#
+# Walking the expression tree costs a method call (and usually a try/except)
+# per node, for every row - or, in FOR ranges, for every cell. Instead,
+# Compile generates the source of a single function that computes the whole
+# expression in straight-line code (the value of every node is assigned to a
+# separate local variable), and builds it with compile(). Nodes that the
+# compiler doesn't know how to inline are evaluated by calling their Eval
+# from the generated code.
+#
+# The generated code is compiled once per expression, and then bound to the
+# context of every command that evaluates it (see Bind): column references
+# become fixed indices into the row, resolved before the row loop starts.
+#
+# Subexpressions that don't depend on the row (like $year, index("district")
+# + 1 or currname() + "_total") are evaluated once, when binding, and the
+# code just reads their values.
+#
+# The expressions of a single command (like the columns of a TRANSFORM) can
+# share subexpressions (see Shared): a subexpression that appears more than
+# once is computed once per row, and the other occurrences reuse the value.
+#
+# The generated code doesn't produce any error messages of its own. When it
+# raises, the function evaluates the expression again by walking the tree,
+# and the tree raises the same error (naming the failing node and its
+# position in the config) that it always did. Expressions have no side
+# effects, so evaluating them twice is safe.
+
+import operator
+
+import expression
+import optimizer
+
+# Set to False to evaluate all expressions by walking the tree.
+ENABLED = True
+
+# The ops of BinaryExpr, UnaryExpr and TernaryExpr that we write out as
+# Python code. Other ops are called as functions. Note that all arguments
+# are always evaluated (and, and or don't short-circuit), just like in the
+# tree.
+BINARY_TEMPLATES = {
+  operator.add: '{} + {}',
+  operator.sub: '{} - {}',
+  operator.mul: '{} * {}',
+  operator.truediv: '{} / {}',
+  operator.eq: '{} == {}',
+  operator.lt: '{} < {}',
+  operator.gt: '{} > {}',
+  operator.contains: '{1} in {0}',
+  expression.logical_and: '{} and {}',
+  expression.logical_or: '{} or {}',
+  expression.string_beginning: '({})[:{}]',
+  expression.string_end: '({})[{}:]',
+  expression.startswith: '({}).startswith({})',
+}
+UNARY_TEMPLATES = {
+  operator.not_: 'not {}',
+}
+TERNARY_TEMPLATES = {
+  expression.substr: '({})[{}:{}]',
+  expression.replace: '({}).replace({}, {})',
+}
+
+# Constants of these types are written into the code as literals, other
+# constants are passed in as globals.
+LITERAL_TYPES = (bool, int, str)
+
+# Evaluates an aggregation (see expression.AggregateExpr), with the child
+# expression already compiled. The context is restored even if the child
+# fails, so that the tree can evaluate the expression again.
+def Aggregate(node, child, context):
+  if isinstance(context['__group_data'], expression.Accumulated):
+    return context['__group_data'].Value(node, context)
+  acc, op = node.base, node.op
+  original_data = context['__data']
+  group_context = context.pop('__group_data')
+  try:
+    for inner_context in group_context:
+      context['__data'] = original_data | inner_context
+      acc = op(acc, child(context))
+  finally:
+    context['__data'] = original_data
+    context['__group_data'] = group_context
+  return acc
+
+# Besides the column names, the context holds special keys (see context.md),
+# which all start with '?' or '__'. at() with one of those has to be
+# evaluated by the tree.
+def IsColumnName(name):
+  return (isinstance(name, str) and not name.startswith('?') and
+          not name.startswith('__'))
+
+# Returns the 0-indexed column that at(arg) refers to in the context, or None
+# if at(arg) fails (or can't be resolved without the tree).
+def ResolveColumn(context, arg):
+  if IsColumnName(arg):
+    index = context.get(arg)
+  elif type(arg) == int:
+    index = arg
+  else:
+    return None
+  if index is None or index <= 0 or index >= context['?last']:
+    return None
+  return index - 1
+
+# The per-command memo for at() with arguments that aren't constant, like
+# at(currname() + "_total"). Maps the argument to the column index, so that
+# every name is resolved once per command, and not for every row. Arguments
+# that can't be resolved raise a KeyError, and get evaluated by the tree.
+class ColumnMemo(dict):
+  def __init__(self, context):
+    super().__init__()
+    self.context = context
+
+  def __missing__(self, arg):
+    index = ResolveColumn(self.context, arg)
+    if index is None:
+      raise KeyError(arg)
+    self[arg] = index
+    return index
+
+# The value of a hoisted subexpression that failed to evaluate when binding.
+# The generated code raises when it needs such a value, so the expression
+# gets evaluated by the tree, which reports the error.
+class Failed:
+  pass
+
+FAILED = Failed()
+
+# The values of the shared subexpressions of a command. `keys` maps the
+# signatures of the shared subexpressions (see optimizer.Signature) to
+# indices in `values`, which hold the value of the subexpression computed
+# for the row at the same index in `rows`.
+class SharedValues:
+  def __init__(self, signatures):
+    self.keys = {signature: key for key, signature in enumerate(signatures)}
+    self.values = [None] * len(self.keys)
+    self.rows = [None] * len(self.keys)
+    # Maps ids of expressions to the signatures of their shared
+    # subexpressions.
+    self.used = {}
+
+# Nodes that don't read the row (or the group), but only the parts of the
+# context that are the same for the whole command (or column, in ranges).
+INVARIANT_LEAVES = (expression.Constant, expression.NumColumnsExpr,
+                    expression.CurrNameExpr)
+# Nodes that don't read the row if their children don't.
+INVARIANT_IF_CHILDREN_ARE = (
+    expression.BinaryExpr, expression.UnaryExpr, expression.TernaryExpr,
+    expression.If, expression.ParamExpr, expression.IndexExpr,
+    expression.NameExpr, expression.MemoExpr)
+
+def Nodes(node):
+  yield node
+  for child in optimizer.Children(node):
+    yield from Nodes(child)
+
+# Looking a value up in a memo (see expression.MemoExpr) from the compiled
+# code is only faster than computing it if it costs at least this much.
+MIN_MEMO_COST = 20
+
+# Nodes that go over many values (of a group, or of a range of columns).
+EXPENSIVE = (expression.AggregateExpr, expression.RangeExpr,
+             expression.SeatAssignmentExpr)
+EXPENSIVE_COST = 100
+# Reading a shared value costs about as much as computing a few arithmetic
+# operations, so only subexpressions with at least this cost (counted in
+# nodes, see Cost) are shared.
+MIN_SHARED_COST = 8
+
+def Cost(node, memo):
+  if id(node) not in memo:
+    if isinstance(node, EXPENSIVE):
+      memo[id(node)] = EXPENSIVE_COST
+    else:
+      memo[id(node)] = 1 + sum(Cost(child, memo)
+                               for child in optimizer.Children(node))
+  return memo[id(node)]
+
+# Whether it makes sense to share the value of node between its occurrences.
+# The subexpressions that get hoisted are computed once anyway, and the ones
+# with curr() have a different value in every column of a range.
+def Shareable(node, compiler, costs):
+  return (Cost(node, costs) >= MIN_SHARED_COST and
+          not compiler.Invariant(node) and not UsesCurrent(node))
+
+# Finds the subexpressions that appear more than once in the expressions
+# (of a single command), and returns the SharedValues for them. Only the
+# outermost of the nested repeated subexpressions (like a + b in
+# a + b - c, when a + b - c repeats) are shared. Subexpressions of
+# aggregations are evaluated in a different context for every row of the
+# group, and aren't shared.
+def Shared(exprs):
+  compiler = Compiler(None)
+  memo = {}
+  costs = {}
+  counts = {}
+  def Count(node, outermost):
+    if isinstance(node, expression.AggregateExpr):
+      children = []
+    else:
+      children = optimizer.Children(node)
+    if Shareable(node, compiler, costs):
+      signature = optimizer.Signature(node, memo)
+      if outermost is None or signature in outermost:
+        counts[signature] = counts.get(signature, 0) + 1
+        if outermost is not None:
+          return
+    for child in children:
+      Count(child, outermost)
+  try:
+    for expr in exprs:
+      Count(expr, None)
+    repeated = set(signature for signature, count in counts.items()
+                   if count > 1)
+    counts = {}
+    for expr in exprs:
+      Count(expr, repeated)
+  except RecursionError:
+    # Very deep expressions just don't share anything.
+    return SharedValues([])
+  shared = SharedValues(sorted(
+      (signature for signature, count in counts.items() if count > 1),
+      key=str))
+  for expr in exprs:
+    shared.used[id(expr)] = frozenset(
+        optimizer.Signature(node, memo) for node in Nodes(expr)
+        if optimizer.Signature(node, memo) in shared.keys)
+  return shared
+
+class Compiler:
+  def __init__(self, expr, shared=frozenset()):
+    self.expr = expr
+    # The signatures of the subexpressions to share with the other
+    # expressions of the command.
+    self.shared = shared
+    self.signatures = {}
+    # Globals holding the keys of the shared subexpressions in
+    # SharedValues, mapped to their signatures.
+    self.shared_keys = {}
+    self.functions = []
+    self.lines = []
+    self.globals = {'_aggregate': Aggregate, '_failed': FAILED}
+    self.variables = 0
+    # Globals holding column indices, mapped to the argument of at() (an
+    # expression that doesn't depend on the row).
+    self.columns = {}
+    # Globals holding the values of the hoisted subexpressions, mapped to
+    # the subexpressions.
+    self.hoisted = {}
+    self.invariant = {}
+    self.costs = {}
+    # In the functions of MemoExprs, maps the signatures of the inputs to the
+    # names of the arguments holding their values.
+    self.params = None
+    # The memos of the functions of MemoExprs, by the function names.
+    self.memos = {}
+
+  def NewGlobalName(self, prefix):
+    return '_{}{}'.format(prefix, len(self.globals) + len(self.columns) +
+                          len(self.hoisted) + len(self.shared_keys))
+
+  def Global(self, value, prefix):
+    name = self.NewGlobalName(prefix)
+    self.globals[name] = value
+    return name
+
+  def Column(self, arg):
+    name = self.NewGlobalName('i')
+    self.columns[name] = arg
+    return name
+
+  def Invariant(self, node):
+    if id(node) not in self.invariant:
+      if isinstance(node, INVARIANT_LEAVES):
+        res = True
+      elif isinstance(node, INVARIANT_IF_CHILDREN_ARE):
+        res = all(self.Invariant(child)
+                  for child in optimizer.Children(node))
+      else:
+        res = False
+      self.invariant[id(node)] = res
+    return self.invariant[id(node)]
+
+  def Assign(self, indent, value):
+    name = 'v{}'.format(self.variables)
+    self.variables += 1
+    self.lines.append('  ' * indent + '{} = {}'.format(name, value))
+    return name
+
+  # Emits the code computing the value of node, and returns a Python
+  # expression (a variable, global or literal) holding that value.
+  def Value(self, node, indent):
+    if self.params is not None:
+      # Everything the child of a MemoExpr reads comes from its inputs.
+      signature = optimizer.Signature(node, self.signatures)
+      if signature in self.params:
+        return self.params[signature]
+      return self.Computed(node, indent)
+    if self.Invariant(node) and not isinstance(node, INVARIANT_LEAVES):
+      name = self.NewGlobalName('h')
+      self.hoisted[name] = node
+      self.lines.append('  ' * indent +
+                        'if {} is _failed: raise LookupError'.format(name))
+      return name
+    if self.shared:
+      signature = optimizer.Signature(node, self.signatures)
+      if signature in self.shared:
+        return self.SharedValue(node, signature, indent)
+    return self.Computed(node, indent)
+
+  # Emits the code reading the value of a shared subexpression, or computing
+  # it, if it's the first occurrence evaluated for the row.
+  def SharedValue(self, node, signature, indent):
+    key = self.NewGlobalName('s')
+    self.shared_keys[key] = signature
+    result = 'v{}'.format(self.variables)
+    self.variables += 1
+    self.lines.append('  ' * indent + 'if _rows[{}] is data:'.format(key))
+    self.lines.append('  ' * (indent + 1) + '{} = _shared[{}]'.format(
+        result, key))
+    self.lines.append('  ' * indent + 'else:')
+    value = self.Computed(node, indent + 1)
+    self.lines.append('  ' * (indent + 1) + '{} = _shared[{}] = {}'.format(
+        result, key, value))
+    self.lines.append('  ' * (indent + 1) + '_rows[{}] = data'.format(key))
+    return result
+
+  def Computed(self, node, indent):
+    if isinstance(node, expression.Constant):
+      if type(node.val) in LITERAL_TYPES:
+        return repr(node.val)
+      return self.Global(node.val, 'c')
+    if isinstance(node, expression.BinaryExpr):
+      left = self.Value(node.left, indent)
+      right = self.Value(node.right, indent)
+      if node.op in BINARY_TEMPLATES:
+        return self.Assign(indent,
+                           BINARY_TEMPLATES[node.op].format(left, right))
+      op = self.Global(node.op, 'f')
+      return self.Assign(indent, '{}({}, {})'.format(op, left, right))
+    if isinstance(node, expression.UnaryExpr):
+      arg = self.Value(node.arg, indent)
+      if node.op in UNARY_TEMPLATES:
+        return self.Assign(indent, UNARY_TEMPLATES[node.op].format(arg))
+      op = self.Global(node.op, 'f')
+      return self.Assign(indent, '{}({})'.format(op, arg))
+    if isinstance(node, expression.TernaryExpr):
+      args = [self.Value(arg, indent)
+              for arg in [node.arg1, node.arg2, node.arg3]]
+      if node.op in TERNARY_TEMPLATES:
+        return self.Assign(indent, TERNARY_TEMPLATES[node.op].format(*args))
+      op = self.Global(node.op, 'f')
+      return self.Assign(indent, '{}({})'.format(op, ', '.join(args)))
+    if isinstance(node, expression.If):
+      condition = self.Value(node.condition, indent)
+      self.lines.append('  ' * indent + 'if {}:'.format(condition))
+      result = 'v{}'.format(self.variables)
+      self.variables += 1
+      then = self.Value(node.then, indent + 1)
+      self.lines.append('  ' * (indent + 1) + '{} = {}'.format(result, then))
+      self.lines.append('  ' * indent + 'else:')
+      otherwise = self.Value(node.otherwise, indent + 1)
+      self.lines.append(
+          '  ' * (indent + 1) + '{} = {}'.format(result, otherwise))
+      return result
+    if isinstance(node, expression.MemoExpr):
+      if Cost(node.child, self.costs) < MIN_MEMO_COST:
+        return self.Value(node.child, indent)
+      values = ', '.join(self.Value(arg, indent) for arg in node.inputs)
+      memo = self.Global(node.memo, 'm')
+      compute = self.ValuesFunction(node)
+      self.memos[compute] = node.memo
+      return self.Assign(indent, '{}_cached({}) if {}.enabled else {}({})'.format(
+          compute, values, memo, compute, values))
+    if isinstance(node, expression.AggregateExpr):
+      child = self.Function(node.child)
+      return self.Assign(indent, '_aggregate({}, {}, context)'.format(
+          self.Global(node, 'n'), child))
+    if isinstance(node, expression.AtExpr):
+      # Unknown columns (and, in aggregations, columns that aren't a part of
+      # the group key) raise here, and the tree reports the error.
+      if self.Invariant(node.arg):
+        return self.Assign(indent, 'data[{}]'.format(self.Column(node.arg)))
+      arg = self.Value(node.arg, indent)
+      return self.Assign(indent, 'data[_at[{}]]'.format(arg))
+    if isinstance(node, expression.CurrExpr):
+      return self.Assign(indent, 'data[_current]')
+    if isinstance(node, expression.CurrNameExpr):
+      return '_current_name'
+    if isinstance(node, expression.NumColumnsExpr):
+      return '_last'
+    # Everything else is evaluated by the tree.
+    return self.Assign(indent, '{}.Eval(context)'.format(
+        self.Global(node, 'n')))
+
+  # Emits a function computing the child of a MemoExpr from the values of
+  # its inputs, and returns its name.
+  def ValuesFunction(self, node):
+    outer = self.lines, self.shared, self.params
+    self.lines = []
+    self.shared = frozenset()
+    self.params = {}
+    for arg in node.inputs:
+      self.params[optimizer.Signature(arg, self.signatures)] = 'p{}'.format(
+          len(self.params))
+    result = self.Value(node.child, 1)
+    name = '_r{}'.format(len(self.functions))
+    self.functions.append('\n'.join(
+        ['def {}({}):'.format(name, ', '.join(self.params.values()))] +
+        self.lines + ['  return ' + result]))
+    self.lines, self.shared, self.params = outer
+    return name
+
+  # Emits a separate function computing node (without the fallback to the
+  # tree), and returns its name.
+  def Function(self, node):
+    outer_lines = self.lines
+    outer_shared = self.shared
+    self.lines = []
+    self.shared = frozenset()
+    result = self.Value(node, 1)
+    self.shared = outer_shared
+    name = '_a{}'.format(len(self.functions))
+    self.functions.append('\n'.join(
+        ['def {}(context):'.format(name), '  data = context[\'__data\']'] +
+        self.lines + ['  return ' + result]))
+    self.lines = outer_lines
+    return name
+
+  def Source(self):
+    result = self.Value(self.expr, 2)
+    self.functions.append('\n'.join(
+        ['def _evaluate(context):', '  try:',
+         '    data = context[\'__data\']'] + self.lines + [
+         '    return ' + result,
+         '  except Exception:',
+         '    return _fallback(context)']))
+    return '\n\n'.join(self.functions)
+
+# The compiled code of an expression, along with what's needed to bind it
+# to a context.
+class Program:
+  def __init__(self, expr, shared):
+    compiler = Compiler(expr, shared)
+    source = compiler.Source()
+    filename = '<expression at line {}>'.format(expr.line + 1)
+    self.code = compile(source, filename, 'exec')
+    self.globals = compiler.globals
+    self.columns = compiler.columns
+    self.hoisted = compiler.hoisted
+    self.shared_keys = compiler.shared_keys
+    self.uses_current = UsesCurrent(expr)
+    if compiler.memos:
+      # The functions of the MemoExprs are the same in every binding, so
+      # that the memos are kept between the commands (and the columns).
+      namespace = self.globals.copy()
+      exec(self.code, namespace)
+      for name, memo in compiler.memos.items():
+        self.globals[name] = namespace[name]
+        self.globals[name + '_cached'] = memo.Cache(namespace[name])
+
+def UsesCurrent(node):
+  if isinstance(node, (expression.CurrExpr, expression.CurrNameExpr)):
+    return True
+  return any(UsesCurrent(child) for child in optimizer.Children(node))
+
+# Evaluates a hoisted subexpression when binding.
+def EvalOrFailed(node, context):
+  try:
+    return node.Eval(context)
+  except Exception:
+    return FAILED
+
+# Returns the Program of expr (sharing the subexpressions with the given
+# signatures), or None if expr can't be compiled. The programs are cached in
+# the expression (see Expression.__getstate__).
+def Compile(expr, shared=frozenset()):
+  if expr.compiled is None:
+    expr.compiled = {}
+  if shared not in expr.compiled:
+    try:
+      expr.compiled[shared] = Program(expr, shared)
+    except (RecursionError, SyntaxError, MemoryError):
+      # Very deep expressions can exceed the limits of the Python compiler
+      # (or of our recursion); the tree can still evaluate them.
+      expr.compiled[shared] = False
+  return expr.compiled[shared] or None
+
+# Returns a function that takes a context, and returns the value of expr
+# in that context (just like expr.Eval). The function can only be used with
+# contexts that differ from the given one in __data (and __group_data), so
+# commands create a single context, and only swap the row in the loop.
+#
+# If the context has a current column ('?'), the function is bound to it.
+# All the column ranges share the memo for at() (see ColumnMemo), and all the
+# expressions of a command share the SharedValues.
+def Bind(expr, context, memo=None, shared=None):
+  used = frozenset() if shared is None else shared.used.get(id(expr),
+                                                            frozenset())
+  program = Compile(expr, used) if ENABLED else None
+  if program is None or (program.uses_current and '?' not in context):
+    return expr.Eval
+  namespace = program.globals.copy()
+  namespace['_fallback'] = expr.Eval
+  namespace['_at'] = memo if memo is not None else ColumnMemo(context)
+  namespace['_last'] = context['?last']
+  if program.uses_current:
+    namespace['_current_name'] = context['?']
+    namespace['_current'] = context[context['?']] - 1
+  for name, arg in program.columns.items():
+    arg = EvalOrFailed(arg, context)
+    namespace[name] = None if arg is FAILED else ResolveColumn(context, arg)
+  for name, node in program.hoisted.items():
+    namespace[name] = EvalOrFailed(node, context)
+  if program.shared_keys:
+    namespace['_shared'] = shared.values
+    namespace['_rows'] = shared.rows
+    for name, signature in program.shared_keys.items():
+      namespace[name] = shared.keys[signature]
+  exec(program.code, namespace)
+  return namespace['_evaluate']
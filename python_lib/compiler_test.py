@@ -0,0 +1,209 @@
+import unittest
+
+import command
+import compiler
+import expression
+import sql
+import tokenizer
+
+HEADER = {'a': 0, 'b': 1, 'city': 2, 'x': 3, 'y': 4}
+ROW = [2, 3, 'Kraków', 10, 20]
+PARAMS = {'year': '2023'}
+
+def parse(s):
+  return sql.GetExpression(tokenizer.tokenize([s]), {})
+
+def context(row=ROW):
+  return command.RowContext(row, HEADER, PARAMS)
+
+# Evaluates the expression both by walking the tree and through the compiled
+# function, and returns the pair of results (or of error strings).
+def both(s, row=ROW, extra={}):
+  res = []
+  for bind in [lambda e, ctx: e.Eval, compiler.Bind]:
+    expr = parse(s)
+    ctx = context(row)
+    ctx.update(extra)
+    try:
+      res.append(bind(expr, ctx)(ctx))
+    except ValueError as e:
+      res.append('raised ' + str(e))
+  return res
+
+class TestCompiler(unittest.TestCase):
+  def assertSame(self, s, row=ROW, extra={}):
+    tree, compiled = both(s, row, extra)
+    self.assertEqual(tree, compiled)
+    return compiled
+
+  def test_arithmetic(self):
+    self.assertEqual(13, self.assertSame('a * 2 + b * 3'))
+    self.assertEqual(-0.5, self.assertSame('(a - b) / 2'))
+    self.assertEqual(-4, self.assertSame('a - -6 - x - 2'))
+
+  def test_comparisons_and_logic(self):
+    self.assertEqual(True, self.assertSame('and(a < b, not(x > y))'))
+    self.assertEqual(False, self.assertSame('or(a = b, contains(city, "x"))'))
+
+  def test_functions(self):
+    self.assertEqual('Kr', self.assertSame('substr(city, 0, 2)'))
+    self.assertEqual(6, self.assertSame('len(city)'))
+    self.assertEqual(2.0, self.assertSame('sqrt(int("4"))'))
+    self.assertEqual(2, self.assertSame('min(a, y)'))
+
+  def test_if(self):
+    self.assertEqual(3, self.assertSame('if(a < b, b, 1 / 0)'))
+    self.assertEqual(7, self.assertSame('if(a > b, 1 / 0, if(x = 10, 7, 8))'))
+
+  def test_special_functions(self):
+    self.assertEqual(3, self.assertSame('at(index("b"))'))
+    self.assertEqual('2023', self.assertSame('$year'))
+    self.assertEqual(35, self.assertSame('sum_range(4:) + a + b'))
+    self.assertEqual(6, self.assertSame('numcolumns()'))
+
+  def test_range_context(self):
+    self.assertEqual('x1', self.assertSame('currname() + "1"', extra={'?': 'x'}))
+    self.assertEqual(20, self.assertSame('curr() + at(currname())',
+                                         extra={'?': 'x'}))
+
+  def test_same_errors(self):
+    tree, compiled = both('a + city')
+    self.assertTrue(compiled.startswith('raised'))
+    self.assertEqual(tree, compiled)
+    self.assertIn('positions', compiled)
+    self.assertSame('if(a < b, x / (a - 2), 1)')
+    self.assertSame('at("nonexistent") + 1')
+    self.assertSame('int(city)')
+    self.assertSame('$missing')
+
+  def test_aggregate(self):
+    def group_context(group_data):
+      ctx = command.RowContext(None, HEADER, PARAMS)
+      ctx['__data'] = {0: 2}
+      ctx['__group_data'] = group_data
+      return ctx
+    expr = parse('sum(x) + a * 10')
+    for bind in [compiler.Bind, lambda e, ctx: e.Eval]:
+      ctx = group_context([{3: 1}, {3: 5}, {3: 7}])
+      self.assertEqual(33, bind(expr, ctx)(ctx))
+    errors = []
+    expr = parse('sum(city)')
+    for bind in [compiler.Bind, lambda e, ctx: e.Eval]:
+      ctx = group_context([{2: 'a'}, {2: 'b'}])
+      with self.assertRaises(ValueError) as e:
+        bind(expr, ctx)(ctx)
+      errors.append(str(e.exception))
+    self.assertIn('When accumulating', errors[0])
+    self.assertEqual(errors[0], errors[1])
+
+  def test_bound_to_command_context(self):
+    ctx = context()
+    evaluate = compiler.Bind(parse('a * 10 + at(2) + at("y")'), ctx)
+    results = []
+    for row in [[1, 2, 'x', 0, 3], [4, 5, 'y', 0, 6]]:
+      ctx['__data'] = row
+      results.append(evaluate(ctx))
+    self.assertEqual([15, 51], results)
+
+  def test_unknown_column_in_untaken_branch(self):
+    self.assertEqual(2, self.assertSame('if(a < b, a, at("zzz"))'))
+
+  def test_dynamic_at_memo(self):
+    ctx = context()
+    memo = compiler.ColumnMemo(ctx)
+    evaluate = compiler.Bind(parse('at(if(a < 5, "x", "y"))'), ctx, memo)
+    results = []
+    for row in [ROW, [7, 1, 'x', 0, 5]]:
+      ctx['__data'] = row
+      results.append(evaluate(ctx))
+    self.assertEqual([10, 5], results)
+    self.assertEqual({'x': 3, 'y': 4}, dict(memo))
+
+  def test_hoisted(self):
+    program = compiler.Compile(parse('a + int($year) * 2 + at(index("a") + 1)'))
+    self.assertEqual(1, len(program.hoisted))
+    self.assertEqual(2, len(program.columns))
+    self.assertEqual(4048, self.assertSame('a + int($year) * 2'))
+    self.assertEqual(5, self.assertSame('at(index("a") + 1) + a'))
+
+  def test_hoisted_failure_in_untaken_branch(self):
+    self.assertEqual(2, self.assertSame('if(a < b, a, $missing + 1)'))
+    self.assertSame('if(a > b, a, $missing + 1)')
+
+  def test_hoisted_per_range_column(self):
+    ctx = context()
+    results = []
+    for column in ['x', 'y']:
+      ctx['?'] = column
+      results.append(compiler.Bind(
+          parse('at(currname()) + index(currname())'), ctx)(ctx))
+    self.assertEqual([14, 25], results)
+
+  def test_shared_outermost_only(self):
+    exprs = [parse(s) for s in [
+        'a * b + x * y + 1 - a', '(a * b + x * y + 1 - a) * 2',
+        'a * b + x * y + 1', 'sum_range(4:) + 1', 'sum_range(4:) + 2',
+        'a + b', 'a + b']]
+    shared = compiler.Shared(exprs)
+    # a * b + x * y + 1 only repeats inside a * b + x * y + 1 - a, and a + b
+    # is too cheap to share.
+    self.assertEqual(2, len(shared.keys))
+    self.assertEqual(frozenset(), shared.used[id(exprs[2])])
+    self.assertEqual(frozenset(), shared.used[id(exprs[5])])
+
+  def test_shared_in_transform(self):
+    config = ('TRANSFORM t WITH a * b - x * y + 1 AS c, '
+              '(a * b - x * y + 1) * y AS d, '
+              'if(a < 3, 1, 100 / (a * b - x * y + 1)) AS e;')
+    rows = [[2, 3, 'x', 4, 5], [7, 1, 'y', 3, 2], [5, 1, 'z', 6, 1]]
+    results = []
+    for enabled in [True, False]:
+      compiler.ENABLED = enabled
+      tables = {'t': (HEADER, rows)}
+      try:
+        sql.GetCommandList([config]).Eval(tables, {})
+        results.append(tables['t'][1])
+      except ValueError as e:
+        results.append(str(e))
+      finally:
+        compiler.ENABLED = True
+    # The last row divides by zero in e, but not in c or d.
+    self.assertIn('column 3', results[0])
+    self.assertEqual(results[1], results[0])
+    rows.pop()
+    tables = {'t': (HEADER, rows)}
+    sql.GetCommandList([config]).Eval(tables, {})
+    self.assertEqual([[-13, -65, 1], [2, 4, 50.0]], tables['t'][1])
+
+  def test_memo(self):
+    expr = parse('if(int(city) > 1100, int(substr(city, 0, 2)) * 100 + '
+                 'int(substr(city, 1, 3)), int(city) * 2 - int(substr(city, 2, 4)))')
+    self.assertIsInstance(expr, expression.MemoExpr)
+    ctx = context()
+    evaluate = compiler.Bind(expr, ctx)
+    results = []
+    for city in ['1234', '1000', '1234', '1000']:
+      ctx['__data'] = [2, 3, city, 10, 20]
+      results.append(evaluate(ctx))
+    self.assertEqual([1223, 2000, 1223, 2000], results)
+    self.assertEqual((2, 2), expr.memo.Counts())
+    self.assertIn(expr.memo.descr + ': 2 hits, 2 misses (sampling)',
+                  sql.GetCommandList(['LIST MEMOS;']).Eval({}, {}))
+
+  def test_cheap_memo_inlined(self):
+    expr = parse('int(city) * 2')
+    self.assertIsInstance(expr, expression.MemoExpr)
+    self.assertEqual(4, self.assertSame('int(b) * 2', row=[2, '2', 'x', 0, 0]))
+    program = compiler.Compile(expr)
+    self.assertNotIn('_cached', str(program.globals))
+
+  def test_disabled(self):
+    compiler.ENABLED = False
+    try:
+      expr = parse('a + b')
+      self.assertEqual(expr.Eval, compiler.Bind(expr, context()))
+    finally:
+      compiler.ENABLED = True
+
+if __name__ == '__main__':
+  unittest.main()
@@ -1,13 +1,54 @@
+import functools
 import heapq
+import operator
+import weakref
 # The expression class, which provides the (implicit) Expression class,
 # which has a single Eval(context) function.
 
+# The ops of the built-in functions (see sql.py). They are named module-level
+# functions (and not lambdas), so that parsed command sequences can be
+# pickled by plancache.py.
+def string_beginning(a, b):
+  return a[:b]
+
+def string_end(a, b):
+  return a[b:]
+
+def logical_and(a, b):
+  return a and b
+
+def logical_or(a, b):
+  return a or b
+
+def startswith(a, b):
+  return a.startswith(b)
+
+def substr(a, b, c):
+  return a[b:c]
+
+def replace(a, b, c):
+  return a.replace(b, c)
+
+def maximum(a, b):
+  return b if a is None else max(a, b)
+
 class Expression:
   def __init__(self, token, descr):
     self.line = token.line
     self.startpos = token.start
     self.endpos = token.end
     self.descr = descr
+    # The types the parser inferred for the value (see sql.py), if known.
+    self.types = None
+    # The compiled version of this expression, see compiler.py.
+    self.compiled = None
+
+  # Compiled functions can't be pickled (and plancache.py pickles parsed
+  # commands), so they're dropped, and compiled again when needed.
+  def __getstate__(self):
+    state = self.__dict__.copy()
+    state['compiled'] = None
+    return state
 
   def DebugString(self):
     return '{} at line {}, positions {}:{}'.format(
@@ -35,6 +76,8 @@ class AggregateExpr(Expression):
     if '__group_data' not in context:
       raise ValueError(self.ErrorStr(),
                        'Cannot evaluate outside of aggregation context')
+    if isinstance(context['__group_data'], Accumulated):
+      return context['__group_data'].Value(self, context)
     acc = self.base
     original_data = context['__data']
     group_context = context['__group_data']
@@ -51,6 +94,18 @@ class AggregateExpr(Expression):
     context['__group_data'] = group_context
     return acc
 
+class Accumulated:
+  """ The __group_data of a group whose aggregations were all accumulated in
+      a single pass over the rows (see command.Aggregate), instead of the
+      list of the rows. Maps every AggregateExpr (and the current column, in
+      column ranges) to its value for the group.
+  """
+  def __init__(self, values):
+    self.values = values
+
+  def Value(self, node, context):
+    return self.values[(id(node), context.get('?'))]
+
 class BinaryExpr(Expression):
   def __init__(self, left, right, op, token, descr):
     super().__init__(token, descr)
@@ -68,32 +123,32 @@ class BinaryExpr(Expression):
 
 class Sum(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a+b, token, 'sum')
+    super().__init__(left, right, operator.add, token, 'sum')
 
 class Difference(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a-b, token, 'difference')
+    super().__init__(left, right, operator.sub, token, 'difference')
 
 class Product(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a*b, token, 'product')
+    super().__init__(left, right, operator.mul, token, 'product')
 
 class Quotient(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a/b, token, 'quotient')
+    super().__init__(left, right, operator.truediv, token, 'quotient')
 
 class Equal(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a == b, token, 'equality')
+    super().__init__(left, right, operator.eq, token, 'equality')
 
 class Lesser(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a < b, token,
+    super().__init__(left, right, operator.lt, token,
                      'lesser comparison')
 
 class Greater(BinaryExpr):
   def __init__(self, left, right, token):
-    super().__init__(left, right, lambda a, b: a > b, token,
+    super().__init__(left, right, operator.gt, token,
                      'greater comparison')
 
 class UnaryExpr(Expression):
@@ -337,6 +392,9 @@ class NameExpr(Expression):
     if arg <= 0 or arg >= context['?last']:
       raise ValueError(self.ErrorStr(),
                        'column index {} out of range'.format(arg))
+    # The contexts of the commands have the names of the (0-indexed) columns.
+    if arg - 1 in context.get('?names', {}):
+      return context['?names'][arg - 1]
     for name in context:
       if context[name] == arg:
         return name
@@ -362,3 +420,111 @@ class Constant(Expression):
 
   def Eval(self, context):
     return self.val
+
+# Memos hold at most MEMO_SIZE values, evicting the least recently used. A memo
+# starts out sampling: after MEMO_SAMPLE_SIZE lookups, it stays enabled only if
+# at least MEMO_MIN_HIT_RATE of them were hits, and otherwise the values are
+# just computed from then on.
+MEMO_SIZE = 4096
+MEMO_SAMPLE_SIZE = 1000
+MEMO_MIN_HIT_RATE = 0.5
+
+# The memos that were used (see LIST MEMOS).
+MEMOS = weakref.WeakSet()
+
+# The memo of a single subexpression (see MemoExpr). It holds one cache for
+# every function computing the values of the subexpression from the values
+# of its inputs: the one walking the tree, and the compiled ones (see
+# compiler.py).
+class Memo:
+  def __init__(self, descr, position):
+    self.descr = descr
+    # The line and column in the config, for sorting.
+    self.position = position
+    self.Reset()
+
+  def Reset(self):
+    self.caches = []
+    self.enabled = True
+    self.sampled = False
+
+  # The caches can't be pickled (by plancache.py), and aren't worth it.
+  def __getstate__(self):
+    return {'descr': self.descr, 'position': self.position}
+
+  def __setstate__(self, state):
+    self.descr = state['descr']
+    self.position = state['position']
+    self.Reset()
+
+  # Returns compute, memoized. Values that are equal in Python, but of
+  # different types (like 0 and 0.0), are different keys.
+  def Cache(self, compute):
+    def Sampled(*values):
+      # Only called on misses.
+      self.Sample()
+      return compute(*values)
+    cached = functools.lru_cache(maxsize=MEMO_SIZE, typed=True)(Sampled)
+    self.caches.append(cached)
+    MEMOS.add(self)
+    return cached
+
+  def Counts(self):
+    hits = sum(cached.cache_info().hits for cached in self.caches)
+    misses = sum(cached.cache_info().misses for cached in self.caches)
+    return hits, misses
+
+  def Sample(self):
+    if not self.sampled:
+      hits, misses = self.Counts()
+      if hits + misses >= MEMO_SAMPLE_SIZE:
+        self.sampled = True
+        self.enabled = hits >= MEMO_MIN_HIT_RATE * (hits + misses)
+
+  def DebugString(self):
+    hits, misses = self.Counts()
+    if not self.sampled:
+      state = 'sampling'
+    elif self.enabled:
+      state = 'enabled'
+    else:
+      state = 'disabled, hit rate below {:.0%}'.format(MEMO_MIN_HIT_RATE)
+    return '{}: {} hits, {} misses ({})'.format(self.descr, hits, misses, state)
+
+class MemoExpr(Expression):
+  """ Evaluates a pure subexpression (see optimizer.Memoize), remembering
+      its values for the values of its inputs: the subexpressions of child
+      that read the row or the context (like at() or curr()).
+  """
+  def __init__(self, child, inputs, token):
+    super().__init__(token, 'memo of ' + child.descr)
+    self.child = child
+    self.inputs = inputs
+    self.types = child.types
+    self.memo = Memo(self.DebugString(), (self.line, self.startpos))
+    self.cached = None
+    # The context of the current Eval, for Compute.
+    self.context = None
+
+  def __getstate__(self):
+    state = super().__getstate__()
+    state['cached'] = None
+    state['context'] = None
+    return state
+
+  def Compute(self, *values):
+    return self.child.Eval(self.context)
+
+  def Eval(self, context):
+    if not self.memo.enabled:
+      return self.child.Eval(context)
+    try:
+      values = [arg.Eval(context) for arg in self.inputs]
+    except Exception:
+      # The child may not need the failing input (if it's in an untaken
+      # branch of an if), or fail with another error first.
+      return self.child.Eval(context)
+    if self.cached is None:
+      self.cached = self.memo.Cache(self.Compute)
+    self.context = context
+    return self.cached(*values)
@@ -0,0 +1,151 @@
+# Parse-time optimizations of expression trees (see expression.py).
+#
+# Fold replaces every subtree whose value doesn't depend on the context with
+# a Constant, so that it isn't evaluated again for every row. This covers
+# the conditionals that sql.GetRange generates for the range ends, arithmetic
+# on literals, and calls like int(460). Subtrees that fail to evaluate are
+# left alone, so they still raise (with the usual message) if, and only if,
+# they're evaluated.
+
+import operator
+
+import expression
+from tokens import Token
+
+# The expression classes that compute their value from their children only,
+# so they're constant if all their children are.
+PURE = (expression.BinaryExpr, expression.UnaryExpr, expression.TernaryExpr)
+
+# The attributes in which the expression classes keep their children.
+CHILDREN = ['left', 'right', 'arg', 'arg1', 'arg2', 'arg3', 'condition',
+            'then', 'otherwise', 'child', 'seats', 'myvotes', 'beg', 'end']
+
+# Maps the expression classes to the CHILDREN their instances have.
+CHILDREN_OF_CLASS = {}
+
+def Children(node):
+  names = CHILDREN_OF_CLASS.get(type(node))
+  if names is None:
+    names = [name for name in CHILDREN if hasattr(node, name)]
+    CHILDREN_OF_CLASS[type(node)] = names
+  return [getattr(node, name) for name in names
+          if isinstance(getattr(node, name), expression.Expression)]
+
+# The attributes of expressions that don't affect their value.
+NOT_IN_SIGNATURE = {'line', 'startpos', 'endpos', 'descr', 'types', 'compiled',
+                    'inputs', 'memo', 'cached', 'context'}
+
+# Returns a hashable key describing the structure of node, such that two
+# expressions with the same signature have the same value in every context
+# (though they may fail with different messages). The memo maps ids of nodes
+# to their signatures.
+def Signature(node, memo=None):
+  if memo is None:
+    memo = {}
+  if id(node) not in memo:
+    key = [type(node)]
+    for name, value in sorted(vars(node).items()):
+      if name in NOT_IN_SIGNATURE:
+        continue
+      if isinstance(value, expression.Expression):
+        value = Signature(value, memo)
+      elif name == 'val':
+        # So that 1, 1.0 and True, which are equal in Python, differ.
+        value = (type(value), value)
+      key.append((name, value))
+    memo[id(node)] = tuple(key)
+  return memo[id(node)]
+
+# A constant with the value of node, keeping its position in the config.
+def Folded(node, val):
+  res = expression.Constant(
+      val, Token(None, None, node.line, node.startpos, node.endpos))
+  res.types = node.types
+  return res
+
+def Fold(node):
+  try:
+    return FoldNode(node)
+  except RecursionError:
+    # Very deep expressions are left (partially) unfolded, every subtree
+    # that got replaced is equivalent to the original.
+    return node
+
+def FoldNode(node):
+  for name in CHILDREN:
+    child = getattr(node, name, None)
+    if isinstance(child, expression.Expression):
+      setattr(node, name, FoldNode(child))
+  if isinstance(node, expression.If):
+    if isinstance(node.condition, expression.Constant):
+      return node.then if node.condition.val else node.otherwise
+  elif isinstance(node, PURE):
+    if all(isinstance(child, expression.Constant)
+           for child in Children(node)):
+      try:
+        return Folded(node, node.Eval({}))
+      except Exception:
+        pass
+  return node
+
+# Memoize wraps the subexpressions that compute a value from a few inputs
+# (values of columns, params, and the like) in an expression.MemoExpr, which
+# remembers the values computed for the values of the inputs. Commune tables
+# repeat the same strings many times, so the same teryt codes get normalized,
+# and the same strings converted to ints, over and over.
+
+# The nodes that are the inputs of memoized subexpressions.
+MEMO_INPUTS = (expression.AtExpr, expression.CurrExpr, expression.CurrNameExpr,
+               expression.ParamExpr, expression.IndexExpr, expression.NameExpr,
+               expression.NumColumnsExpr)
+# Subexpressions using only these ops are cheap enough not to be worth
+# memoizing, only the ones calling functions (like int() or substr()) are.
+CHEAP_OPS = {operator.add, operator.sub, operator.mul, operator.truediv,
+             operator.eq, operator.lt, operator.gt, operator.not_,
+             expression.logical_and, expression.logical_or}
+# The more inputs, the less likely it is that their values repeat.
+MAX_MEMO_INPUTS = 3
+
+# Returns the inputs of node (as a dict mapping their signatures to one of
+# the nodes), and whether node calls a function, or None if node isn't pure
+# (and can't be memoized).
+def MemoInputs(node, results, signatures):
+  if id(node) not in results:
+    if isinstance(node, MEMO_INPUTS):
+      res = ({Signature(node, signatures): node}, False)
+    elif isinstance(node, expression.Constant):
+      res = ({}, False)
+    elif isinstance(node, PURE + (expression.If,)):
+      inputs = {}
+      calls = isinstance(node, PURE) and node.op not in CHEAP_OPS
+      for child in Children(node):
+        child_res = MemoInputs(child, results, signatures)
+        if child_res is None:
+          inputs = None
+          break
+        inputs.update(child_res[0])
+        calls = calls or child_res[1]
+      res = None if inputs is None else (inputs, calls)
+    else:
+      res = None
+    results[id(node)] = res
+  return results[id(node)]
+
+def Memoize(node):
+  try:
+    return MemoizeNode(node, {}, {})
+  except RecursionError:
+    return node
+
+def MemoizeNode(node, results, signatures):
+  res = MemoInputs(node, results, signatures)
+  if (res is not None and res[1] and 0 < len(res[0]) <= MAX_MEMO_INPUTS and
+      not isinstance(node, MEMO_INPUTS)):
+    return expression.MemoExpr(
+        node, list(res[0].values()),
+        Token(None, None, node.line, node.startpos, node.endpos))
+  for name in CHILDREN:
+    child = getattr(node, name, None)
+    if isinstance(child, expression.Expression):
+      setattr(node, name, MemoizeNode(child, results, signatures))
+  return node
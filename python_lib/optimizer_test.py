@@ -0,0 +1,101 @@
+import unittest
+
+import expression
+import optimizer
+import sql
+import tokenizer
+
+def parse(s):
+  return sql.GetExpression(tokenizer.tokenize([s]), {})
+
+def parse_range(s):
+  return sql.GetRange(tokenizer.tokenize([s]), {})
+
+class TestFold(unittest.TestCase):
+  def assertConstant(self, val, expr):
+    self.assertIsInstance(expr, expression.Constant)
+    self.assertEqual(val, expr.val)
+
+  def test_literals(self):
+    self.assertConstant(460, parse('int(460)'))
+    self.assertConstant(-6, parse('-3 * 2'))
+    self.assertConstant('ab_c', parse('"ab" + "_" + "c"'))
+    self.assertConstant(True, parse('and(1 < 2, startswith("abc", "a"))'))
+
+  def test_partially_constant(self):
+    expr = parse('a + int("4") * 2')
+    self.assertIsInstance(expr, expression.Sum)
+    self.assertConstant(8, expr.right)
+
+  def test_constant_condition(self):
+    self.assertIsInstance(parse('if(2 > 1, a, b)'), expression.AtExpr)
+    self.assertConstant(3, parse('if(2 < 1, 1 / 0, 3)'))
+
+  def test_failures_are_not_folded(self):
+    expr = parse('if(2 > 1, 1 / 0, 3)')
+    self.assertIsInstance(expr, expression.Quotient)
+    with self.assertRaises(ValueError):
+      expr.Eval({})
+
+  def test_ranges(self):
+    beg, end = parse_range('2:')
+    self.assertConstant(2, beg)
+    self.assertIsInstance(end, expression.NumColumnsExpr)
+    beg, end = parse_range('2:5')
+    self.assertConstant(5, end)
+    beg, end = parse_range('[1:3]')
+    self.assertConstant(3, end)
+    beg, end = parse_range('[index("a"):]')
+    self.assertIsInstance(beg, expression.IndexExpr)
+
+  def test_deep_expression(self):
+    # Deeper than the recursion limit, it's just left unfolded.
+    expr = parse(' + '.join(['a'] * 3000))
+    self.assertIsInstance(expr, expression.Sum)
+
+  def test_types(self):
+    self.assertIn(sql.INT, parse('int(a) + 1').types)
+    self.assertEqual([sql.BOOL], parse('a < 3').types)
+    # Either branch of the if.
+    self.assertEqual([sql.INT, sql.STRING], parse('if(a = b, 1, "x")').types)
+    # Folded constants keep the types.
+    self.assertEqual([sql.INT], parse('int(460)').types)
+
+class TestSignature(unittest.TestCase):
+  def test_structure(self):
+    sig = lambda s: optimizer.Signature(parse(s))
+    self.assertEqual(sig('a + b'), sig('(a  +  b)'))
+    self.assertNotEqual(sig('a + b'), sig('a - b'))
+    self.assertNotEqual(sig('a + 1'), sig('a + 1.0'))
+    self.assertNotEqual(sig('sum(a)'), sig('max(a)'))
+
+class TestMemoize(unittest.TestCase):
+  def test_wrapped(self):
+    expr = parse('int(substr(a, 0, 2)) + b + a + c + d')
+    # The whole sum has four inputs, so only its left side is memoized.
+    self.assertIsInstance(expr.left, expression.MemoExpr)
+    self.assertEqual(3, len(expr.left.inputs))
+    # Only arithmetic, no inputs, or too many inputs.
+    self.assertIsInstance(parse('a + b * 2'), expression.Sum)
+    self.assertIsInstance(parse('int(a) + int(b) + int(c) + int(d)'),
+                          expression.Sum)
+    self.assertIsInstance(parse('sum(int(a))'), expression.AggregateExpr)
+
+  def test_values(self):
+    expr = parse('if(a = "", 0, int(a) * 2)')
+    self.assertIsInstance(expr, expression.MemoExpr)
+    for val, res in [('', 0), ('12', 24), ('', 0), ('12', 24)]:
+      self.assertEqual(res, expr.Eval({'a': 1, '?last': 2, '__data': [val]}))
+    self.assertEqual((2, 2), expr.memo.Counts())
+    with self.assertRaises(ValueError):
+      expr.Eval({'a': 1, '?last': 2, '__data': ['x']})
+
+  def test_disabled_on_misses(self):
+    expr = parse('int(a) * 2')
+    for i in range(expression.MEMO_SAMPLE_SIZE + 1):
+      self.assertEqual(2 * i, expr.Eval({'a': 1, '?last': 2, '__data': [str(i)]}))
+    self.assertFalse(expr.memo.enabled)
+    self.assertIn('disabled', expr.memo.DebugString())
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,158 @@
+# A cache of parsed command sequences (plans), used by RUN and IMPORT, so
+# that a config file that is executed many times (within one run, or across
+# many runs of cadmium.py) is tokenized and parsed only once.
+#
+# Plans are keyed by a hash of the parsed lines, so editing a config file
+# invalidates its entry. The key also includes a digest of the interpreter
+# sources (the .py files in this directory), so that plans pickled by an
+# older version of the interpreter are never loaded.
+#
+# There are two levels of the cache:
+# - in memory, holding at most MAX_MEMORY_ENTRIES plans, evicting the least
+#   recently used one,
+# - on disk, only if the CADMIUM_CACHE_DIR environment variable is set (to
+#   a non-empty directory), holding pickled plans in that directory, and
+#   evicting the least recently used files when their total size exceeds
+#   MAX_DISK_BYTES. The plans are unpickled when read, so the directory
+#   should only be writable by the user running cadmium.py.
+
+import collections
+import hashlib
+import os
+import pickle
+
+MAX_MEMORY_ENTRIES = 64
+MAX_DISK_BYTES = 64 * 1024 * 1024
+
+CACHE_DIR_VARIABLE = 'CADMIUM_CACHE_DIR'
+PLAN_SUFFIX = '.plan'
+
+def CacheDir():
+  directory = os.environ.get(CACHE_DIR_VARIABLE)
+  if not directory:
+    return None
+  return os.path.expanduser(directory)
+
+_sources_digest = None
+
+def SourcesDigest():
+  global _sources_digest
+  if _sources_digest is None:
+    digest = hashlib.sha256()
+    libdir = os.path.dirname(os.path.abspath(__file__))
+    for name in sorted(os.listdir(libdir)):
+      if name.endswith('.py'):
+        digest.update(name.encode())
+        with open(os.path.join(libdir, name), 'rb') as source:
+          digest.update(source.read())
+    _sources_digest = digest.hexdigest()
+  return _sources_digest
+
+def Key(lines):
+  digest = hashlib.sha256(SourcesDigest().encode())
+  for line in lines:
+    digest.update(line.encode())
+    # A separator, so that ['ab', 'c'] and ['a', 'bc'] get different keys.
+    digest.update(b'\0')
+  return digest.hexdigest()
+
+class PlanCache:
+  def __init__(self, max_entries=MAX_MEMORY_ENTRIES,
+               max_disk_bytes=MAX_DISK_BYTES):
+    self.max_entries = max_entries
+    self.max_disk_bytes = max_disk_bytes
+    self.plans = collections.OrderedDict()
+    self.hits = 0
+    self.disk_hits = 0
+    self.misses = 0
+
+  def Clear(self):
+    self.plans.clear()
+
+  # Returns the parsed plan for lines, calling parser(lines) only if the
+  # plan isn't cached yet.
+  def Parse(self, lines, parser):
+    key = Key(lines)
+    if key in self.plans:
+      self.plans.move_to_end(key)
+      self.hits += 1
+      return self.plans[key]
+    plan = self.ReadFromDisk(key)
+    if plan is not None:
+      self.disk_hits += 1
+    else:
+      self.misses += 1
+      plan = parser(lines)
+      self.WriteToDisk(key, plan)
+    self.plans[key] = plan
+    if len(self.plans) > self.max_entries:
+      self.plans.popitem(last=False)
+    return plan
+
+  # The disk cache is best-effort: if anything goes wrong, we just parse.
+  def ReadFromDisk(self, key):
+    directory = CacheDir()
+    if directory is None:
+      return None
+    path = os.path.join(directory, key + PLAN_SUFFIX)
+    try:
+      with open(path, 'rb') as planfile:
+        plan = pickle.load(planfile)
+      # Mark the entry as recently used, for the eviction.
+      os.utime(path)
+      return plan
+    except OSError:
+      return None
+    except Exception:
+      # A corrupt entry; drop it.
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      return None
+
+  def WriteToDisk(self, key, plan):
+    directory = CacheDir()
+    if directory is None:
+      return
+    path = os.path.join(directory, key + PLAN_SUFFIX)
+    try:
+      os.makedirs(directory, exist_ok=True)
+      data = pickle.dumps(plan, protocol=pickle.HIGHEST_PROTOCOL)
+      # Write to a temporary file and rename, so that a concurrent run never
+      # sees a partially written plan.
+      temp_path = '{}.{}.tmp'.format(path, os.getpid())
+      with open(temp_path, 'wb') as planfile:
+        planfile.write(data)
+      os.replace(temp_path, path)
+      self.EvictFromDisk(directory)
+    except (OSError, pickle.PicklingError, RecursionError):
+      pass
+
+  def EvictFromDisk(self, directory):
+    entries = []
+    total_size = 0
+    for name in os.listdir(directory):
+      if not name.endswith(PLAN_SUFFIX):
+        continue
+      path = os.path.join(directory, name)
+      try:
+        stat = os.stat(path)
+      except OSError:
+        continue
+      entries.append((stat.st_mtime, stat.st_size, path))
+      total_size += stat.st_size
+    entries.sort()
+    for _, size, path in entries:
+      if total_size <= self.max_disk_bytes:
+        break
+      try:
+        os.remove(path)
+      except OSError:
+        pass
+      total_size -= size
+
+CACHE = PlanCache()
+
+def Parse(lines, parser):
+  return CACHE.Parse(lines, parser)
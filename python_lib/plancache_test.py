@@ -0,0 +1,128 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import plancache
+import sql
+
+class CountingParser:
+  def __init__(self):
+    self.calls = 0
+
+  def __call__(self, lines):
+    self.calls += 1
+    return sql.GetCommandList(lines)
+
+class TestPlanCache(unittest.TestCase):
+  def setUp(self):
+    self.cache_dir = tempfile.mkdtemp()
+    self.old_cache_dir = os.environ.get(plancache.CACHE_DIR_VARIABLE)
+    os.environ[plancache.CACHE_DIR_VARIABLE] = self.cache_dir
+
+  def tearDown(self):
+    shutil.rmtree(self.cache_dir)
+    if self.old_cache_dir is None:
+      del os.environ[plancache.CACHE_DIR_VARIABLE]
+    else:
+      os.environ[plancache.CACHE_DIR_VARIABLE] = self.old_cache_dir
+
+  def CachedFiles(self):
+    return [f for f in os.listdir(self.cache_dir)
+            if f.endswith(plancache.PLAN_SUFFIX)]
+
+  def test_memory_hit(self):
+    cache = plancache.PlanCache()
+    parser = CountingParser()
+    first = cache.Parse(['EMPTY AS t;'], parser)
+    second = cache.Parse(['EMPTY AS t;'], parser)
+    self.assertIs(first, second)
+    self.assertEqual(1, parser.calls)
+    self.assertEqual(1, cache.hits)
+
+  def test_changed_content_is_a_miss(self):
+    cache = plancache.PlanCache()
+    parser = CountingParser()
+    cache.Parse(['EMPTY AS t;'], parser)
+    cache.Parse(['EMPTY AS u;'], parser)
+    self.assertEqual(2, parser.calls)
+
+  def test_line_boundaries_matter(self):
+    self.assertNotEqual(plancache.Key(['ab', 'c']), plancache.Key(['a', 'bc']))
+
+  def test_disk_hit(self):
+    parser = CountingParser()
+    plancache.PlanCache().Parse(['EMPTY AS t;'], parser)
+    self.assertEqual(1, len(self.CachedFiles()))
+    # A fresh cache (as in a new process) reads the plan from disk.
+    cache = plancache.PlanCache()
+    plan = cache.Parse(['EMPTY AS t;'], parser)
+    self.assertEqual(1, parser.calls)
+    self.assertEqual(1, cache.disk_hits)
+    tables = {}
+    plan.Eval(tables, {})
+    self.assertEqual(({}, []), tables['t'])
+
+  def test_corrupt_entry_is_reparsed(self):
+    parser = CountingParser()
+    plancache.PlanCache().Parse(['EMPTY AS t;'], parser)
+    path = os.path.join(self.cache_dir, self.CachedFiles()[0])
+    with open(path, 'wb') as planfile:
+      planfile.write(b'garbage')
+    plancache.PlanCache().Parse(['EMPTY AS t;'], parser)
+    self.assertEqual(2, parser.calls)
+
+  def test_parse_errors_are_not_cached(self):
+    cache = plancache.PlanCache()
+    with self.assertRaises(Exception):
+      cache.Parse(['EMPTY t;'], sql.GetCommandList)
+    self.assertEqual([], self.CachedFiles())
+    self.assertEqual(0, len(cache.plans))
+
+  def test_memory_eviction(self):
+    cache = plancache.PlanCache(max_entries=2)
+    parser = CountingParser()
+    for name in ['a', 'b', 'a', 'c', 'a']:
+      cache.Parse(['EMPTY AS {};'.format(name)], parser)
+    # 'b' was the least recently used when 'c' came in.
+    self.assertEqual(3, parser.calls)
+    self.assertEqual(2, len(cache.plans))
+
+  def test_disk_eviction(self):
+    cache = plancache.PlanCache(max_disk_bytes=1)
+    parser = CountingParser()
+    cache.Parse(['EMPTY AS t;'], parser)
+    cache.Parse(['EMPTY AS u;'], parser)
+    # Every entry is above the cap, so at most the newest can survive.
+    self.assertLessEqual(len(self.CachedFiles()), 1)
+
+  def test_disk_cache_disabled(self):
+    os.environ[plancache.CACHE_DIR_VARIABLE] = ''
+    plancache.PlanCache().Parse(['EMPTY AS t;'], CountingParser())
+    self.assertEqual([], self.CachedFiles())
+    # The disk cache is only used when the directory is given.
+    del os.environ[plancache.CACHE_DIR_VARIABLE]
+    self.assertIsNone(plancache.CacheDir())
+    cache = plancache.PlanCache()
+    parser = CountingParser()
+    cache.Parse(['EMPTY AS t;'], parser)
+    cache.Clear()
+    cache.Parse(['EMPTY AS t;'], parser)
+    self.assertEqual(2, parser.calls)
+    os.environ[plancache.CACHE_DIR_VARIABLE] = self.cache_dir
+
+  def test_run_file_uses_cache(self):
+    config = os.path.join(self.cache_dir, 'child.cfg')
+    with open(config, 'w') as config_file:
+      config_file.write('EMPTY AS t;\n')
+    plancache.CACHE.Clear()
+    misses = plancache.CACHE.misses
+    tables = {}
+    for target in ['x', 'y']:
+      sql.GetCommandList(
+          ['RUN FILE "{}" INTO {};'.format(config, target)]).Eval(tables, {})
+    self.assertEqual(misses + 1, plancache.CACHE.misses)
+    self.assertEqual(({}, []), tables['y'])
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,428 @@
+# Column pruning: works out, before evaluating a command (see cadmium.py),
+# which columns of the tables loaded and transformed by it (and by the
+# files it runs) are ever read, and doesn't compute the others.
+#
+# The plan is found by checking the command (see check.py), which goes
+# through all the commands it runs, including the files run with RUN FILE,
+# in the order of evaluation, knowing the schemas of all the tables. Every
+# column of a checked table gets an id, and the commands record which
+# columns every new column is computed from (see Computed), and which
+# columns are read in any other way: by the conditions of FILTERs, the keys
+# of JOINs and AGGREGATEs, DUMP, and so on (see Read). The columns that are
+# read, and the ones they're computed from (recursively), are live.
+#
+# When evaluating, LOAD and TRANSFORM don't compute the values of the
+# columns that aren't live, and store None instead (so the other columns
+# keep their positions). Their values are never read, so the results are
+# the same - except that the errors these values would raise aren't raised.
+# The columns calling assert() are always live.
+#
+# The FILTERs whose conditions only read columns copied (by at() or curr())
+# from a loaded table, through TRANSFORMs and other FILTERs, are evaluated by
+# the LOAD instead (see Pushdown), so the rows they reject are never stored,
+# or transformed. This needs the tables in between to be read by nothing
+# else (see Plan.uses), and the TRANSFORMs in between not to compute live
+# columns that could raise errors (or assert) for the rejected rows, which
+# is anything but copies and constants. If a condition fails in the LOAD,
+# the FILTERs evaluate all the rows themselves, and raise the usual error.
+#
+# The commands are evaluated in the same order they're checked in, so the
+# n-th evaluation of a command gets what was found for its n-th check (see
+# Planned). If it's evaluated for a different header than it was checked
+# for, the evaluation went differently, and pruning stops (the FILTERs
+# evaluated by the LOADs still filter their tables, which changes nothing).
+
+import collections
+
+import check
+import compiler
+import expression
+import optimizer
+
+# Set to False to compute all the columns, and filter all the rows in the
+# FILTERs.
+ENABLED = True
+
+# The Plan being built by the check, or None.
+_plan = None
+# What was found for the checks of the evaluated commands (see Planned), or
+# None.
+_live = None
+
+class Plan:
+  def __init__(self):
+    self.next_id = 0
+    # Maps the ids of the checked tables to the tables (so that they're not
+    # freed, and their ids reused) and the ids of their columns.
+    self.tables = {}
+    # Maps the ids of the computed columns to the ids of the columns they're
+    # computed from.
+    self.sources = {}
+    self.read = set()
+    # Counts the commands reading (or writing) every checked table.
+    self.uses = collections.Counter()
+    # Maps the ids of the checked tables to their Origins.
+    self.origins = {}
+    # The Pushdowns of the checked FILTERs of tables with Origins, in order.
+    self.filters = []
+    # The (command, header, function of the live columns returning what was
+    # found for the command) of every check of a LOAD, TRANSFORM or FILTER,
+    # in order.
+    self.checks = []
+
+  def NewColumns(self, count):
+    self.next_id += count
+    return list(range(self.next_id - count, self.next_id))
+
+  # The ids of the columns of a checked table, or None for tables with an
+  # unknown schema.
+  def Columns(self, table):
+    if not check.Known(table):
+      return None
+    if id(table) not in self.tables:
+      self.tables[id(table)] = (table, self.NewColumns(len(table[0])))
+    return self.tables[id(table)][1]
+
+  def Live(self):
+    live = set()
+    stack = list(self.read)
+    while stack:
+      column = stack.pop()
+      if column not in live:
+        live.add(column)
+        stack.extend(self.sources.get(column, []))
+    return live
+
+# The rows of a checked table that are the rows of a loaded table, filtered
+# by some FILTERs, with some of the columns copied from it.
+class Origin:
+  def __init__(self, filters, columns, path):
+    # The list of the Pushdowns the LOAD evaluates.
+    self.filters = filters
+    # The (0-indexed) columns of the loaded table every column is a copy of,
+    # or None.
+    self.columns = columns
+    # The ids of the tables from the loaded one to this one, with the
+    # Pushdowns of the FILTERs returning them (or None), and the ids of their
+    # columns that can raise errors when they're computed.
+    self.path = path
+
+  def Then(self, table, columns, pushdown=None, raising=()):
+    return Origin(self.filters, columns,
+                  self.path + [(id(table), pushdown, raising)])
+
+# A FILTER that can be evaluated by a LOAD: the header of the filtered table,
+# the context (see command.RowContext) to evaluate the condition in, and the
+# pairs of the (0-indexed) columns of the filtered table the condition reads
+# and the columns of the loaded table they're copies of.
+class Pushdown:
+  def __init__(self, command, header, context, columns, origin):
+    self.command = command
+    self.header = header
+    self.context = context
+    self.columns = columns
+    self.origin = origin
+    self.pushed = False
+
+  # Whether the LOAD can evaluate the FILTER: nothing else reads the tables
+  # in between, none of their live columns can raise errors, and the FILTERs
+  # before this one are evaluated by the LOAD.
+  def Pushable(self, uses, live):
+    return all(uses[table] == 1 and (pushdown is None or pushdown.pushed) and
+               not any(column in live for column in raising)
+               for table, pushdown, raising in self.origin.path)
+
+# Returns the list of whether the columns with the ids are live, or None if
+# all of them are.
+def Mask(ids, live):
+  if ids is None or all(column in live for column in ids):
+    return None
+  return [column in live for column in ids]
+
+# Whether a plan is being found (so the checked commands should record
+# their columns).
+def Planning():
+  return _plan is not None
+
+# The (0-indexed) columns of the table that evaluating expr in the context
+# (see command.RowContext) can read, or None if they depend on the row.
+def Reads(expr, context):
+  checker = check.Checker(context, None)
+  res = set()
+  def Range(beg, end):
+    beg = checker.Value(beg)
+    end = checker.Value(end)
+    if not isinstance(beg, int) or not isinstance(end, int) or beg < 1:
+      return False
+    end = end - 1 if end > 0 else context['?last']
+    res.update(range(beg - 1, end))
+    return True
+  def Visit(node):
+    if checker.Invariant(node):
+      return True
+    if isinstance(node, expression.AtExpr):
+      arg = checker.Value(node.arg)
+      if isinstance(arg, str) and compiler.IsColumnName(arg):
+        arg = context.get(arg)
+      if not isinstance(arg, int) or arg < 1:
+        return False
+      res.add(arg - 1)
+      return True
+    if isinstance(node, expression.CurrExpr):
+      res.add(context[context['?']] - 1)
+      return True
+    found = True
+    if isinstance(node, (expression.RangeExpr, expression.SeatAssignmentExpr)):
+      found = Range(node.beg, node.end)
+    return all([Visit(child) for child in optimizer.Children(node)]) and found
+  try:
+    return res if Visit(expr) else None
+  except Exception:
+    return None
+
+# The (0-indexed) column that the expression, reading the columns (see
+# Reads), copies, or None.
+def Copied(expr, columns):
+  if (isinstance(expr, (expression.AtExpr, expression.CurrExpr)) and
+      columns is not None and len(columns) == 1):
+    return next(iter(columns))
+  return None
+
+# Whether the expression has to be evaluated even if nothing reads its
+# value.
+def Asserts(expr):
+  return any(node.descr == 'assert' for node in compiler.Nodes(expr))
+
+# Records that the columns of the checked table (given by their 0-indexed
+# positions, or all of them) are read.
+def Read(table, columns=None):
+  if _plan is None:
+    return
+  ids = _plan.Columns(table)
+  if ids is None:
+    return
+  _plan.uses[id(table)] += 1
+  if columns is None:
+    _plan.read.update(ids)
+  else:
+    _plan.read.update(ids[column] for column in columns
+                      if 0 <= column < len(ids))
+
+# Records that the columns of the checked target table are the columns of
+# the sources, in order (like in a JOIN).
+def Passed(target, sources):
+  if _plan is None or not check.Known(target):
+    return
+  ids = []
+  for source in sources:
+    ids.extend(_plan.Columns(source))
+    _plan.uses[id(source)] += 1
+  _plan.tables[id(target)] = (target, ids)
+
+# Records that the command writes to the rows of the checked table (like
+# APPEND).
+def Written(table):
+  if _plan is not None and check.Known(table):
+    _plan.uses[id(table)] += 1
+
+# Records that the columns of the checked target table are computed by the
+# command from the columns of the source table, reads[i] being the
+# positions of the columns the i-th one is computed from (or None, if it
+# can read any of them), copies[i] the column it's a copy of (see Copied),
+# or None, and constants[i] whether it's a constant (which, like a copy,
+# can't raise errors). The live columns are later given to the command by
+# Live.
+# Source is None for LOAD.
+def Computed(command, source, target, reads, copies=None, constants=None):
+  if _plan is None:
+    return
+  ids = _plan.Columns(target)
+  if source is None:
+    filters = []
+    _plan.origins[id(target)] = Origin(filters, list(range(len(ids))),
+                                       [(id(target), None, ())])
+    _plan.checks.append((command, dict(target[0]),
+                         lambda live: (Mask(ids, live), filters)))
+    return
+  source_ids = _plan.Columns(source)
+  _plan.uses[id(source)] += 1
+  for column, columns in zip(ids, reads):
+    if columns is None:
+      _plan.sources[column] = source_ids
+    else:
+      _plan.sources[column] = [source_ids[i] for i in columns
+                               if 0 <= i < len(source_ids)]
+  origin = _plan.origins.get(id(source))
+  if origin is not None and copies is not None:
+    raising = [column for column, copy, constant
+               in zip(ids, copies, constants or [False] * len(ids))
+               if copy is None and not constant]
+    _plan.origins[id(target)] = origin.Then(target, [
+        None if column is None else origin.columns[column]
+        for column in copies], raising=raising)
+  _plan.checks.append((command, dict(source[0]), lambda live: Mask(ids, live)))
+
+# Records that the checked target table is the source table filtered by the
+# command, the condition of which, evaluated in the context, reads the
+# columns (see Reads). Whether the rows are filtered by a LOAD instead is
+# later given to the command by Pushed.
+def Filtered(command, source, target, reads, context):
+  if _plan is None:
+    return
+  Read(source, reads)
+  _plan.tables[id(target)] = (target, _plan.Columns(source))
+  origin = _plan.origins.get(id(source))
+  if origin is None:
+    _plan.checks.append((command, dict(source[0]), lambda live: None))
+    return
+  columns = None
+  if reads is not None and all(origin.columns[column] is not None
+                               for column in reads):
+    columns = [(column, origin.columns[column]) for column in sorted(reads)]
+  pushdown = Pushdown(command, dict(source[0]), context, columns, origin)
+  _plan.origins[id(target)] = origin.Then(target, origin.columns, pushdown)
+  _plan.filters.append(pushdown)
+  _plan.checks.append((command, dict(source[0]), lambda live: pushdown))
+
+# Records that the DUMP reads all the columns of the checked table. Whether
+# anything else reads its rows is later given to the DUMP by Kept.
+def Dumped(command, table):
+  if _plan is None:
+    return
+  Read(table)
+  if not check.Known(table):
+    _plan.checks.append((command, None, lambda live: True))
+    return
+  uses = _plan.uses
+  _plan.checks.append((command, dict(table[0]),
+                       lambda live: uses[id(table)] > 1))
+
+# Records that the command couldn't be checked (for a table with an unknown
+# schema), so it will compute all the columns (and rows).
+def Unchecked(command):
+  if _plan is not None:
+    _plan.checks.append((command, None, lambda live: None))
+
+# Returns what was found for the command, evaluated for a table with the
+# given header (see Find), or None if there's no plan.
+def Planned(command, header):
+  if _live is None or id(command) not in _live:
+    return None
+  _, checks = _live[id(command)]
+  if not checks or checks[0][0] not in (None, header):
+    Stop()
+    return None
+  return checks.popleft()[1]
+
+# Returns the list of whether every column the TRANSFORM, evaluated for a
+# table with the given header, computes is live, or None if all of them are.
+def Live(command, header):
+  return Planned(command, header)
+
+# Returns the list of whether every column the LOAD, reading a file with the
+# given header, computes is live (or None if all of them are), and the
+# function returning whether a row passes the FILTERs the LOAD evaluates (or
+# None, if there are none).
+def Loaded(command, header):
+  planned = Planned(command, header)
+  if planned is None:
+    return None, None
+  live, filters = planned
+  if not filters:
+    return live, None
+  keeps = [(len(pushdown.header), pushdown.columns,
+            pushdown.command.RowFunction(pushdown.context, pushdown.header))
+           for pushdown in filters]
+  def Keep(row):
+    if not filters[0].pushed:
+      return True
+    try:
+      for width, columns, keep in keeps:
+        filtered = [None] * width
+        for column, loaded in columns:
+          filtered[column] = row[loaded]
+        if not keep(filtered):
+          return False
+    except Exception:
+      # The FILTERs evaluate all the rows, and raise the error themselves.
+      for pushdown in filters:
+        pushdown.pushed = False
+    return True
+  return live, Keep
+
+# Whether anything but the DUMP, evaluated for a table with the given
+# header, reads the rows of the table.
+def Kept(command, header):
+  kept = Planned(command, header)
+  return kept is None or kept
+
+# Returns the Pushdown of the FILTER, evaluated for a table with the given
+# header, or None. The rows are already filtered by the LOAD while its
+# pushed is True (and while streaming, the LOAD can stop filtering them
+# midway, see command.Stream).
+def Pushed(command, header):
+  return Planned(command, header)
+
+# Stops pruning, for the rest of the evaluation.
+def Stop():
+  global _live
+  _live = None
+
+# Returns the state of the plan, for Restore to go back to before the
+# commands evaluated since are evaluated again.
+def Save():
+  if _live is None:
+    return None
+  return {key: (command, collections.deque(checks))
+          for key, (command, checks) in _live.items()}
+
+def Restore(saved):
+  global _live
+  _live = saved
+
+# Checks the command, and returns what was found for every check of a LOAD,
+# TRANSFORM or FILTER (see Planned), or None if the command fails the check.
+# If the command is evaluated on some tables (of which only the names are
+# known), the tables it leaves are read by the caller.
+def Find(comm, params, tables=None):
+  global _plan
+  _plan = Plan()
+  try:
+    checked = {name: check.UNKNOWN for name in tables or {}}
+    comm.Check(checked, dict(params))
+    if tables is not None:
+      for table in checked.values():
+        Read(table)
+    plan = _plan
+  except Exception:
+    return None
+  finally:
+    _plan = None
+  live = plan.Live()
+  for pushdown in plan.filters:
+    pushdown.pushed = (pushdown.columns is not None and
+                       pushdown.Pushable(plan.uses, live))
+    if pushdown.pushed:
+      pushdown.origin.filters.append(pushdown)
+  res = {}
+  for command, header, found in plan.checks:
+    if id(command) not in res:
+      res[id(command)] = (command, collections.deque())
+    res[id(command)][1].append((header, found(live)))
+  return res
+
+# Evaluates the command on the tables (by default on no tables, discarding
+# the ones it leaves), not computing the columns nothing reads, and
+# filtering the rows in LOADs where possible. Returns the output of the
+# command.
+def Eval(comm, params, tables=None):
+  global _live
+  if ENABLED:
+    _live = Find(comm, params, tables)
+  try:
+    if tables is None:
+      # Nothing reads the tables left, so they're freed after their last use.
+      return comm.Eval({}, params, set())
+    return comm.Eval(tables, params)
+  finally:
+    _live = None
@@ -0,0 +1,224 @@
+import os
+import re
+import shutil
+import tempfile
+import unittest
+
+import command
+import prune
+import sql
+
+class TestPrune(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.old_dir = os.getcwd()
+    os.chdir(self.dir)
+    self.Write('votes.csv', ['teryt;county;party;votes;comment',
+                             '1;a;x;10;', '2;a;y;20;z', '3;b;x;5;'])
+    # Returns the table with its teryt and votes, like the configs in data/.
+    self.Write('votes.cfg', ['LOAD raw FROM "votes.csv";',
+                             'TRANSFORM raw TO table WITH curr() FOR 1:3,',
+                             '  party AS party, int(votes) AS votes,',
+                             '  if(comment = "", 0, 1) AS comment;',
+                             'OUTPUT TABLES table;'])
+
+  def tearDown(self):
+    os.chdir(self.old_dir)
+    shutil.rmtree(self.dir)
+
+  def Write(self, name, lines):
+    with open(name, 'w') as f:
+      f.write('\n'.join(lines) + '\n')
+
+  # Returns the live columns of the checks of every LOAD and TRANSFORM, in
+  # the order of their first checks (see prune.Find).
+  def Live(self, commands):
+    found = prune.Find(sql.GetCommandList(commands), {}).values()
+    return [[live[0] if isinstance(comm, command.Load) else live
+             for _, live in checks]
+            for comm, checks in found
+            if isinstance(comm, (command.Load, command.Transform))]
+
+  # Returns whether anything else reads the rows of the tables of every
+  # DUMP.
+  def Kept(self, commands):
+    found = prune.Find(sql.GetCommandList(commands), {}).values()
+    return [[kept for _, kept in checks]
+            for comm, checks in found if isinstance(comm, command.Dump)]
+
+  # Returns whether the checks of every FILTER are evaluated by LOADs.
+  def Pushed(self, commands):
+    found = prune.Find(sql.GetCommandList(commands), {}).values()
+    return [[pushdown is not None and pushdown.pushed
+             for _, pushdown in checks]
+            for comm, checks in found if isinstance(comm, command.Filter)]
+
+  # Evaluates the commands with and without pruning, and returns the output.
+  def Eval(self, commands):
+    comm = sql.GetCommandList(commands)
+    prune.ENABLED = False
+    try:
+      expected = prune.Eval(comm, {})
+    finally:
+      prune.ENABLED = True
+    res = prune.Eval(comm, {})
+    self.assertEqual(expected, res)
+    return res
+
+  def test_live_columns(self):
+    # The columns read across RUN FILE.
+    live = [True, False, False, True, False]
+    self.assertEqual([[live], [live], [None]],
+                     self.Live(['RUN FILE "votes.cfg" INTO v;',
+                                'TRANSFORM v TO w WITH votes * 2 AS votes;',
+                                'FILTER w BY at(1) > 0;',
+                                'AGGREGATE v BY teryt WITH sum(1) AS n;']))
+    # A row-dependent at(), and a DUMP, read all the columns.
+    self.assertEqual([[None], [None]],
+                     self.Live(['RUN FILE "votes.cfg" INTO v;',
+                                'FILTER v BY at(votes) = 1;']))
+    self.assertEqual([[None], [None]],
+                     self.Live(['RUN FILE "votes.cfg" INTO v;', 'DUMP v;']))
+
+  def test_eval(self):
+    self.assertEqual(['votes', '20', '40', '10'],
+                     self.Eval(['RUN FILE "votes.cfg" INTO v;',
+                                'TRANSFORM v TO w WITH votes * 2 AS votes;',
+                                'DUMP w;']))
+    self.assertEqual(['votes', '20'],
+                     self.Eval(['RUN COMMAND "LOAD raw FROM \'votes.csv\';"',
+                                '  INTO v;',
+                                'TRANSFORM v WITH county AS c, int(votes) AS v;',
+                                'FILTER v BY c = "a";',
+                                'AGGREGATE v WITH sum(v) AS votes;',
+                                'FILTER v BY votes > 25;',
+                                'TRANSFORM v WITH votes - 10 AS votes;',
+                                'DUMP v;']))
+
+  def test_filter_in(self):
+    # The column looked up by IN is read, and only the other FILTER is
+    # evaluated by a LOAD.
+    commands = ['RUN FILE "votes.cfg" INTO v;',
+                'LOAD raw FROM "votes.csv";',
+                'TRANSFORM raw TO k WITH teryt AS t, county AS c;',
+                'FILTER k BY c = "a";',
+                'FILTER v BY teryt NOT IN k.t;',
+                'DUMP v;']
+    self.assertEqual([[True]], self.Pushed(commands))
+    self.assertEqual(['teryt;county;party;votes;comment', '3;b;x;5;0'],
+                     self.Eval(commands))
+
+  def test_pushdown(self):
+    # The party is copied from the loaded table, the votes are not. The
+    # TRANSFORM computing the votes could fail for the rows the FILTERs
+    # reject, so they're all evaluated by the FILTERs.
+    commands = ['RUN FILE "votes.cfg" INTO v;',
+                'FILTER v BY not(party = "y");',
+                'FILTER v BY votes > 5;',
+                'FILTER v BY startswith(at(1), "1");',
+                'DUMP v;']
+    self.assertEqual([[False], [False], [False]], self.Pushed(commands))
+    self.assertEqual(['teryt;county;party;votes;comment', '1;a;x;10;0'],
+                     self.Eval(commands))
+    commands = ['LOAD raw FROM "votes.csv";',
+                'TRANSFORM raw TO v WITH curr() FOR 1:3, party AS party,',
+                '  "x" AS source;',
+                'FILTER v BY not(party = "y");',
+                'FILTER v BY startswith(at(1), "1");',
+                'DUMP v;']
+    self.assertEqual([[True], [True]], self.Pushed(commands))
+    self.assertEqual(['teryt;county;party;source', '1;a;x;x'],
+                     self.Eval(commands))
+    # The errors of the rows the FILTER rejects are raised.
+    commands = ['LOAD raw FROM "votes.csv";',
+                'TRANSFORM raw TO t WITH county AS c,',
+                '  1 / (int(votes) - 20) AS q;',
+                'FILTER t BY c = "b";',
+                'DUMP t;']
+    self.assertEqual([[False]], self.Pushed(commands))
+    with self.assertRaisesRegex(ValueError, 'evaluating q'):
+      prune.Eval(sql.GetCommandList(commands), {})
+    # The filtered table, and the tables in between, can't be read by
+    # anything else.
+    self.assertEqual([[False]],
+                     self.Pushed(['LOAD raw FROM "votes.csv";',
+                                  'TRANSFORM raw TO t WITH county AS c;',
+                                  'FILTER t BY c = "a";',
+                                  'DUMP raw;']))
+    self.assertEqual([[False]],
+                     self.Pushed(['LOAD raw FROM "votes.csv";',
+                                  'FILTER raw TO t BY county = "a";',
+                                  'DUMP raw;']))
+    self.assertEqual([[False]],
+                     self.Pushed(['LOAD raw FROM "votes.csv";',
+                                  'APPEND 4, "b", "x", 1, "" TO raw;',
+                                  'FILTER raw BY county = "a";']))
+    # The rows of a file run twice are filtered by every check.
+    self.Write('child.cfg', ['LOAD raw FROM "votes.csv";',
+                             'FILTER raw BY county = $county;',
+                             'OUTPUT TABLES raw;'])
+    self.assertEqual(['teryt;county;party;votes;comment', '3;b;x;5;',
+                      'teryt;county;party;votes;comment', '1;a;x;10;',
+                      '2;a;y;20;z'],
+                     self.Eval(['RUN FILE "child.cfg" WITH PARAM county b;',
+                                'DUMP raw;',
+                                'DROP raw;',
+                                'RUN FILE "child.cfg" WITH PARAM county a;',
+                                'DUMP raw;']))
+
+  def test_kept(self):
+    self.assertEqual([[False]],
+                     self.Kept(['RUN FILE "votes.cfg" INTO v;', 'DUMP v;']))
+    self.assertEqual([[True], [False]],
+                     self.Kept(['RUN FILE "votes.cfg" INTO v;', 'DUMP v;',
+                                'TRANSFORM v TO w WITH votes AS votes;',
+                                'DUMP w;']))
+    # The tables left are read by the caller.
+    tables = {}
+    prune.Eval(sql.GetCommandList(['RUN FILE "votes.cfg" INTO v;',
+                                   'TRANSFORM v WITH votes AS votes;',
+                                   'DUMP v;']), {}, tables)
+    self.assertEqual(({'votes': 0}, [[10], [20], [5]]), tables['v'])
+    # Without --stream, the DUMP leaves the rows even if nothing reads them.
+    comm = sql.GetCommandList(['RUN FILE "votes.cfg" INTO v;', 'DUMP v;'])
+    tables = {}
+    prune.Restore(prune.Find(comm, {}))
+    try:
+      comm.Eval(tables, {})
+    finally:
+      prune.Stop()
+    self.assertEqual(3, len(tables['v'][1]))
+
+  def test_errors(self):
+    # The comments can't be converted to ints, but nothing reads them.
+    self.assertEqual(['n', '30'],
+                     prune.Eval(sql.GetCommandList([
+                         'RUN FILE "votes.cfg" INTO v;',
+                         'TRANSFORM v WITH county AS county, votes AS votes,',
+                         '  int(comment) AS comment;',
+                         'AGGREGATE v BY county WITH sum(votes) AS n;',
+                         'FILTER v BY n > 20;',
+                         'DUMP v;']), {}))
+    # Asserts are evaluated, even if their values aren't read.
+    comm = sql.GetCommandList([
+        'RUN FILE "votes.cfg" INTO v;',
+        'TRANSFORM v TO w WITH assert(votes < 20) AS checked, teryt AS t;',
+        'DUMP v;'])
+    with self.assertRaises(ValueError):
+      prune.Eval(comm, {})
+    # The rows in the errors have the values of the columns nothing reads.
+    comm = sql.GetCommandList(['LOAD raw FROM "votes.csv";',
+                               'FILTER raw BY votes > "10";',
+                               'TRANSFORM raw WITH int(comment) AS c;',
+                               'DUMP raw;'])
+    with self.assertRaisesRegex(
+        ValueError, re.escape("for row ['2', 'a', 'y', '20', 'z']")):
+      prune.Eval(comm, {})
+    # The FILTERs evaluated by LOADs raise their errors themselves.
+    comm = sql.GetCommandList(['LOAD raw FROM "votes.csv";',
+                               'FILTER raw BY int(county) > 0;'])
+    with self.assertRaisesRegex(ValueError, 'FAILED FILTER'):
+      prune.Eval(comm, {})
+
+if __name__ == '__main__':
+  unittest.main()
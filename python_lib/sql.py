@@ -1,10 +1,12 @@
 # This is an in-memory kinda SQL interpreter.
 import math
+import operator
 import random
 
 import tokenizer
 import expression
 import command
+import optimizer
 from tokens import *
 
 # Types:
@@ -32,40 +34,39 @@ def assert_and_return(x):
   return x
 
 UNARY_FUNCTIONS = {
-  'sqrt': (lambda a: math.sqrt(a), [INT, FLOAT], FLOAT_1),
-  'int': (lambda a: int(a), [INT, FLOAT, STRING], INT_1),
-  'len': (lambda a: len(a), [STRING], INT_1),
-  'not': (lambda a: not a, [BOOL], BOOL_1),
-  'abs': (lambda a: abs(a), [INT, FLOAT], MIRROR_1),
+  'sqrt': (math.sqrt, [INT, FLOAT], FLOAT_1),
+  'int': (int, [INT, FLOAT, STRING], INT_1),
+  'len': (len, [STRING], INT_1),
+  'not': (operator.not_, [BOOL], BOOL_1),
+  'abs': (abs, [INT, FLOAT], MIRROR_1),
   'assert': (assert_and_return, [BOOL], BOOL_1)
 }
 BINARY_FUNCTIONS = {
-  'min': (lambda a, b: min(a,b), [INT, FLOAT], [INT, FLOAT], NUMERIC),
-  'beginning': (lambda a, b: a[:b], [STRING], [INT], STRING_2),
-  'end': (lambda a, b: a[b:], [STRING], [INT], STRING_2),
-  'and': (lambda a, b: a and b, [BOOL], [BOOL], BOOL_2),
-  'or': (lambda a, b: a or b, [BOOL], [BOOL], BOOL_2),
-  'startswith': (lambda a, b: a.startswith(b), [STRING], [STRING], BOOL_2),
-  'contains': (lambda a, b: b in a, [STRING], [STRING], BOOL_2)
+  'min': (min, [INT, FLOAT], [INT, FLOAT], NUMERIC),
+  'beginning': (expression.string_beginning, [STRING], [INT], STRING_2),
+  'end': (expression.string_end, [STRING], [INT], STRING_2),
+  'and': (expression.logical_and, [BOOL], [BOOL], BOOL_2),
+  'or': (expression.logical_or, [BOOL], [BOOL], BOOL_2),
+  'startswith': (expression.startswith, [STRING], [STRING], BOOL_2),
+  'contains': (operator.contains, [STRING], [STRING], BOOL_2)
 }
 TERNARY_FUNCTIONS = {
+  # The type of 'if' is calculated separately, see GetFactor.
   'if': ('SPECIAL', [BOOL], ANY, ANY, lambda a, b, c: b),
-  'substr': (lambda a, b, c: a[b:c], [STRING], [INT], [INT], STRING_3),
-  'replace': (lambda a, b, c: a.replace(b, c), [STRING], [STRING], [STRING],
-              STRING_3)
+  'substr': (expression.substr, [STRING], [INT], [INT], STRING_3),
+  'replace': (expression.replace, [STRING], [STRING], [STRING], STRING_3)
 }
 # For now, since the range functions are applied straight to columns, the
 # allowed input types are ignored.
 RANGE_FUNCTIONS = {
-  'concat_range': ('', lambda a, b: a + b, [STRING], [STRING]),
-  'sum_range': (0, lambda a, b: a + b, [INT, FLOAT], [INT, FLOAT]),
-  'and_range': (True, lambda a, b: a and b, [BOOL], [BOOL]),
+  'concat_range': ('', operator.add, [STRING], [STRING]),
+  'sum_range': (0, operator.add, [INT, FLOAT], [INT, FLOAT]),
+  'and_range': (True, expression.logical_and, [BOOL], [BOOL]),
 }
 AGGREGATE_FUNCTIONS = {
-  'sum': (0, lambda a, b: a + b, [INT, FLOAT], MIRROR_1),
-  'max': (None, lambda a, b: b if a is None else max(a,b), 
-          [INT, FLOAT, STRING], MIRROR_1),
-  'and': (0, lambda a, b: a + b, [BOOL], MIRROR_1),
+  'sum': (0, operator.add, [INT, FLOAT], MIRROR_1),
+  'max': (None, expression.maximum, [INT, FLOAT, STRING], MIRROR_1),
+  'and': (0, operator.add, [BOOL], MIRROR_1),
 }
 
 # Calculates the possible output types of a function.
@@ -106,13 +107,14 @@ KEYWORDS = FUNCTION_NAMES + [
   'PARAM', 'PREFIX', 'IMPORT']
 
 def TryPop(tokens, expected_type=None, expected_value=None):
-  if not tokens:
+  token = tokens.Peek()
+  if token is None:
     return None
-  if expected_type is not None and tokens[0].typ != expected_type:
+  if expected_type is not None and token.typ != expected_type:
     return None
-  if expected_value is not None and tokens[0].value != expected_value:
+  if expected_value is not None and token.value != expected_value:
     return None
-  return tokens.pop(0)
+  return tokens.Pop()
 
 def InvalidToken(message, token):
   raise ValueError(*message, token.DebugString())
@@ -121,7 +123,7 @@ def FailedPop(tokens, message):
   if not tokens:
     raise ValueError(message, 'Token list empty')
   else:
-    raise ValueError(message, tokens[0].DebugString())
+    raise ValueError(message, tokens.Peek().DebugString())
 
 def ForcePop(tokens, expected_type=None, expected_value=None):
   token = TryPop(tokens, expected_type, expected_value)
@@ -157,11 +159,11 @@ def GetRange(tokens, settings):
       endval = GetExpression(tokens, settings)
       end = expression.If(
           expression.BinaryExpr(
-              endval, expression.Constant(0, midtoken), lambda a, b: a < b,
+              endval, expression.Constant(0, midtoken), operator.lt,
               midtoken, '<'),
           expression.NumColumnsExpr(midtoken), endval, midtoken)
       ForcePop(tokens, SYMBOL, ']')
-    return beg, end
+    return optimizer.Fold(beg), optimizer.Fold(end)
   begtoken = TryPop(tokens, NUMBER)
   midtoken = ForcePop(tokens, SYMBOL, ':')
   endtoken = TryPop(tokens, NUMBER)
@@ -175,7 +177,15 @@ def GetRange(tokens, settings):
             expression.Constant(endval < 0, endtoken),
             expression.NumColumnsExpr(endtoken),
             expression.Constant(endval, endtoken), endtoken)
-  return beg, end
+  return optimizer.Fold(beg), optimizer.Fold(end)
+
+# Records the inferred types in the expression (the first time we see it,
+# that is before they're narrowed down by what the context expects).
+def Typed(res):
+  expr, typ = res
+  if expr.types is None:
+    expr.types = list(typ)
+  return res
 
 def GetFactor(tokens, settings):
   token = ForcePop(tokens)
@@ -209,6 +219,9 @@ def GetFactor(tokens, settings):
         f = TERNARY_FUNCTIONS[token.value]
         typ = CalcType3(f[1], arg1[1], f[2], arg2[1], f[3], arg3[1], f[4])
         if token.value == 'if':
+          # The result is either of the branches.
+          if typ:
+            typ = arg2[1] + [t for t in arg3[1] if t not in arg2[1]]
           res = expression.If(arg1[0], arg2[0], arg3[0], token)
         else:
           res = expression.TernaryExpr(
@@ -289,13 +302,14 @@ def GetFactor(tokens, settings):
   InvalidToken(['Unexpected token when trying to get factor'], token)
 
 def GetProduct(tokens, settings):
-  expr, typ = GetFactor(tokens, expect(settings, ANY))
+  expr, typ = Typed(GetFactor(tokens, expect(settings, ANY)))
   if INT not in typ and FLOAT not in typ:
     return (expr, typ)
-  while tokens and tokens[0].typ == 'symbol' and tokens[0].value in '*/':
+  while (tokens and tokens.Peek().typ == 'symbol' and
+         tokens.Peek().value in '*/'):
     typ = [t for t in typ if t == INT or t == FLOAT]
     token = ForcePop(tokens)
-    rexpr, rtyp = GetFactor(tokens, settings)
+    rexpr, rtyp = Typed(GetFactor(tokens, settings))
     if INT not in rtyp and FLOAT not in rtyp:
       InvalidToken(['Can only divide and multiply numbers'], token)
     if FLOAT not in typ and FLOAT not in rtyp:
@@ -311,14 +325,15 @@ def GetProduct(tokens, settings):
   return (expr, typ)
 
 def GetSum(tokens, settings):
-  expr, typ = GetProduct(tokens, expect(settings, ANY))
+  expr, typ = Typed(GetProduct(tokens, expect(settings, ANY)))
   typ = [t for t in typ if t in settings[EXPECTED_TYPES]]
   if INT not in typ and FLOAT not in typ and STRING not in typ:
     return (expr, typ)
-  while tokens and tokens[0].typ == 'symbol' and tokens[0].value in '+-':
+  while (tokens and tokens.Peek().typ == 'symbol' and
+         tokens.Peek().value in '+-'):
     typ = [t for t in typ for t in [INT, FLOAT, STRING]]
     token = ForcePop(tokens)
-    rexpr, rtyp = GetProduct(tokens, settings)
+    rexpr, rtyp = Typed(GetProduct(tokens, settings))
     ftyp = []
     if STRING in typ and STRING in rtyp and token.value == '+':
       ftyp.append(STRING)
@@ -337,12 +352,12 @@ def GetSum(tokens, settings):
   return (expr, typ)
 
 def GetComparison(tokens, settings):
-  expr, typ = GetSum(tokens, expect(settings, ANY))
-  if (tokens and tokens[0].typ == 'symbol' and tokens[0].value in '<=>' and
-      BOOL in settings[EXPECTED_TYPES]):
+  expr, typ = Typed(GetSum(tokens, expect(settings, ANY)))
+  if (tokens and tokens.Peek().typ == 'symbol' and
+      tokens.Peek().value in '<=>' and BOOL in settings[EXPECTED_TYPES]):
     token = ForcePop(tokens)
     # TODO: I could do more string checks here; I don't accept any types.
-    rexpr, _ = GetSum(tokens, expect(settings, ANY))
+    rexpr, _ = Typed(GetSum(tokens, expect(settings, ANY)))
     if token.value == '=':
       return (expression.Equal(expr, rexpr, token), [BOOL])
     elif token.value == '<':
@@ -352,8 +367,8 @@ def GetComparison(tokens, settings):
   return (expr, typ)
 
 def GetExpressionFull(tokens, settings):
-  token = tokens[0]
-  res, typ = GetComparison(tokens, settings)
+  token = tokens.Peek()
+  res, typ = Typed(GetComparison(tokens, settings))
   return (res, typ)
 
 # Expression grammar
@@ -400,7 +415,7 @@ def expect(settings, expected_types):
           EXPECTED_TYPES: expected_types}
 
 def GetExpression(tokens, settings):
-  token = tokens[0]
+  token = tokens.Peek()
   if EXPECTED_TYPES not in settings:
     settings[EXPECTED_TYPES] = ANY
   if WORDS_AS_CONSTANTS not in settings:
@@ -411,7 +426,7 @@ def GetExpression(tokens, settings):
     raise InvalidToken([
         'Type mismatch, expected one of {}, got one of {}'.format(
             settings[EXPECTED_TYPES], typ)], token)
-  return expr
+  return optimizer.Memoize(optimizer.Fold(expr))
 
 #----------------------------------------------------------------------#
 QUOTED_STRING = {WORDS_AS_CONSTANTS: False, EXPECTED_TYPES: [STRING]}
@@ -438,7 +453,7 @@ def GetDumpTable(tokens, line):
   if TryPop(tokens, WORD, 'TO'):
     path = GetExpression(tokens, UNQUOTED_STRING)
   else:
-    path = expression.Constant('stdout', tokens[0])
+    path = expression.Constant('stdout', tokens.Peek())
   return command.Dump(line, name, path)
 
 def GetPrint(tokens, line):
@@ -446,12 +461,12 @@ def GetPrint(tokens, line):
   if TryPop(tokens, WORD, 'TO'):
     path = GetExpression(tokens, UNQUOTED_STRING)
   else:
-    path = expression.Constant('stdout', tokens[0])
+    path = expression.Constant('stdout', tokens.Peek())
   return command.Print(line, expr, path)
 
 
 def GetRunSource(tokens):
-  line = tokens[0].line
+  line = tokens.Peek().line
   if TryPop(tokens, WORD, 'FILE'):
     return ('FILE', GetExpression(tokens, QUOTED_STRING), line)
   elif TryPop(tokens, WORD, 'COMMAND'):
@@ -462,9 +477,9 @@ def GetRunSource(tokens):
 def GetRun(tokens, line):
   runnables = []
   random_names = []
-  storedtoken = tokens[0]
+  storedtoken = tokens.Peek()
   while True:
-    storedtoken = tokens[0]
+    storedtoken = tokens.Peek()
     source = GetRunSource(tokens)
     runnable = {'INPUT': source, 'FROM': [], 'INTO': None, 'PARAMS': {},
                 'PARAM_PREFIX': expression.Constant('', storedtoken),
@@ -526,10 +541,10 @@ def GetRun(tokens, line):
 
 def GetImport(tokens, line):
   path = GetExpression(tokens, UNQUOTED_STRING)
-  options = {command.PREFIX: expression.Constant('', tokens[0]),
+  options = {command.PREFIX: expression.Constant('', tokens.Peek()),
              command.EXTRA_PARAMS: {},
              command.EXTRA_TABLES: [],
-             command.PARAM_PREFIX: expression.Constant('', tokens[0]),
+             command.PARAM_PREFIX: expression.Constant('', tokens.Peek()),
              command.TARGET_TABLE: None}
   while token := TryPop(tokens, WORD, 'WITH'):
     if TryPop(tokens, WORD, 'PREFIX'):
@@ -578,38 +593,85 @@ def GetTransform(tokens, line):
   expr_list = GetExprList(tokens)
   return command.Transform(line, source_table, target_table, expr_list)
 
+def GetGroupKeys(tokens):
+  group_list = []
+  while True:
+    group_key = None
+    if word := TryPop(tokens, WORD):
+      group_key = word.value
+    elif var := TryPop(tokens, PARAM):
+      try:
+        group_key = int(var.value)
+      except ValueError:
+        group_key = var.value
+    else:
+      FailedPop(tokens, ['Word or variable expected as group key'])
+    group_list.append(group_key)
+    if TryPop(tokens, SYMBOL, ',') is None:
+      break
+  return group_list
+
+# After BY, ROLLUP is a keyword only if group keys follow it, so a single
+# group key can still be a column named ROLLUP (as in BY ROLLUP WITH ...).
+def PopRollup(tokens):
+  token = tokens.Peek()
+  following = tokens.Peek(1)
+  if (token is None or token.typ != WORD or token.value != 'ROLLUP' or
+      following is None):
+    return None
+  if following.typ == PARAM or (following.typ == WORD and
+                                following.value not in ['WITH', 'AND']):
+    return tokens.Pop()
+  return None
+
+# Aggregates by one or more grouping sets, each with its target table:
+#   AGGREGATE source [TO target] [BY keys] [AND TO target [BY keys]]* WITH ...
+#   AGGREGATE source [TO target, target, ...] BY ROLLUP keys WITH ...
+# where ROLLUP groups the first target by all the keys, and every next one by
+# one key fewer (so with a single target, it groups by all the keys).
 def GetAggregate(tokens, line):
   source_table = GetExpression(tokens, UNQUOTED_STRING)
-  target_table = None
-  if TryPop(tokens, WORD, 'TO'):
-    target_table = GetExpression(tokens, UNQUOTED_STRING)
-  group_list = []
-  if TryPop(tokens, WORD, 'BY'):
-    while True:
-      group_key = None
-      if word := TryPop(tokens, WORD):
-        group_key = word.value
-      elif var := TryPop(tokens, PARAM):
-        try:
-          group_key = int(var.value)
-        except ValueError:
-          group_key = var.value
-      else:
-        FailedPop(tokens, ['Word or variable expected as group key'])
-      group_list.append(group_key)
-      if TryPop(tokens, SYMBOL, ',') is None:
-        break
+  grouping_sets = []
+  while True:
+    target_tables = [None]
+    if grouping_sets:
+      # Only the first grouping set can replace the source table.
+      ForcePop(tokens, WORD, 'TO')
+    if grouping_sets or TryPop(tokens, WORD, 'TO'):
+      target_tables = [GetExpression(tokens, UNQUOTED_STRING)]
+      while TryPop(tokens, SYMBOL, ','):
+        target_tables.append(GetExpression(tokens, UNQUOTED_STRING))
+    group_list = []
+    if len(target_tables) > 1:
+      ForcePop(tokens, WORD, 'BY')
+      ForcePop(tokens, WORD, 'ROLLUP')
+      group_list = GetGroupKeys(tokens)
+      if len(target_tables) > len(group_list) + 1:
+        FailedPop(tokens, ['ROLLUP of {} keys has at most {} levels'.format(
+            len(group_list), len(group_list) + 1)])
+      for i, target_table in enumerate(target_tables):
+        grouping_sets.append((target_table, group_list[:len(group_list) - i]))
+    else:
+      if TryPop(tokens, WORD, 'BY'):
+        PopRollup(tokens)
+        group_list = GetGroupKeys(tokens)
+      grouping_sets.append((target_tables[0], group_list))
+    if not TryPop(tokens, WORD, 'AND'):
+      break
   ForcePop(tokens, WORD, 'WITH')
   expr_list = GetExprList(tokens)
-  return command.Aggregate(
-      line, source_table, target_table, group_list, expr_list)
-      
+  return command.Aggregate(line, source_table, grouping_sets, expr_list)
+
 def GetJoin(tokens, line):
-  left_table = GetExpression(tokens, UNQUOTED_STRING)
+  left_tables = [GetExpression(tokens, UNQUOTED_STRING)]
+  while TryPop(tokens, WORD, 'AND'):
+    left_tables.append(GetExpression(tokens, UNQUOTED_STRING))
   ForcePop(tokens, WORD, 'INTO')
   right_table = GetExpression(tokens, UNQUOTED_STRING)
   ForcePop(tokens, WORD, 'ON')
-  left_expr = GetExpression(tokens, {})
+  left_exprs = [GetExpression(tokens, {})]
+  while TryPop(tokens, SYMBOL, ','):
+    left_exprs.append(GetExpression(tokens, {}))
   comparator = None
   if TryPop(tokens, WORD, 'EQ'):
     comparator = 'EQ'
@@ -617,9 +679,17 @@ def GetJoin(tokens, line):
     comparator = 'PREFIX'
   else:
     FailedPop(tokens, ['Invalid comparator'])
-  right_expr = GetExpression(tokens, {})
+  right_exprs = [GetExpression(tokens, {})]
+  while TryPop(tokens, SYMBOL, ','):
+    right_exprs.append(GetExpression(tokens, {}))
+  if len(left_exprs) != len(right_exprs):
+    FailedPop(tokens, ['Joining {} keys with {} keys'.format(
+        len(left_exprs), len(right_exprs))])
+  if comparator == 'PREFIX' and len(left_exprs) > 1:
+    FailedPop(tokens, ['PREFIX joins have to have a single key'])
   unmatched_keys = 'IGNORE'
   unmatched_values = False
+  longest_prefix = False
   while TryPop(tokens, WORD, 'WITH'):
     if TryPop(tokens, WORD, 'INSERT'):
       if TryPop(tokens, WORD, 'UNMATCHED'):
@@ -634,11 +704,16 @@ def GetJoin(tokens, line):
       ForcePop(tokens, WORD, 'UNMATCHED')
       ForcePop(tokens, WORD, 'KEYS')
       unmatched_keys = 'RAISE'
+    elif comparator == 'PREFIX' and TryPop(tokens, WORD, 'LONGEST'):
+      ForcePop(tokens, WORD, 'PREFIX')
+      longest_prefix = True
+  if len(left_tables) > 1 and unmatched_keys == 'INCLUDE':
+    FailedPop(tokens, ['Cannot insert missing keys of more than one table'])
   ForcePop(tokens, WORD, 'AS')
   target_table = GetExpression(tokens, UNQUOTED_STRING)
-  return command.Join(line, left_table, right_table, target_table,
-                      left_expr, right_expr, comparator, unmatched_keys,
-                      unmatched_values)
+  return command.Join(line, left_tables, right_table, target_table,
+                      left_exprs, right_exprs, comparator, unmatched_keys,
+                      unmatched_values, longest_prefix)
 
 def GetAppend(tokens, line):
   expr_list = [GetExpression(tokens, {})]
@@ -671,7 +746,15 @@ def GetFilter(tokens, line):
     target = GetExpression(tokens, UNQUOTED_STRING)
   ForcePop(tokens, WORD, 'BY')
   expr = GetExpression(tokens, {})
-  return command.Filter(line, table, target, expr)
+  member = None
+  negated = bool(TryPop(tokens, WORD, 'NOT'))
+  if negated:
+    ForcePop(tokens, WORD, 'IN')
+  if negated or TryPop(tokens, WORD, 'IN'):
+    member_table = GetExpression(tokens, UNQUOTED_STRING)
+    ForcePop(tokens, SYMBOL, '.')
+    member = (member_table, GetExpression(tokens, UNQUOTED_STRING))
+  return command.Filter(line, table, target, expr, member, negated)
 
 def GetEmpty(tokens, line):
   ForcePop(tokens, WORD, 'AS')
@@ -730,6 +813,8 @@ def GetOutput(tokens, line):
   return command.Output(line, tables)
 
 def GetList(tokens, line):
+  if TryPop(tokens, WORD, 'MEMOS'):
+    return command.ListMemos(line)
   ForcePop(tokens, WORD, 'TABLES')
   return command.List(line)
 
@@ -865,24 +950,58 @@ def GetCommand(tokens):
 # quoted_or_var = quoted | variable
 # word_or_var = word | variable
 
+####### Filters
+# filter = FILTER word_or_var [TO word_or_var] BY expression
+#              [[NOT] IN word_or_var.word_or_var]
+# Keeps the rows for which the expression is true. With IN, keeps the rows
+# for which the value of the expression is (or, with NOT IN, isn't) one of the
+# values in the column of the other table.
+
 ####### Aggregations.
-# aggregate = AGGREGATE word_or_variable [TO word_or_variable]
-#     BY column_list WITH expr_list
-# column_list = {empty} | var_or_word | var_or_word, column_list
+# aggregate = AGGREGATE word_or_variable grouping_sets WITH expr_list
+# grouping_sets = grouping_set | grouping_set AND grouping_set_to
+# grouping_set = [TO word_or_variable] [BY column_list]
+#     | [TO table_list] BY ROLLUP column_list
+# grouping_set_to = TO word_or_variable [BY column_list]
+#     | TO table_list BY ROLLUP column_list
+# table_list = word_or_variable | word_or_variable, table_list
+# column_list = var_or_word | var_or_word, column_list
 # The column list is the "group by" clause.
 # The expressions can also include aggregate functions.
+# Every grouping set (each with its own target table) groups the rows of the
+# same source table by its own column list, in a single pass; only the first
+# one can leave out TO, to replace the source table. In the groups of one
+# grouping set, the columns of the other grouping sets' keys are empty.
+# With ROLLUP, the first table of the list is grouped by the whole column
+# list, and every next one by one column fewer; there can be at most one
+# more table than columns. ROLLUP is only a keyword when a column list
+# follows it, so BY ROLLUP alone (or BY ROLLUP, ...) groups by a column named
+# ROLLUP; with more than one table, ROLLUP is required, and a column named
+# ROLLUP is listed after it (BY ROLLUP ROLLUP, ...).
 
 ####### Joins
-# join = JOIN word_or_var INTO word_or_var ON expression comparator expression 
+# join = JOIN table_list INTO word_or_var ON expression_list comparator
+#            expression_list
 #            [WITH INSERT MISSING KEYS]
 #            [WITH INSERT UNMATCHED VALUES]
 #            [WITH RAISE UNMATCHED KEYS]
+#            [WITH LONGEST PREFIX]
 #            AS word_or_var
 # comparator = EQ | PREFIX
+# table_list = word_or_var | word_or_var AND table_list
 #
 # The assumption here is that every item in the right table has exactly
 # one match (equality or prefix) in the left table. Or, in other words,
 # the left table is the lookup source, and the right table does the lookups.
+# With more than one expression on each side (EQ only), the rows match if all
+# the pairs of the expressions are equal.
+# With more than one left table (a star join), every one of them is the
+# lookup source for the right table: the left expressions are evaluated in
+# each of them, every right row is matched in all of them in a single pass,
+# and the joined rows have the columns of all the left tables (in order), and
+# then the right one. It's the same as joining every left table into the
+# right one by itself (with the same options, except that WITH INSERT MISSING
+# KEYS isn't allowed), without the intermediate tables.
 # WITH INSERT MISSING KEYS means that any key that doesn't get matched to some
 #  value will be inserted, with empty strings as the values for all columns
 #  from the right table.
@@ -891,6 +1010,10 @@ def GetCommand(tokens):
 #  table.
 # WITH RAISE UNMATCHED KEYS means that an exception will be raised if any key
 #  is not matched at least ones.
+# WITH LONGEST PREFIX (for PREFIX only) means that a value with more than one
+#  matching key is matched to the longest one, instead of raising an exception.
+#  The keys are looked up by their lengths, so the cost of matching a value
+#  depends on the number of distinct key lengths, not on the length of the value.
 
 ##### Append row
 # append = APPEND expression_list TO word_or_var
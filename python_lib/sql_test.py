@@ -1,6 +1,7 @@
 import unittest
 import os
 
+import command
 import sql
 import tokenizer
 
@@ -51,6 +52,26 @@ class TestTokenize(unittest.TestCase):
     self.assertEqual(['A$word', '=$symbol', '4$number'],
                      fullTokens('A = 4'))
 
+  def test_positions(self):
+    tokens = list(tokenizer.tokenize(['', 'ab + "cd" $e 1.5']))
+    self.assertEqual([(1, 0, 2), (1, 3, 4), (1, 5, 9), (1, 10, 12),
+                      (1, 13, 16)],
+                     [(t.line, t.start, t.end) for t in tokens])
+
+  def test_unclosed_quote(self):
+    self.assertRaises(ValueError, tokenizer.tokenize, ['a "bc'])
+
+  def test_stream_cursor(self):
+    tokens = tokenizer.tokenize(['a b c'])
+    self.assertEqual(3, len(tokens))
+    self.assertEqual('a', tokens.Pop().value)
+    self.assertEqual('b', tokens.Peek().value)
+    self.assertEqual(['b', 'c'], [t.value for t in tokens])
+    tokens.Pop()
+    tokens.Pop()
+    self.assertFalse(tokens)
+    self.assertIsNone(tokens.Peek())
+
 def evaluate(s, c={}):
   context = {'__data': []}
   for x in c:
@@ -131,14 +152,17 @@ class TempFile(object):
   def __exit__(self, *args):
     os.remove(self.path)
 
-def ExecAndRead(lines, path, params={}):
-  command = sql.GetCommandList(lines)
-  command.Eval({}, params)
+def ReadAndRemove(path):
   with open(path, 'r') as result:
     lines = [l.strip() for l in result.readlines()]
   os.remove(path)
   return lines
 
+def ExecAndRead(lines, path, params={}):
+  command = sql.GetCommandList(lines)
+  command.Eval({}, params)
+  return ReadAndRemove(path)
+
 def SomeContent():
   # To be used only when the actual content is irrelevant.
   return [
@@ -366,6 +390,107 @@ class TestTransform(unittest.TestCase):
     expected = ['A;B', '2;4', '4;6']
     self.assertEqual(expected, Transform(content, command))
 
+class TestPipeline(unittest.TestCase):
+  def Eval(self, lines):
+    tables = {'t': ({'A': 0, 'B': 1}, [[1, 2], [3, 4], [5, 0]])}
+    sql.GetCommandList(lines).Eval(tables, {})
+    return tables
+
+  def test_fused_chain(self):
+    tables = self.Eval(['TRANSFORM t TO u WITH A + B AS S, A AS A;',
+                        'FILTER u TO v BY S > 4;',
+                        'TRANSFORM v TO w WITH S * A AS P;',
+                        'OUTPUT TABLES t, w;'])
+    self.assertEqual({'t', 'w'}, set(tables))
+    self.assertEqual(({'P': 0}, [[21], [25]]), tables['w'])
+    tables = self.Eval(['TRANSFORM t TO u WITH A + B AS S;',
+                        'FILTER u TO v BY S > 4;',
+                        'DROP u;'])
+    self.assertEqual({'t', 'v'}, set(tables))
+    self.assertEqual(({'S': 0}, [[7], [5]]), tables['v'])
+
+  def test_intermediate_read_later(self):
+    tables = self.Eval(['TRANSFORM t TO u WITH A + B AS S;',
+                        'TRANSFORM u TO v WITH S * 2 AS D;',
+                        'DROP t;'])
+    self.assertEqual(({'S': 0}, [[3], [7], [5]]), tables['u'])
+    self.assertEqual(({'D': 0}, [[6], [14], [10]]), tables['v'])
+
+  def test_freed_tables(self):
+    # u is dropped without being read after the AGGREGATE, so its rows are
+    # freed right after it; t is left.
+    tables = {'t': ({'A': 0, 'B': 1}, [[1, 2], [3, 4], [5, 0]])}
+    with self.assertRaisesRegex(ValueError, 'evaluating Q'):
+      sql.GetCommandList(['TRANSFORM t TO u WITH A AS A;',
+                          'AGGREGATE u TO v WITH sum(A) AS S;',
+                          'TRANSFORM v WITH S / 0 AS Q;',
+                          'DROP u;']).Eval(tables, {})
+    self.assertEqual(({'A': 0}, []), tables['u'])
+    self.assertEqual(3, len(tables['t'][1]))
+    self.assertEqual(({'S': 0}, [[9]]), tables['v'])
+    # Without a DROP, the tables read after the sequence are given, and the
+    # rows of the other ones are freed after their last use: u and v, but not
+    # t, which the failing TRANSFORM still reads.
+    commands = ['TRANSFORM t TO u WITH A AS A;',
+                'AGGREGATE u TO v WITH sum(A) AS S;',
+                'TRANSFORM v TO w WITH S AS S;',
+                'TRANSFORM t TO x WITH A / B AS Q;']
+    for kept, freed in [({'w'}, {'u', 'v'}), (None, set())]:
+      tables = {'t': ({'A': 0, 'B': 1}, [[1, 2], [3, 4], [5, 0]])}
+      with self.assertRaisesRegex(ValueError, 'evaluating Q'):
+        sql.GetCommandList(commands).Eval(tables, {}, kept)
+      self.assertEqual(freed, {name for name in tables if not tables[name][1]})
+      self.assertEqual(({'S': 0}, [[9]]), tables['w'])
+
+  def test_filter_in(self):
+    tables = {'t': ({'A': 0, 'B': 1}, [[1, 2], [3, 4], [5, 0]]),
+              'k': ({'K': 0}, [[2], [5], [6]])}
+    sql.GetCommandList(['TRANSFORM t TO u WITH A + 1 AS C, B AS B;',
+                        'FILTER u TO v BY B IN k.K;',
+                        'FILTER u TO w BY C - 1 NOT IN k.K;',
+                        'TRANSFORM v WITH C AS C;',
+                        'DROP u;']).Eval(tables, {})
+    self.assertEqual({'t', 'k', 'v', 'w'}, set(tables))
+    self.assertEqual(({'C': 0}, [[2]]), tables['v'])
+    self.assertEqual(({'C': 0, 'B': 1}, [[2, 2], [4, 4]]), tables['w'])
+
+  def test_error_in_chain(self):
+    with self.assertRaisesRegex(ValueError, 'evaluating Q .* row \[5, 0\]'):
+      self.Eval(['TRANSFORM t TO u WITH A AS A, B AS B;',
+                 'TRANSFORM u TO v WITH A / B AS Q;',
+                 'DROP u;'])
+
+class TestStream(unittest.TestCase):
+  def setUp(self):
+    command.STREAM = True
+
+  def tearDown(self):
+    command.STREAM = False
+
+  def test_streamed_chain(self):
+    lines = ['LOAD t FROM "in";',
+             'TRANSFORM t TO u WITH int(A) + int(B) AS S, A AS A;',
+             'FILTER u BY S > 4;',
+             'DUMP u TO "out";',
+             'DROP t;',
+             'DESCRIBE u;']
+    with TempFile('in', ['A;B', '1;2', '3;4', '5;0']):
+      tables = {}
+      sql.GetCommandList(lines).Eval(tables, {})
+      self.assertEqual(['S;A', '7;3', '5;5'], ReadAndRemove('out'))
+      self.assertEqual({'u': ({'S': 0, 'A': 1}, [[7, '3'], [5, '5']])},
+                       tables)
+
+  def test_error_in_stream(self):
+    # No partially written file is left, and the usual error is raised.
+    lines = ['LOAD t FROM "in";',
+             'TRANSFORM t WITH int(A) / int(B) AS Q;',
+             'DUMP t TO "out";']
+    with TempFile('in', ['A;B', '1;2', '3;4', '5;0']):
+      with self.assertRaisesRegex(ValueError, 'evaluating Q .* row'):
+        sql.GetCommandList(lines).Eval({}, {})
+    self.assertFalse(os.path.exists('out'))
+
 def Aggregate(content, aggregate):
   command = [
       'LOAD table FROM "in";',
@@ -438,6 +563,63 @@ class TestAggregate(unittest.TestCase):
     expected = ['A;B;C', '1;4;6', '2;3;4']
     self.assertEqual(expected, SimpleAggregate(content, groups, exprs))
 
+  def test_aggregation_in_untaken_branch(self):
+    # The aggregation fails for the rows of the group that doesn't use it.
+    content = ['A;B', '1;2', '0;2', '1;3']
+    command = ['LOAD table FROM "in";',
+               'AGGREGATE table BY A WITH A AS A,',
+               '  if(A = "0", 0, sum(int(int(B) * 10 / int(A)))) AS s;',
+               'DUMP table TO "out";']
+    expected = ['A;s', '1;50', '0;0']
+    with TempFile('in', content):
+      self.assertEqual(expected, ExecAndRead(command, 'out'))
+
+  def test_grouping_sets(self):
+    content = ['A;B;C', '1;1;1', '1;2;2', '2;1;3']
+    command = ['LOAD table FROM "in";',
+               'AGGREGATE table TO ab BY A, B AND TO a BY A AND TO total',
+               '  WITH A AS A, B AS B, sum(int(C)) AS C;',
+               'DUMP ab TO "ab";', 'DUMP a TO "a";', 'DUMP total TO "out";']
+    with TempFile('in', content):
+      self.assertEqual(['A;B;C', ';;6'], ExecAndRead(command, 'out'))
+    self.assertEqual(['A;B;C', '1;1;1', '1;2;2', '2;1;3'], ReadAndRemove('ab'))
+    self.assertEqual(['A;B;C', '1;;3', '2;;3'], ReadAndRemove('a'))
+
+  def test_rollup(self):
+    content = ['A;B;C', '1;1;1', '1;2;2', '2;1;3']
+    command = ['LOAD table FROM "in";',
+               'AGGREGATE table TO ab, a BY ROLLUP A, B',
+               '  WITH A AS A, sum(int(C)) AS C, max(B) AS B;',
+               'DUMP a TO "out";']
+    with TempFile('in', content):
+      self.assertEqual(['A;C;B', '1;3;2', '2;3;1'], ExecAndRead(command, 'out'))
+    with self.assertRaises(ValueError):
+      sql.GetCommandList(['AGGREGATE t TO x, y, z BY ROLLUP A WITH 1 AS one;'])
+    # A ROLLUP of a single level groups by all the keys.
+    command[1] = 'AGGREGATE table TO a BY ROLLUP A'
+    with TempFile('in', content):
+      self.assertEqual(['A;C;B', '1;3;2', '2;3;1'], ExecAndRead(command, 'out'))
+    # Without the keys after it, ROLLUP is a column.
+    def GroupLists(lines):
+      aggregate = sql.GetCommandList(lines).seq[0]
+      return [group_list for _, group_list in aggregate.grouping_sets]
+    self.assertEqual([['ROLLUP']],
+                     GroupLists(['AGGREGATE t BY ROLLUP WITH 1 AS one;']))
+    self.assertEqual([['ROLLUP', 'A']],
+                     GroupLists(['AGGREGATE t BY ROLLUP, A WITH 1 AS one;']))
+    self.assertEqual([['A']],
+                     GroupLists(['AGGREGATE t BY ROLLUP A WITH 1 AS one;']))
+    self.assertEqual([['ROLLUP', 'A'], ['ROLLUP']],
+                     GroupLists(['AGGREGATE t TO x, y BY ROLLUP ROLLUP, A',
+                                 '  WITH 1 AS one;']))
+    content = ['ROLLUP;C', '1;1', '1;2', '2;3']
+    command = ['LOAD table FROM "in";',
+               'AGGREGATE table TO a BY ROLLUP',
+               '  WITH ROLLUP AS R, sum(int(C)) AS C;',
+               'DUMP a TO "out";']
+    with TempFile('in', content):
+      self.assertEqual(['R;C', '1;3', '2;3'], ExecAndRead(command, 'out'))
+
 def Join(left_content, right_content, on_clause):
   lines = ['LOAD left FROM "left.csv";',
            'LOAD right FROM "right.csv";',
@@ -475,6 +657,63 @@ class TestJoin(unittest.TestCase):
     on_clause = 'int(S) EQ int(x) + int(y)'
     self.assertEqual(expected, Join(left_content, right_content, on_clause))
 
+  def test_multiple_keys(self):
+    left_content = ['A;B;V', '1;x;one', '1;y;two', '2;x;three']
+    right_content = ['C;D', '1;y', '2;x', '1;x']
+    expected = ['A;B;V;C;D', '1;y;two;1;y', '2;x;three;2;x', '1;x;one;1;x']
+    self.assertEqual(expected, Join(left_content, right_content,
+                                    'A, B EQ C, D'))
+
+  def test_sorted_and_small_tables(self):
+    # Sorted keys are merged, and the keys of a smaller right table are
+    # looked up in the left one, with the same results.
+    left_content = ['K;V', '1;a', '1;b', '3;c', '4;d']
+    options = ' WITH INSERT UNMATCHED VALUES WITH INSERT MISSING KEYS'
+    self.assertEqual(['K;V;R', '1;b;1', ';;2', '3;c;3', '4;d;'],
+                     Join(left_content, ['R', '1', '2', '3'],
+                          'K EQ R' + options))
+    self.assertEqual(['K;V;R', '3;c;3', ';;2', '1;b;1', '4;d;'],
+                     Join(left_content, ['R', '3', '2', '1'],
+                          'K EQ R' + options))
+    self.assertEqual(['K;V;R', '3;c;3', ';;2', '1;b;1'],
+                     Join(left_content, ['R', '3', '2', '1'],
+                          'K EQ R WITH INSERT UNMATCHED VALUES'))
+    for right_content in [['R', '1', '2', '3', '4'], ['R', '2']]:
+      self.assertRaises(ValueError, Join, left_content, right_content,
+                        'K EQ R')
+
+  def test_join_strategies(self):
+    # The way of joining is chosen from the inputs (see Join.PairRows).
+    def Strategy(right_content, on_clause):
+      before = command.JOIN_STRATEGIES.copy()
+      try:
+        res = Join(left_content, right_content, 'K EQ R' + on_clause)
+      except ValueError as e:
+        res = str(e)
+      return list(command.JOIN_STRATEGIES - before), res
+    left_content = ['K;V', '1;a', '1;b', '3;c', '4;d']
+    # A right table smaller than the left one.
+    self.assertEqual((['probe'], ['K;V;R', '3;c;3', '1;b;1']),
+                     Strategy(['R', '3', '1'], ''))
+    self.assertEqual((['probe'], ['K;V;R', '3;c;3', '4;d;4', '1;b;1']),
+                     Strategy(['R', '3', '4', '1'],
+                              ' WITH RAISE UNMATCHED KEYS'))
+    strategy, error = Strategy(['R', '3', '1'], ' WITH RAISE UNMATCHED KEYS')
+    self.assertEqual(['probe'], strategy)
+    self.assertIn('Key 4 from left not matched', error)
+    # All the left rows are needed for the missing keys.
+    self.assertEqual((['hash'], ['K;V;R', '3;c;3', '1;b;1', '4;d;']),
+                     Strategy(['R', '3', '1'], ' WITH INSERT MISSING KEYS'))
+    # Sorted keys.
+    self.assertEqual((['merge'], ['K;V;R', '1;b;1', ';;2', '3;c;3', '4;d;4',
+                                  ';;5']),
+                     Strategy(['R', '1', '2', '3', '4', '5'],
+                              ' WITH INSERT UNMATCHED VALUES'))
+    self.assertEqual((['hash'], ['K;V;R', ';;5', '4;d;4', '3;c;3', ';;2',
+                                 '1;b;1']),
+                     Strategy(['R', '5', '4', '3', '2', '1'],
+                              ' WITH INSERT UNMATCHED VALUES'))
+
   def test_prefix_match(self):
     left_content = ['Prefix', 'A', 'BABA', 'ZE']
     right_content = ['Word', 'A', 'AA', 'ZERO']
@@ -482,6 +721,16 @@ class TestJoin(unittest.TestCase):
     on_clause = 'Prefix PREFIX Word'
     self.assertEqual(expected, Join(left_content, right_content, on_clause))
 
+  def test_longest_prefix_match(self):
+    left_content = ['Prefix', 'A', 'AB', 'ABCD', 'Z']
+    right_content = ['Word', 'ABC', 'ABCDE', 'A', 'X']
+    on_clause = 'Prefix PREFIX Word'
+    self.assertRaises(ValueError, Join, left_content, right_content, on_clause)
+    expected = ['Prefix;Word', 'AB;ABC', 'ABCD;ABCDE', 'A;A', ';X']
+    on_clause = ('Prefix PREFIX Word WITH LONGEST PREFIX '
+                 'WITH INSERT UNMATCHED VALUES')
+    self.assertEqual(expected, Join(left_content, right_content, on_clause))
+
   def test_without_insert_unmatched_values(self):
     left_content = ['A', '1', '2']
     right_content = ['B', '1', '3']
@@ -515,6 +764,26 @@ class TestJoin(unittest.TestCase):
     on_clause = 'A EQ B WITH RAISE UNMATCHED KEYS'
     self.assertRaises(ValueError, Join, left_content, right_content, on_clause)
 
+  def test_star_join(self):
+    def StarJoin(options):
+      tables = {'a': ({'K': 0, 'A': 1}, [['1', 'a1'], ['2', 'a2']]),
+                'b': ({'K': 0, 'B': 1}, [['3', 'b3'], ['2', 'b2']]),
+                'c': ({'K': 0, 'C': 1}, [['1', 'c1'], ['2', 'c2']])}
+      sql.GetCommandList(['JOIN a AND b INTO c ON K EQ K ' + options +
+                          ' AS j;']).Eval(tables, {})
+      return tables['j']
+    self.assertEqual(({'K': 4, 'A': 1, 'B': 3, 'C': 5},
+                      [['1', 'a1', '', '', '1', 'c1'],
+                       ['2', 'a2', '2', 'b2', '2', 'c2']]),
+                     StarJoin('WITH INSERT UNMATCHED VALUES'))
+    self.assertRaisesRegex(ValueError, 'Failed to find key 1 in table b',
+                           StarJoin, '')
+    self.assertRaisesRegex(ValueError, 'Key 3 from b not matched',
+                           StarJoin, 'WITH INSERT UNMATCHED VALUES '
+                           'WITH RAISE UNMATCHED KEYS')
+    self.assertRaisesRegex(ValueError, 'more than one table', StarJoin,
+                           'WITH INSERT MISSING KEYS')
+
   def test_join_single_row(self):
     left_content = ['A;B', '1;2']
     right_content = ['C;D', '3;4', '5;6']
@@ -0,0 +1,12 @@
+import unittest
+
+import benchmark
+
+class TestStartup(unittest.TestCase):
+  def test_no_imaging_modules(self):
+    _, loaded = benchmark.ImportTime(benchmark.STARTUP_MODULES)
+    for module in benchmark.IMAGING_MODULES:
+      self.assertNotIn(module, loaded)
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,76 @@
+# The tables stored by the commands (see context.md).
+#
+# A table is a pair of the header, mapping the names of the columns to their
+# (0-indexed) positions, and the rows. The Table keeps the header as a Header,
+# which has the map from the positions back to the names, and remembers
+# whether all the rows have the length of the header, so that the commands
+# reading it don't check the length of every row. A Table unpacks, indexes
+# and compares like a (header, rows) tuple, and the commands read tuples
+# too (like the ones given to api.py).
+
+import view
+
+# A header that can't be modified, with the map from the positions of the
+# columns to their names.
+class Header(dict):
+  __slots__ = ('names',)
+
+  def __init__(self, columns=()):
+    super().__init__(columns)
+    self.names = {index: name for name, index in self.items()}
+
+  def Immutable(self, *args, **kwargs):
+    raise TypeError('The header of a table cannot be modified')
+
+  __setitem__ = __delitem__ = Immutable
+  clear = pop = popitem = setdefault = update = Immutable
+
+class Table:
+  __slots__ = ('header', 'rows', 'uniform')
+
+  # Pass uniform if it's known whether all the rows have the length of the
+  # header (like for the rows computed by TRANSFORM), instead of checking.
+  def __init__(self, header, rows, uniform=None):
+    self.header = header if isinstance(header, Header) else Header(header)
+    self.rows = rows
+    if uniform is None:
+      uniform = view.Widths(rows) <= {len(header)}
+    self.uniform = uniform
+
+  def __iter__(self):
+    return iter((self.header, self.rows))
+
+  def __len__(self):
+    return 2
+
+  def __getitem__(self, index):
+    return (self.header, self.rows)[index]
+
+  def __eq__(self, other):
+    if not isinstance(other, (Table, tuple)):
+      return NotImplemented
+    return tuple(self) == tuple(other)
+
+  __hash__ = None
+
+  def __repr__(self):
+    return repr(tuple(self))
+
+# The map from the positions of the columns of the header to their names.
+def Names(header):
+  if isinstance(header, Header):
+    return header.names
+  return {index: name for name, index in header.items()}
+
+# Whether all the rows of the table have the length of its header.
+def Uniform(table):
+  if isinstance(table, Table):
+    return table.uniform
+  header, rows = table
+  return view.Widths(rows) <= {len(header)}
+
+# The table with the rows, which have the same columns as the rows of the
+# table (like the rows that pass a FILTER).
+def WithRows(table, rows):
+  header, _ = table
+  return Table(header, rows, Uniform(table))
@@ -0,0 +1,51 @@
+import unittest
+
+import sql
+import tabular
+import view
+
+def evaluate(commands, tables):
+  sql.GetCommandList(commands).Eval(tables, {})
+  return tables
+
+class TestTabular(unittest.TestCase):
+  def test_header(self):
+    header = tabular.Header({'a': 0, 'b': 1})
+    self.assertEqual({'a': 0, 'b': 1}, header)
+    self.assertEqual({0: 'a', 1: 'b'}, tabular.Names(header))
+    self.assertEqual({0: 'a'}, tabular.Names({'a': 0}))
+    with self.assertRaises(TypeError):
+      header['c'] = 2
+    with self.assertRaises(TypeError):
+      header.update({'c': 2})
+
+  def test_table(self):
+    table = tabular.Table({'a': 0}, [['1'], ['2']])
+    header, rows = table
+    self.assertEqual(({'a': 0}, [['1'], ['2']]), table)
+    self.assertEqual([['1'], ['2']], table[1])
+    self.assertIsInstance(header, tabular.Header)
+    self.assertTrue(table.uniform)
+    self.assertFalse(tabular.Table({'a': 0}, [['1', '2']]).uniform)
+    self.assertFalse(tabular.Uniform(({'a': 0}, [[]])))
+    self.assertTrue(tabular.Uniform(
+        ({'a': 0, 'b': 1}, view.Projection([['1', '2', '3']], [2, 0]))))
+
+  def test_commands(self):
+    tables = evaluate(['TRANSFORM t TO u WITH name(2) AS n, b AS b;',
+                       'FILTER u BY b = "2";'],
+                      {'t': ({'a': 0, 'b': 1}, [['1', '2'], ['3', '4']])})
+    self.assertIsInstance(tables['u'], tabular.Table)
+    self.assertTrue(tables['u'].uniform)
+    self.assertEqual(({'n': 0, 'b': 1}, [['b', '2']]), tables['u'])
+
+  def test_row_length(self):
+    # The rows that don't have the length of the header still fail.
+    for command in ['FILTER t BY a = "1";', 'TRANSFORM t WITH a AS a;',
+                    'TRANSFORM t WITH a + "x" AS a;']:
+      with self.assertRaisesRegex(ValueError, 'has length 1, expected 2'):
+        evaluate([command],
+                 {'t': ({'a': 0, 'b': 1}, [['1', '2'], ['3']])})
+
+if __name__ == '__main__':
+  unittest.main()
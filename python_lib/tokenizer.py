@@ -1,67 +1,64 @@
 # This is the tokenizer for sql.py
+import re
+
 from tokens import *
 
-# Note to self: There's a lot of quadratic line parsing here. I've initially
-# not passed curpos around, just used s truncating. However, I've added
-# curpos for debugging reasons. So, now, the code could be changed not to
-# modify s, just to modify curpos and operate on the immutable line.
+# The tokenizer makes a single pass over each line. The line itself is never
+# modified; each consume function takes the current position, and returns
+# the position after the consumed token (or the same position, if the token
+# type didn't match).
+
+# Python's \w is exactly "isalnum() or underscore", which is what we accept
+# inside words and variable names.
+WORD_TAIL = re.compile(r'\w*')
 
 def consumeWord(s, tokenList, line, curpos):
-  pos = 0
-  if s and s[0].isalpha():
-    while pos < len(s) and (s[pos].isalnum() or s[pos] == '_'):
-      pos += 1
-    tokenList.append(Token(s[:pos], WORD, line, curpos, curpos + pos))
-    s = s[pos:]
-  return curpos + pos, s
+  if curpos < len(s) and s[curpos].isalpha():
+    pos = WORD_TAIL.match(s, curpos + 1).end()
+    tokenList.append(Token(s[curpos:pos], WORD, line, curpos, pos))
+    return pos
+  return curpos
 
 def consumeQuotedWord(s, tokenList, line, curpos):
-  if s and (s[0] == '"' or s[0] == '\''):
-    quote = s[0]
-    endpos = 1
-    if len(s) == 1:
+  if curpos < len(s) and (s[curpos] == '"' or s[curpos] == '\''):
+    quote = s[curpos]
+    if curpos + 1 == len(s):
       raise ValueError('Unclosed quote at the end of the line ' + str(line))
-    while s[endpos] != quote:
-      endpos += 1
-      if endpos >= len(s):
-        raise ValueError('Unclosed quote: ' + s + ' in line ' + str(line))
+    endpos = s.find(quote, curpos + 1)
+    if endpos == -1:
+      raise ValueError(
+          'Unclosed quote: ' + s[curpos:] + ' in line ' + str(line))
     tokenList.append(
-        Token(s[1:endpos], QUOTED, line, curpos, curpos+endpos+1))
-    s = s[endpos+1:]
-    return curpos + endpos + 1, s
-  return curpos, s
+        Token(s[curpos+1:endpos], QUOTED, line, curpos, endpos + 1))
+    return endpos + 1
+  return curpos
 
 def consumeVariable(s, tokenList, line, curpos):
-  if s and s[0] == '$':
-    pos = 1
-    while pos < len(s) and (s[pos].isalnum() or s[pos] == "_"):
-      pos += 1
-    tokenList.append(Token(s[1:pos], PARAM, line, curpos, curpos+pos))
-    s = s[pos:]
-    return curpos + pos, s
-  return curpos, s
+  if curpos < len(s) and s[curpos] == '$':
+    pos = WORD_TAIL.match(s, curpos + 1).end()
+    tokenList.append(Token(s[curpos+1:pos], PARAM, line, curpos, pos))
+    return pos
+  return curpos
 
 def consumeSpace(s, tokenList, line, curpos):
-  if s and s[0].isspace():
-    s = s[1:]
-    return curpos + 1, s
-  return curpos, s
+  if curpos < len(s) and s[curpos].isspace():
+    return curpos + 1
+  return curpos
 
 def consumeNumber(s, tokenList, line, curpos):
-  pos = 0
-  if s and s[0].isnumeric():
+  if curpos < len(s) and s[curpos].isnumeric():
+    pos = curpos + 1
     while pos < len(s) and (s[pos].isnumeric() or s[pos] == '.'):
       pos += 1
-    tokenList.append(Token(s[:pos], NUMBER, line, curpos, curpos+pos))
-    s = s[pos:]
-  return curpos + pos, s
+    tokenList.append(Token(s[curpos:pos], NUMBER, line, curpos, pos))
+    return pos
+  return curpos
 
 def consumeSymbol(s, tokenList, line, curpos):
-  if s and s[0] in '+-=*/,();:<>[]':
-    tokenList.append(Token(s[0], SYMBOL, line, curpos, curpos+1))
-    s = s[1:]
-    return curpos + 1, s
-  return curpos, s
+  if curpos < len(s) and s[curpos] in '+-=*/,();:<>[].':
+    tokenList.append(Token(s[curpos], SYMBOL, line, curpos, curpos+1))
+    return curpos + 1
+  return curpos
 
 def tokenize(lines):
   res = []
@@ -69,16 +66,16 @@ def tokenize(lines):
     if not s.strip() or s.strip()[0] == '#':
       continue
     curbeg = 0
-    while s:
-      curlen = len(s)
-      curbeg, s = consumeWord(s, res, l, curbeg)
-      curbeg, s = consumeQuotedWord(s, res, l, curbeg)
-      curbeg, s = consumeVariable(s, res, l, curbeg)
-      curbeg, s = consumeSpace(s, res, l, curbeg)
-      curbeg, s = consumeNumber(s, res, l, curbeg)
-      curbeg, s = consumeSymbol(s, res, l, curbeg)
-      if len(s) == curlen:
+    while curbeg < len(s):
+      start = curbeg
+      curbeg = consumeWord(s, res, l, curbeg)
+      curbeg = consumeQuotedWord(s, res, l, curbeg)
+      curbeg = consumeVariable(s, res, l, curbeg)
+      curbeg = consumeSpace(s, res, l, curbeg)
+      curbeg = consumeNumber(s, res, l, curbeg)
+      curbeg = consumeSymbol(s, res, l, curbeg)
+      if curbeg == start:
         raise ValueError(
             'Failed to consume a token on line', l, 'position', curbeg,
-            ' - remaining string', s)
-  return res
+            ' - remaining string', s[curbeg:])
+  return TokenStream(res)
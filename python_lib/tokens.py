@@ -22,3 +22,32 @@ PARAM = 'variable'
 def Symbol(val):
   return Token(val, SYMBOL)
 
+
+# The token list produced by the tokenizer, with a cursor marking the first
+# token that wasn't consumed yet. Consuming a token just moves the cursor, so
+# the parser doesn't pay for shifting the remainder of the list on every pop.
+class TokenStream:
+  def __init__(self, tokens):
+    self.tokens = tokens
+    self.pos = 0
+
+  def __bool__(self):
+    return self.pos < len(self.tokens)
+
+  def __len__(self):
+    return len(self.tokens) - self.pos
+
+  def __iter__(self):
+    return iter(self.tokens[self.pos:])
+
+  # Returns the first unconsumed token (or the one `ahead` tokens after it),
+  # or None if there are none left.
+  def Peek(self, ahead=0):
+    if self.pos + ahead < len(self.tokens):
+      return self.tokens[self.pos + ahead]
+    return None
+
+  def Pop(self):
+    token = self.tokens[self.pos]
+    self.pos += 1
+    return token
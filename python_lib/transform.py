@@ -2,18 +2,19 @@
 
 import sys
 
+import plancache
 import sql
 
 assert len(sys.argv) % 2 == 0
 with open(sys.argv[1], 'r') as configfile:
   print('Parsing command file: ', sys.argv[1])
-  comm = sql.GetCommandList(configfile.readlines())
+  comm = plancache.Parse(configfile.readlines(), sql.GetCommandList)
 print('Parsed successfully, running')
 print()
 params = {}
 for i in range(2, len(sys.argv), 2):
   params[sys.argv[i]] = sys.argv[i+1]
-comm.Eval({}, params)
+comm.Eval({}, params, set())
 print()
 print('Run ended with success')
 
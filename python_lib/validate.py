@@ -4,6 +4,7 @@ import random
 import sys
 
 import sql
+import tabular
 
 def printhelp(exitcode):
   print('Usage:')
@@ -53,9 +54,7 @@ validator.Eval(context, params)
 assert 'v_table' in context
 
 header, rows = context['v_table']
-reverse_header = {}
-for title in header:
-  reverse_header[header[title]] = title
+reverse_header = tabular.Names(header)
 
 # Check the validity of the result.
 incorrect_rows = []
@@ -103,9 +102,7 @@ def PrintFailure(failure):
 
 def PrintRow(index):
   header, rows = context['table']
-  reverse_header = {}
-  for title in header:
-    reverse_header[header[title]] = title
+  reverse_header = tabular.Names(header)
   for column in range(len(rows[index])):
     print('[{}] {}: {}'.format(
         column + 1, reverse_header[column], rows[index][column]))
@@ -0,0 +1,134 @@
+# Tables whose rows are computed from the rows of other tables when they're
+# read, instead of being stored (see context.md).
+#
+# A view is a sequence of rows, so the commands can read it like a list: every
+# row is a new list, built when it's read. The commands that can, read the
+# columns they need (Column), or select rows (Select), without building the
+# rows at all. APPEND, and the api, turn views into lists (see Rows).
+
+import collections.abc
+import itertools
+import operator
+
+class View(collections.abc.Sequence):
+  def __getitem__(self, index):
+    if isinstance(index, slice):
+      return [self.Row(i) for i in range(len(self))[index]]
+    if index < 0:
+      index += len(self)
+    if not 0 <= index < len(self):
+      raise IndexError('row index {} out of range'.format(index))
+    return self.Row(index)
+
+  def __eq__(self, other):
+    if not isinstance(other, collections.abc.Sequence):
+      return NotImplemented
+    return list(self) == list(other)
+
+  def __repr__(self):
+    return repr(list(self))
+
+# The rows with the given (0-indexed) columns of the rows of another table. The
+# rows appended to the other table later aren't in the view.
+class Projection(View):
+  def __init__(self, rows, columns):
+    if isinstance(rows, Projection):
+      columns = [rows.columns[column] for column in columns]
+      rows = rows.Base()
+    self.rows = rows
+    self.count = len(rows)
+    self.columns = list(columns)
+
+  # The rows of the other table.
+  def Base(self):
+    if len(self.rows) == self.count:
+      return self.rows
+    return self.rows[:self.count]
+
+  def __len__(self):
+    return self.count
+
+  def __iter__(self):
+    rows = itertools.islice(self.rows, self.count)
+    if len(self.columns) == 1:
+      column = self.columns[0]
+      return ([row[column]] for row in rows)
+    if not self.columns:
+      return ([] for _ in rows)
+    get = operator.itemgetter(*self.columns)
+    return (list(get(row)) for row in rows)
+
+  def Row(self, index):
+    row = self.rows[index]
+    return [row[column] for column in self.columns]
+
+  def Widths(self):
+    return {len(self.columns)} if self.count else set()
+
+  def Column(self, index):
+    if isinstance(self.rows, View):
+      return self.rows.Column(self.columns[index])
+    column = self.columns[index]
+    return [row[column] for row in itertools.islice(self.rows, self.count)]
+
+  def Select(self, indices):
+    if isinstance(self.rows, View):
+      return Projection(self.rows.Select(indices), self.columns)
+    return Projection([self.rows[i] for i in indices], self.columns)
+
+# The rows of a JOIN: the pairs (or, for more than two tables, the tuples) of
+# the rows of the tables, concatenated when they're read.
+class Joined(View):
+  def __init__(self, pairs):
+    self.pairs = pairs
+
+  def __len__(self):
+    return len(self.pairs)
+
+  def __iter__(self):
+    if self.pairs and len(self.pairs[0]) > 2:
+      return map(Concatenated, self.pairs)
+    return (left + right for left, right in self.pairs)
+
+  def Row(self, index):
+    return Concatenated(self.pairs[index])
+
+  def Widths(self):
+    return {sum(map(len, rows)) for rows in self.pairs}
+
+  def Column(self, index):
+    if self.pairs and len(self.pairs[0]) > 2:
+      return [Concatenated(rows)[index] for rows in self.pairs]
+    return [left[index] if index < len(left) else right[index - len(left)]
+            for left, right in self.pairs]
+
+  def Select(self, indices):
+    return Joined([self.pairs[i] for i in indices])
+
+# The concatenation of the rows.
+def Concatenated(rows):
+  if len(rows) == 2:
+    return rows[0] + rows[1]
+  return [value for row in rows for value in row]
+
+# The values of the (0-indexed) column of the rows.
+def Column(rows, index):
+  if isinstance(rows, View):
+    return rows.Column(index)
+  return [row[index] for row in rows]
+
+# The set of the lengths of the rows.
+def Widths(rows):
+  if isinstance(rows, View):
+    return rows.Widths()
+  return set(map(len, rows))
+
+# The rows for which the value in selected is true.
+def Selected(rows, selected):
+  if isinstance(rows, View):
+    return rows.Select([i for i, val in enumerate(selected) if val])
+  return [row for row, val in zip(rows, selected) if val]
+
+# The rows, as a list.
+def Rows(rows):
+  return list(rows) if isinstance(rows, View) else rows
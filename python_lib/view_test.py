@@ -0,0 +1,72 @@
+import unittest
+
+import columnar
+import sql
+import view
+
+LEFT = [['1', 'a'], ['2', 'b']]
+RIGHT = [['x', '1'], ['y', '2'], ['z', '1']]
+
+def evaluate(commands, tables):
+  sql.GetCommandList(commands).Eval(tables, {})
+  return tables
+
+class TestView(unittest.TestCase):
+  def test_projection(self):
+    rows = [list(row) for row in RIGHT]
+    projection = view.Projection(rows, [1, 0, 1])
+    rows.append(['w', '3'])
+    self.assertEqual([['1', 'x', '1'], ['2', 'y', '2'], ['1', 'z', '1']],
+                     list(projection))
+    self.assertEqual(['2', 'y', '2'], projection[-2])
+    self.assertEqual(['x', 'y', 'z'], view.Column(projection, 1))
+    # Projections of projections read the rows of the first table.
+    twice = view.Projection(projection, [1])
+    self.assertIs(rows[0], twice.rows[0])
+    self.assertEqual([['y']], twice.Select([1]))
+
+  def test_joined(self):
+    joined = view.Joined([(LEFT[0], RIGHT[0]), (['', ''], RIGHT[1]),
+                          (LEFT[0], RIGHT[2])])
+    self.assertEqual(3, len(joined))
+    self.assertEqual(['', '', 'y', '2'], joined[1])
+    self.assertEqual(['1', '', '1'], view.Column(joined, 0))
+    self.assertEqual({4}, view.Widths(joined))
+    self.assertEqual([['1', 'a', 'z', '1']],
+                     view.Selected(joined, [False, False, True]))
+    # The rows of more than two tables.
+    joined = view.Joined([(LEFT[0], RIGHT[0], ['p']), (LEFT[1], RIGHT[1], [])])
+    self.assertEqual([['1', 'a', 'x', '1', 'p'], ['2', 'b', 'y', '2']],
+                     list(joined))
+    self.assertEqual(['x', 'y'], view.Column(joined, 2))
+    self.assertEqual({4, 5}, view.Widths(joined))
+
+  def test_commands(self):
+    tables = evaluate(['JOIN l INTO r ON at(1) EQ at(2) AS j;',
+                       'TRANSFORM j TO p WITH at(3) AS v, at(2) AS n;'],
+                      {'l': ({'k': 0, 'n': 1}, LEFT),
+                       'r': ({'v': 0, 'k2': 1}, RIGHT)})
+    self.assertIsInstance(tables['j'][1], view.Joined)
+    self.assertIsInstance(tables['p'][1], view.Projection)
+    evaluate(['FILTER p BY v > "x";'], tables)
+    self.assertEqual([['y', 'b'], ['z', 'a']], tables['p'][1])
+    # APPEND stores the rows.
+    evaluate(['APPEND "v", "c" TO p;'], tables)
+    self.assertEqual([['y', 'b'], ['z', 'a'], ['v', 'c']], tables['p'][1])
+    self.assertIsInstance(tables['p'][1], list)
+
+  def test_columnar(self):
+    min_rows = columnar.MIN_ROWS
+    columnar.MIN_ROWS = 1
+    try:
+      tables = evaluate(['JOIN l INTO r ON k EQ k2 AS j;',
+                         'FILTER j BY k = "1";',
+                         'TRANSFORM j WITH v + n AS vn;'],
+                        {'l': ({'k': 0, 'n': 1}, LEFT),
+                         'r': ({'v': 0, 'k2': 1}, RIGHT)})
+    finally:
+      columnar.MIN_ROWS = min_rows
+    self.assertEqual(({'vn': 0}, [['xa'], ['za']]), tables['j'])
+
+if __name__ == '__main__':
+  unittest.main()